@@ -0,0 +1,154 @@
+"""
+Background job handlers for AI-heavy batch generation.
+
+Handlers run on the shared job runner and call the LLM with background=True, so
+they only use concurrency left over by interactive chat traffic.
+"""
+from typing import List, Optional, Tuple
+import json
+import logging
+
+import llm
+from catalog import load_taxonomy
+from database import quiz_drafts_collection, topic_summaries_collection
+from jobs import JobContext, JobParamsInvalid, job_runner
+from models import DifficultyLevel, Job, QuizDraft, QuizQuestion
+from summaries import SUMMARY_MODEL_VERSION, SummaryKey, generate_summary, is_fresh
+
+logger = logging.getLogger(__name__)
+
+MAX_QUIZ_DRAFT_QUESTIONS = 20
+
+QUIZ_DRAFT_SYSTEM_MESSAGE = (
+    "You write multiple-choice quiz questions for Indian school students. Reply with only a JSON "
+    "array; each item has 'question', 'options' (exactly 4 strings), 'correct_answer' (index 0-3) "
+    "and 'explanation'."
+)
+
+def parse_quiz_questions(text: str) -> List[QuizQuestion]:
+    """Extract and validate the JSON array of questions from a model reply"""
+    start, end = text.find("["), text.rfind("]")
+    if start == -1 or end <= start:
+        raise ValueError("No JSON array in model reply")
+
+    questions = []
+    for item in json.loads(text[start:end + 1]):
+        question = QuizQuestion(**item)
+        if len(question.options) == 4 and 0 <= question.correct_answer < 4:
+            questions.append(question)
+    if not questions:
+        raise ValueError("Model reply contained no usable questions")
+    return questions
+
+def taxonomy_filters(params: dict) -> Tuple[Optional[str], Optional[int], Optional[str], Optional[str]]:
+    """(stream, class_level, subject, topic) filters from job params"""
+    for field in ("stream", "subject", "topic"):
+        if params.get(field) is not None and not isinstance(params[field], str):
+            raise JobParamsInvalid(f"{field} must be a string")
+    class_level = params.get("class_level")
+    if class_level is not None and (isinstance(class_level, bool) or not isinstance(class_level, int)):
+        raise JobParamsInvalid("class_level must be an integer")
+    return params.get("stream"), class_level, params.get("subject"), params.get("topic")
+
+def quiz_draft_settings(params: dict) -> Tuple[int, DifficultyLevel]:
+    """(questions per quiz, difficulty) from quiz_drafts job params"""
+    try:
+        question_count = int(params.get("questions", 5))
+    except (TypeError, ValueError):
+        raise JobParamsInvalid("questions must be an integer")
+    if not 1 <= question_count <= MAX_QUIZ_DRAFT_QUESTIONS:
+        raise JobParamsInvalid(f"questions must be between 1 and {MAX_QUIZ_DRAFT_QUESTIONS}")
+    try:
+        difficulty = DifficultyLevel(params.get("difficulty", DifficultyLevel.BEGINNER))
+    except ValueError:
+        raise JobParamsInvalid(f"difficulty must be one of {[level.value for level in DifficultyLevel]}")
+    return question_count, difficulty
+
+def validate_quiz_draft_params(params: dict):
+    taxonomy_filters(params)
+    quiz_draft_settings(params)
+
+def validate_summary_warmup_params(params: dict):
+    taxonomy_filters(params)
+    if not isinstance(params.get("force", False), bool):
+        raise JobParamsInvalid("force must be true or false")
+
+@job_runner.register("quiz_drafts", validate=validate_quiz_draft_params)
+async def generate_quiz_drafts(job: Job, ctx: JobContext) -> dict:
+    """Draft a quiz for every matching taxonomy entry, for teachers to review
+
+    params: stream, class_level, subject, topic (all optional filters),
+    questions (per quiz, default 5), difficulty (default beginner).
+    Drafts already written by an earlier attempt of this job are kept.
+    """
+    question_count, difficulty = quiz_draft_settings(job.params)
+    entries = await load_taxonomy(*taxonomy_filters(job.params))
+
+    done = set()
+    async for doc in quiz_drafts_collection.find({"job_id": job.id}, {"_id": 0, "stream": 1, "class_level": 1, "subject": 1, "topic": 1}):
+        done.add((doc["stream"], doc["class_level"], doc["subject"], doc["topic"]))
+
+    created, failed = 0, []
+    for index, entry in enumerate(entries):
+        key = (entry["stream"], entry["class_level"], entry["subject"], entry["topic"])
+        if key not in done:
+            prompt = (
+                f"Write {question_count} {difficulty.value} questions on '{entry['topic']}' "
+                f"({entry['subject']}, {entry['stream']} class {entry['class_level']})."
+            )
+            try:
+                reply = await llm.generate(f"job-{job.id}-{index}", QUIZ_DRAFT_SYSTEM_MESSAGE, prompt, background=True)
+                draft = QuizDraft(
+                    title=f"{entry['topic']} practice quiz",
+                    difficulty=difficulty,
+                    questions=parse_quiz_questions(reply),
+                    job_id=job.id,
+                    **entry
+                )
+                await quiz_drafts_collection.insert_one(draft.dict())
+                created += 1
+            except Exception as e:
+                logger.warning(f"Quiz draft failed for {key}: {str(e)}")
+                failed.append(" / ".join(str(part) for part in key))
+
+        await ctx.report((index + 1) * 100 / len(entries), f"{index + 1}/{len(entries)} topics")
+
+    if entries and len(failed) == len(entries):
+        raise RuntimeError("Every quiz draft failed")
+    return {"topics": len(entries), "created": created, "failed": failed}
+
+@job_runner.register("summary_warmup", validate=validate_summary_warmup_params)
+async def warm_topic_summaries(job: Job, ctx: JobContext) -> dict:
+    """Generate stored summaries for every matching taxonomy entry that lacks a fresh one
+
+    params: stream, class_level, subject, topic (all optional filters),
+    force (regenerate even fresh summaries).
+    """
+    validate_summary_warmup_params(job.params)
+    entries = await load_taxonomy(*taxonomy_filters(job.params))
+
+    fresh = set()
+    if not job.params.get("force"):
+        async for doc in topic_summaries_collection.find(
+            {"model_version": SUMMARY_MODEL_VERSION},
+            {"_id": 0, "subject": 1, "topic": 1, "stream": 1, "class_level": 1, "generated_at": 1}
+        ):
+            if is_fresh(doc):
+                fresh.add(SummaryKey(doc["subject"], doc["topic"], doc["stream"], doc["class_level"]))
+
+    generated, failed = 0, []
+    for index, entry in enumerate(entries):
+        key = SummaryKey(entry["subject"], entry["topic"], entry["stream"], entry["class_level"])
+        if key not in fresh:
+            try:
+                await generate_summary(key, background=True)
+                generated += 1
+            except Exception as e:
+                logger.warning(f"Summary warm-up failed for {key}: {str(e)}")
+                failed.append(" / ".join(str(part) for part in key))
+
+        await ctx.report((index + 1) * 100 / len(entries), f"{index + 1}/{len(entries)} topics")
+
+    if failed and not generated:
+        raise RuntimeError("Every summary generation failed")
+    return {"topics": len(entries), "generated": generated, "failed": failed}
@@ -0,0 +1,114 @@
+"""
+Batched read requests (/api/batch).
+
+A batch authenticates once and runs its GET sub-requests concurrently against
+the existing route functions, resolved from the app's own routes so paths,
+path parameters and query parameters behave as they do over HTTP. Only routes
+in the allowlist passed to BatchDispatcher can be batched.
+
+Sub-requests share a per-batch memo (request_memo), so loaders wrapped with
+memoized() run once per batch however many sub-requests need them; outside a
+batch they simply run.
+"""
+from contextvars import ContextVar
+from inspect import Parameter, signature
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+import asyncio
+import logging
+
+from fastapi import HTTPException
+from fastapi.routing import APIRoute
+from pydantic import TypeAdapter, ValidationError
+from pydantic_core import to_json
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+request_memo: ContextVar[Optional[Dict[Any, asyncio.Future]]] = ContextVar("request_memo", default=None)
+
+async def memoized(key: Any, loader: Callable[[], Awaitable[Any]]) -> Any:
+    """Run loader once per batch for this key; concurrent callers share the in-flight result"""
+    memo = request_memo.get()
+    if memo is None:
+        return await loader()
+    future = memo.get(key)
+    if future is None:
+        future = asyncio.ensure_future(loader())
+        memo[key] = future
+    return await asyncio.shield(future)
+
+class BatchDispatcher:
+    def __init__(self, routes: List[Any], endpoints: List[Callable]):
+        allowed = set(endpoints)
+        self.routes = [
+            route for route in routes
+            if isinstance(route, APIRoute) and route.endpoint in allowed and "GET" in route.methods
+        ]
+        self._adapters: Dict[Any, TypeAdapter] = {}
+
+    def resolve(self, path: str) -> Optional[Tuple[APIRoute, Dict[str, Any]]]:
+        for route in self.routes:
+            match = route.path_regex.match(path)
+            if match:
+                params = {
+                    name: route.param_convertors[name].convert(value)
+                    for name, value in match.groupdict().items()
+                }
+                return route, params
+        return None
+
+    def _adapter(self, annotation: Any) -> TypeAdapter:
+        adapter = self._adapters.get(annotation)
+        if adapter is None:
+            adapter = self._adapters[annotation] = TypeAdapter(annotation)
+        return adapter
+
+    async def call(self, url: str, current_user: Any) -> Tuple[int, bytes]:
+        """Run one sub-request; returns (status, JSON body bytes)"""
+        parts = urlsplit(url)
+        resolved = self.resolve(parts.path)
+        if resolved is None:
+            return 404, to_json({"detail": f"Not batchable: {parts.path}"})
+        route, path_params = resolved
+        query = dict(parse_qsl(parts.query))
+
+        kwargs = {}
+        try:
+            for name, parameter in signature(route.endpoint).parameters.items():
+                if name == "current_user":
+                    kwargs[name] = current_user
+                elif name in path_params:
+                    kwargs[name] = path_params[name]
+                elif name in query:
+                    annotation = parameter.annotation if parameter.annotation is not Parameter.empty else str
+                    kwargs[name] = self._adapter(annotation).validate_python(query[name])
+                elif parameter.default is Parameter.empty:
+                    return 422, to_json({"detail": f"Missing query parameter: {name}"})
+        except ValidationError as e:
+            return 422, to_json({"detail": e.errors(include_url=False)})
+
+        try:
+            result = await route.endpoint(**kwargs)
+        except HTTPException as e:
+            return e.status_code, to_json({"detail": e.detail})
+        except Exception as e:
+            logger.error(f"Batch sub-request {parts.path} failed: {str(e)}")
+            return 500, to_json({"detail": "Internal server error"})
+        if isinstance(result, Response):
+            return result.status_code, result.body or b"null"
+        return route.status_code or 200, to_json(result)
+
+    async def run(self, requests: List[Any], current_user: Any) -> bytes:
+        """Run all sub-requests concurrently with a shared memo; returns the combined JSON body"""
+        token = request_memo.set({})
+        try:
+            results = await asyncio.gather(*(self.call(r.path, current_user) for r in requests))
+        finally:
+            request_memo.reset(token)
+
+        parts = [
+            b'{"id":' + to_json(r.id) + b',"status":' + str(status).encode() + b',"body":' + body + b"}"
+            for r, (status, body) in zip(requests, results)
+        ]
+        return b'{"responses":[' + b",".join(parts) + b"]}"
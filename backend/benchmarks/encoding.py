@@ -0,0 +1,60 @@
+"""
+Bytes on the wire and CPU per response for each negotiated encoding.
+
+Encodes catalog-shaped JSON bodies (100 books, 100 quizzes) with every
+representation/encoding the EncodingMiddleware can produce, plus the cost of
+serving the same body from the encoded-body cache. Brotli and MessagePack rows
+are skipped when those optional packages are not installed.
+
+    cd backend && python benchmarks/encoding.py
+"""
+from pathlib import Path
+import argparse
+import gzip
+import hashlib
+import json
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pydantic_core import to_json
+
+from benchmarks.serialization import book_doc, quiz_doc
+from encoding import EncodedBodyCache, brotli, msgpack
+
+def variants():
+    yield "identity", lambda body: body
+    for level in (1, 6, 9):
+        yield f"gzip -{level}", lambda body, level=level: gzip.compress(body, compresslevel=level, mtime=0)
+    if brotli is not None:
+        for quality in (1, 5, 11):
+            yield f"br q{quality}", lambda body, quality=quality: brotli.compress(body, quality=quality)
+    if msgpack is not None:
+        yield "msgpack", lambda body: msgpack.packb(json.loads(body))
+        yield "msgpack + gzip -6", lambda body: gzip.compress(msgpack.packb(json.loads(body)), compresslevel=6, mtime=0)
+
+def cpu_ms(fn, body: bytes, repeat: int) -> float:
+    started = time.process_time()
+    for _ in range(repeat):
+        fn(body)
+    return (time.process_time() - started) / repeat * 1000
+
+def main(repeat: int):
+    for name, make in (("books", book_doc), ("quizzes", quiz_doc)):
+        body = to_json([make(i) for i in range(100)])
+        print(f"100 {name}: {len(body)} bytes of JSON")
+        for label, encode in variants():
+            encoded = encode(body)
+            print(f"  {label:<18} {len(encoded):>8} bytes  {len(encoded) / len(body):6.1%}  {cpu_ms(encode, body, repeat):7.3f} ms CPU")
+
+        cache = EncodedBodyCache()
+        key = (hashlib.blake2b(body, digest_size=16).digest(), False, "gzip")
+        cache.put(key, (gzip.compress(body, mtime=0), "application/json", "gzip"))
+        hit = lambda body: cache.get((hashlib.blake2b(body, digest_size=16).digest(), False, "gzip"))
+        print(f"  {'cached gzip hit':<18} {'':>8}        {'':>6}  {cpu_ms(hit, body, repeat):7.3f} ms CPU")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    main(parser.parse_args().repeat)
@@ -0,0 +1,142 @@
+"""
+httpx baseline: a fresh HTTP client per request versus LlmClientPool's shared client.
+
+This measures the HTTP transport only, not the provider SDK. The pool hands its
+keep-alive client to litellm as aclient_session, and the SDK sends chat turns
+through it; the SDK itself can't be pointed at a local server, so it is left
+out. Requests go to a local stand-in for the chat-completions endpoint
+(instant canned JSON, HTTP/1.1 keep-alive), so only client-side cost is
+measured: connection setup, TLS handshake with --tls, and client construction.
+Without --tls a fresh client still builds its default SSL context (loading the
+CA bundle), which is what a provider SDK client does on every construction.
+
+A second measurement goes through llm_clients.handle() with the fake provider
+at zero latency: the per-turn cost of the pool's own code path.
+
+    cd backend && python benchmarks/llm_client_pool.py --requests 500 --tls
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("LLM_PROVIDER", "fake")
+
+import httpx
+
+import fake_llm
+from llm import DEFAULT_MODEL, LLM_PROVIDER, LlmClientPool, load_sdk
+
+COMPLETION = json.dumps({
+    "id": "chatcmpl-local",
+    "object": "chat.completion",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11},
+}).encode()
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            if length:
+                await reader.readexactly(length)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: keep-alive\r\n"
+                + f"Content-Length: {len(COMPLETION)}\r\n\r\n".encode()
+                + COMPLETION
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+        pass
+    finally:
+        writer.close()
+
+def self_signed_context(directory: str) -> ssl.SSLContext:
+    """Server context for a throwaway certificate, which clients trust through SSL_CERT_FILE"""
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+        check=True, capture_output=True
+    )
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(cert, key)
+    os.environ["SSL_CERT_FILE"] = cert
+    return server_context
+
+async def post(client: httpx.AsyncClient, url: str):
+    response = await client.post(url, json={"model": "stand-in", "messages": [{"role": "user", "content": "hi"}]})
+    response.raise_for_status()
+    response.json()
+
+async def measure(label: str, count: int, call) -> float:
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        await call()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    mean = statistics.fmean(samples)
+    print(
+        f"{label:<28} mean {mean:7.3f} ms  p50 {samples[len(samples) // 2]:7.3f} ms  "
+        f"p99 {samples[int(len(samples) * 0.99) - 1]:7.3f} ms"
+    )
+    return mean
+
+async def main(count: int, tls: bool):
+    with tempfile.TemporaryDirectory() as directory:
+        server_context = self_signed_context(directory) if tls else None
+        server = await asyncio.start_server(handle_connection, "127.0.0.1", 0, ssl=server_context)
+        port = server.sockets[0].getsockname()[1]
+        url = f"{'https' if tls else 'http'}://localhost:{port}/v1/chat/completions"
+
+        async def fresh_client():
+            # What constructing a new client per chat turn costs
+            async with httpx.AsyncClient() as client:
+                await post(client, url)
+
+        # The pool's own client, exactly as start() builds it
+        pool = LlmClientPool()
+        await pool.start()
+
+        async def pooled_client():
+            await post(pool.http_client, url)
+
+        await pooled_client()  # open the keep-alive connection
+        print(f"httpx baseline: {count} requests against local stand-in ({'https' if tls else 'http'})")
+        fresh = await measure("fresh client per request", count, fresh_client)
+        pooled = await measure("LlmClientPool.http_client", count, pooled_client)
+        print(f"saved per request: {fresh - pooled:.3f} ms ({fresh / pooled:.1f}x)")
+
+        if LLM_PROVIDER == "fake":
+            fake_llm.LATENCY_MS = fake_llm.JITTER_MS = 0
+            _, UserMessage = load_sdk()
+
+            async def through_handle():
+                await pool.handle(DEFAULT_MODEL, "benchmark", "You are a tutor.").send_message(UserMessage(text="hi"))
+
+            print(f"\nllm_clients.handle() + send_message, fake provider at 0 ms ({count} calls)")
+            await measure("pool handle per chat turn", count, through_handle)
+
+        await pool.close()
+        server.close()
+        await server.wait_closed()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--tls", action="store_true", help="serve HTTPS with a throwaway self-signed certificate")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.tls))
@@ -0,0 +1,354 @@
+"""
+Load and latency benchmark for the API, run in-process.
+
+Boots the FastAPI app (startup and shutdown hooks included) on an ASGI
+transport against a Mongo stand-in. That is mongomock-motor by default, or a
+real mongod with --mongo-url, using a throwaway database that is dropped
+afterwards. The LLM is the fake client (LLM_PROVIDER=fake), with latency set
+by --llm-latency-ms. A seeded catalog is loaded through the API. Then --concurrency virtual students loop
+over a weighted mix of scenarios for --duration seconds:
+
+    browse     list books/videos/quizzes for a subject, subject metadata
+    quiz       start a quiz and submit an attempt
+    chat       ask the tutor a question, follow up in the same session
+    dashboard  stats, progress and recent chat sessions
+
+Reports throughput and p50/p95/p99 per endpoint, writes them to --output as
+JSON and, with --baseline, compares against an earlier run. It exits with
+status 1 when any endpoint's p95 or the overall throughput is worse than the
+baseline by more than --tolerance.
+
+mongomock never yields to the event loop, so in the default mode Mongo work is
+serialized and concurrency mostly overlaps LLM waits; use --mongo-url to
+measure real I/O overlap. Compare runs made on the same machine and in the
+same mode.
+
+    cd backend && python benchmarks/load.py --duration 30 --output load.json
+    cd backend && python benchmarks/load.py --baseline load.json
+"""
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+SUBJECTS = {
+    "Physics": ["Kinematics", "Laws of Motion", "Work and Energy", "Gravitation"],
+    "Chemistry": ["Atomic Structure", "Chemical Bonding", "Thermodynamics"],
+    "Mathematics": ["Quadratic Equations", "Trigonometry", "Probability", "Calculus"],
+    "Biology": ["Cell Structure", "Photosynthesis", "Genetics"],
+}
+QUESTIONS = [
+    "Can you explain {topic} with an everyday example?",
+    "Why is {topic} important for the board exam?",
+    "Give me a quick summary of {topic}",
+    "I keep getting {topic} problems wrong. What am I missing?",
+]
+
+DEFAULT_MIX = "browse=5,quiz=2,chat=1,dashboard=2"
+
+def configure_environment(args, scratch: str):
+    """Must run before the app is imported: settings are read at import time"""
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["FAKE_LLM_JITTER_MS"] = str(args.llm_jitter_ms)
+    os.environ.setdefault("EMERGENT_LLM_KEY", "benchmark")
+    os.environ["RETRIEVAL_INDEX_DIR"] = os.path.join(scratch, "retrieval_index")
+    os.environ["WRITE_BEHIND_SPILL_DIR"] = os.path.join(scratch, "spill")
+    os.environ["DB_NAME"] = f"load_benchmark_{uuid.uuid4().hex[:8]}"
+    if args.mongo_url:
+        os.environ["MONGO_URL"] = args.mongo_url
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("mongomock-motor is not installed; pip install mongomock-motor or pass --mongo-url")
+        import motor.motor_asyncio
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+
+def parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name.strip()] = int(weight or 1)
+    return mix
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.recording = False
+
+    async def call(self, client, label: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - started
+        if self.recording:
+            self.latencies[label].append(elapsed)
+            if response.status_code >= 400:
+                self.errors[label] += 1
+        return response
+
+class Student:
+    def __init__(self, headers: dict, rng: random.Random):
+        self.headers = headers
+        self.rng = rng
+        self.stream = rng.choice(["CBSE", "ICSE"])
+        self.class_level = rng.choice([9, 10, 11, 12])
+
+    def pick_topic(self):
+        subject = self.rng.choice(list(SUBJECTS))
+        return subject, self.rng.choice(SUBJECTS[subject])
+
+async def browse(client, student: Student, catalog: dict, recorder: Recorder):
+    subject, _ = student.pick_topic()
+    await recorder.call(client, "GET /api/metadata/subjects", "GET", "/api/metadata/subjects",
+                        params={"stream": student.stream, "class_level": student.class_level})
+    for kind in ("books", "videos", "quizzes"):
+        await recorder.call(client, f"GET /api/{kind}", "GET", f"/api/{kind}",
+                            params={"subject": subject, "stream": student.stream})
+    book_id = student.rng.choice(catalog["books"])
+    await recorder.call(client, "GET /api/books/{book_id}", "GET", f"/api/books/{book_id}")
+
+async def quiz(client, student: Student, catalog: dict, recorder: Recorder):
+    quiz_id, _ = student.rng.choice(catalog["quizzes"])
+    started = await recorder.call(client, "POST /api/quizzes/{quiz_id}/start", "POST",
+                                  f"/api/quizzes/{quiz_id}/start", headers=student.headers)
+    if started.status_code != 200:
+        return
+    served = started.json()
+    answers = [student.rng.randrange(4) for _ in served["questions"]]
+    await recorder.call(client, "POST /api/quizzes/{quiz_id}/attempt", "POST", f"/api/quizzes/{quiz_id}/attempt",
+                        json=answers, headers={**student.headers, "X-Attempt-Token": served["attempt_token"]})
+
+async def chat(client, student: Student, catalog: dict, recorder: Recorder):
+    subject, topic = student.pick_topic()
+    payload = {
+        "message": student.rng.choice(QUESTIONS).format(topic=topic),
+        "subject": subject, "topic": topic, "stream": student.stream, "class_level": student.class_level,
+    }
+    response = await recorder.call(client, "POST /api/chat", "POST", "/api/chat", json=payload, headers=student.headers)
+    if response.status_code == 200 and student.rng.random() < 0.5:
+        follow_up = {**payload, "message": "Thanks, can you give one practice question?",
+                     "session_id": response.json().get("session_id")}
+        await recorder.call(client, "POST /api/chat", "POST", "/api/chat", json=follow_up, headers=student.headers)
+
+async def dashboard(client, student: Student, catalog: dict, recorder: Recorder):
+    for path in ("/api/dashboard/stats", "/api/progress", "/api/chat/sessions"):
+        await recorder.call(client, f"GET {path}", "GET", path, headers=student.headers)
+
+SCENARIOS = {"browse": browse, "quiz": quiz, "chat": chat, "dashboard": dashboard}
+
+async def register(client, email: str, role: str) -> dict:
+    response = await client.post("/api/auth/register", json={
+        "email": email, "full_name": email.split("@")[0], "role": role, "password": "benchmark-password",
+    })
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+async def seed_catalog(client, admin: dict, rng: random.Random, items_per_topic: int) -> dict:
+    catalog = {"books": [], "quizzes": []}
+    for subject, topics in SUBJECTS.items():
+        for topic in topics:
+            for i in range(items_per_topic):
+                common = {
+                    "stream": rng.choice(["CBSE", "ICSE"]), "class_level": rng.choice([9, 10, 11, 12]),
+                    "subject": subject, "topic": topic,
+                }
+                book = await client.post("/api/books", headers=admin, json={
+                    **common, "title": f"{topic} notes {i}", "author": "Benchmark Author",
+                    "summary": f"Key ideas of {topic} in {subject}, worked examples and exercises. " * 3,
+                    "tags": [subject.lower(), topic.lower()],
+                })
+                catalog["books"].append(book.json()["id"])
+                await client.post("/api/videos", headers=admin, json={
+                    **common, "title": f"{topic} lecture {i}", "teacher_name": "Benchmark Teacher",
+                    "difficulty": "beginner", "duration": 900, "description": f"Lecture on {topic}",
+                })
+                questions = [
+                    {"question": f"{topic} question {q}", "options": ["A", "B", "C", "D"],
+                     "correct_answer": rng.randrange(4), "explanation": f"Because of {topic}"}
+                    for q in range(10)
+                ]
+                created = await client.post("/api/quizzes", headers=admin, json={
+                    **common, "title": f"{topic} quiz {i}", "difficulty": "intermediate", "questions": questions,
+                })
+                catalog["quizzes"].append((created.json()["id"], len(questions)))
+    return catalog
+
+async def virtual_user(client, student: Student, catalog: dict, mix: Dict[str, int], recorder: Recorder, stop_at: float):
+    names, weights = list(mix), list(mix.values())
+    while time.perf_counter() < stop_at:
+        scenario = SCENARIOS[student.rng.choices(names, weights)[0]]
+        await scenario(client, student, catalog, recorder)
+        await asyncio.sleep(0)  # let other users in even when every await completes synchronously
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    endpoints = {}
+    total = 0
+    for label in sorted(recorder.latencies):
+        values = sorted(recorder.latencies[label])
+        total += len(values)
+        endpoints[label] = {
+            "requests": len(values),
+            "errors": recorder.errors.get(label, 0),
+            "throughput_rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        }
+    return {
+        "requests": total,
+        "errors": sum(recorder.errors.values()),
+        "throughput_rps": round(total / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+def compare(result: dict, baseline: dict, tolerance: float, min_requests: int) -> List[str]:
+    regressions = []
+    if result["summary"]["throughput_rps"] < baseline["summary"]["throughput_rps"] * (1 - tolerance):
+        regressions.append(
+            f"throughput {baseline['summary']['throughput_rps']} -> {result['summary']['throughput_rps']} rps"
+        )
+    for label, stats in result["summary"]["endpoints"].items():
+        before = baseline["summary"]["endpoints"].get(label)
+        if not before or min(stats["requests"], before["requests"]) < min_requests:
+            continue
+        if stats["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{label} p95 {before['p95_ms']} -> {stats['p95_ms']} ms")
+        if stats["errors"] > before["errors"] and stats["errors"] / stats["requests"] > 0.01:
+            regressions.append(f"{label} errors {before['errors']} -> {stats['errors']}")
+    return regressions
+
+def print_report(result: dict, baseline: dict = None):
+    summary = result["summary"]
+    print(f"{summary['requests']} requests in {result['config']['duration']}s, "
+          f"{summary['throughput_rps']} req/s, {summary['errors']} errors")
+    print(f"{'endpoint':<38} {'reqs':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  {'p95 vs base':>11}")
+    for label, stats in summary["endpoints"].items():
+        delta = ""
+        before = (baseline or {}).get("summary", {}).get("endpoints", {}).get(label)
+        if before and before["p95_ms"]:
+            delta = f"{(stats['p95_ms'] / before['p95_ms'] - 1) * 100:+.0f}%"
+        print(f"{label:<38} {stats['requests']:>6} {stats['errors']:>4} {stats['p50_ms']:>8} "
+              f"{stats['p95_ms']:>8} {stats['p99_ms']:>8}  {delta:>11}")
+
+async def drop_database(mongo_url: str):
+    """Drop the throwaway database; the app's own client is closed by shutdown"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(mongo_url)
+    try:
+        await client.drop_database(os.environ["DB_NAME"])
+    finally:
+        client.close()
+
+async def run(args) -> dict:
+    import httpx
+    from server import app
+
+    # Per-request access and slow-request lines would drown the report
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("slow_requests").setLevel(logging.ERROR)
+
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    recorder = Recorder()
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+            admin = await register(client, "admin@example.com", "admin")
+            catalog = await seed_catalog(client, admin, rng, args.items_per_topic)
+            students = [
+                Student(await register(client, f"student{i}@example.com", "student"), random.Random(rng.random()))
+                for i in range(args.concurrency)
+            ]
+
+            if args.warmup:
+                stop_at = time.perf_counter() + args.warmup
+                await asyncio.gather(*(virtual_user(client, s, catalog, mix, recorder, stop_at) for s in students))
+
+            recorder.recording = True
+            started = time.perf_counter()
+            stop_at = started + args.duration
+            await asyncio.gather(*(virtual_user(client, s, catalog, mix, recorder, stop_at) for s in students))
+            elapsed = time.perf_counter() - started
+    finally:
+        await app.router.shutdown()
+        if args.mongo_url:
+            await drop_database(args.mongo_url)
+
+    return {
+        "config": {
+            "duration": args.duration, "concurrency": args.concurrency, "mix": mix, "seed": args.seed,
+            "llm_latency_ms": args.llm_latency_ms, "items_per_topic": args.items_per_topic,
+            "mongo": "mongod" if args.mongo_url else "mongomock",
+        },
+        "environment": {"python": platform.python_version(), "machine": platform.machine(), "node": platform.node()},
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "summary": summarize(recorder, elapsed),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before the run")
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual students")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--items-per-topic", type=int, default=3)
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-jitter-ms", type=float, default=300)
+    parser.add_argument("--mongo-url", help="use this mongod (a throwaway database) instead of mongomock-motor")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (default 0.2)")
+    parser.add_argument("--min-requests", type=int, default=30, help="ignore endpoints with fewer samples")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="load-benchmark-")
+    try:
+        configure_environment(args, scratch)
+        result = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if baseline:
+        regressions = compare(result, baseline, args.tolerance, args.min_requests)
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline")
+
+if __name__ == "__main__":
+    main()
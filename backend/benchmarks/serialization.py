@@ -0,0 +1,103 @@
+"""
+CPU time per list response: validated models versus the trusted-read fast path.
+
+"validated" is what list endpoints did before: build a model per document,
+then FastAPI validates the list against response_model and encodes it with
+jsonable_encoder + json.dumps. "trusted" is TrustedReader rows encoded by
+FastJSONResponse. Documents are shaped like stored books and quizzes.
+
+    cd backend && python benchmarks/serialization.py
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from models import Book, Quiz
+from serialization import FastJSONResponse, TrustedReader
+
+def book_doc(i: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "title": f"Concepts of Physics, part {i}",
+        "author": "H. C. Verma",
+        "stream": "CBSE",
+        "class_level": 11,
+        "subject": "Physics",
+        "topic": "Kinematics",
+        "content_url": f"https://example.com/books/{i}.pdf",
+        "summary": "Motion in one and two dimensions, projectiles and relative velocity. " * 3,
+        "tags": ["physics", "motion", "jee"],
+        "uploaded_by": str(uuid.uuid4()),
+        "created_at": datetime(2024, 1, 1) + timedelta(minutes=i),
+        "approved": True,
+    }
+
+def quiz_doc(i: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "title": f"Kinematics practice {i}",
+        "stream": "CBSE",
+        "class_level": 11,
+        "subject": "Physics",
+        "topic": "Kinematics",
+        "difficulty": "intermediate",
+        "questions": [
+            {
+                "question": f"A ball is thrown upwards at {q + 5} m/s. How high does it rise?",
+                "options": ["1.25 m", "2.5 m", "5 m", "10 m"],
+                "correct_answer": q % 4,
+                "explanation": "Use v^2 = u^2 - 2gh with v = 0 at the top.",
+            }
+            for q in range(10)
+        ],
+        "created_by": str(uuid.uuid4()),
+        "created_at": datetime(2024, 1, 1) + timedelta(minutes=i),
+    }
+
+async def validated(model, docs: List[dict]) -> bytes:
+    field = create_response_field(name="response", type_=List[model])
+    content = await serialize_response(field=field, response_content=[model(**doc) for doc in docs])
+    return JSONResponse(content).body
+
+async def trusted(reader: TrustedReader, docs: List[dict]) -> bytes:
+    return FastJSONResponse(reader.rows(docs)).body
+
+def cpu_per_request(fn, *args, repeat: int) -> float:
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(fn(*args))  # warm up
+        started = time.process_time()
+        for _ in range(repeat):
+            loop.run_until_complete(fn(*args))
+        return (time.process_time() - started) / repeat * 1000
+    finally:
+        loop.close()
+
+def main(repeat: int):
+    for model, make in ((Book, book_doc), (Quiz, quiz_doc)):
+        reader = TrustedReader(model)
+        for size in (100, 1000):
+            docs = [make(i) for i in range(size)]
+            runs = max(3, repeat * 100 // size)
+            slow = cpu_per_request(validated, model, docs, repeat=runs)
+            fast = cpu_per_request(trusted, reader, docs, repeat=runs)
+            print(
+                f"{model.__name__:<5} x{size:<5} validated {slow:8.3f} ms CPU   trusted {fast:7.3f} ms CPU   "
+                f"{slow / fast:5.1f}x"
+            )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50, help="requests timed at 100 items; scaled down for larger sizes")
+    main(parser.parse_args().repeat)
@@ -0,0 +1,158 @@
+"""
+Worker startup time: process spawn to first ready response.
+
+Spawns --workers fresh interpreters at once, like a gunicorn pre-fork master
+does on a deploy, and repeats that --runs times. Each worker imports the app,
+runs its startup hooks on an ASGI transport and polls /api/ready until it
+returns 200. It reports how long each phase took:
+
+    interpreter  process spawn until the benchmark code starts
+    import       `from server import app`
+    startup      the app's startup hooks
+    ready        startup finished until /api/ready returned 200 (warm-up)
+    total        process spawn until ready
+
+Each worker also reports what its index bootstrap did (synced, waited or
+current). With --mongo-url all workers share a throwaway database, so only one
+of them should build indexes. With mongomock-motor (the default) every worker
+has a private in-memory database and syncs its own. --llm-provider selects the
+LLM stack that would be imported, though it is now only loaded after startup.
+Pass --importtime to list the modules with the most self import time.
+
+    cd backend && python benchmarks/startup.py --workers 4 --runs 3
+    cd backend && python benchmarks/startup.py --mongo-url mongodb://localhost:27017 --workers 8
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+BACKEND = Path(__file__).resolve().parent.parent
+PHASES = ("interpreter", "import", "startup", "ready", "total")
+
+async def worker(spawned_at: float, mongo_url: str) -> dict:
+    entered = time.time()
+    if not mongo_url:
+        import motor.motor_asyncio
+        from mongomock_motor import AsyncMongoMockClient
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+    sys.path.insert(0, str(BACKEND))
+    logging.disable(logging.INFO)
+
+    started = time.perf_counter()
+    import httpx
+    from server import app
+    from lifecycle import lifecycle
+    imported = time.perf_counter()
+    await app.router.startup()
+    booted = time.perf_counter()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            while (await client.get("/api/ready")).status_code != 200:
+                await asyncio.sleep(0.01)
+        ready = time.perf_counter()
+        indexes = lifecycle.checks["indexes"]
+    finally:
+        await app.router.shutdown()
+    return {
+        "interpreter": entered - spawned_at,
+        "import": imported - started,
+        "startup": booted - imported,
+        "ready": ready - booted,
+        "total": entered - spawned_at + ready - started,
+        "indexes": indexes,
+    }
+
+def spawn(args, db_name: str, scratch: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "LLM_PROVIDER": args.llm_provider,
+        "DB_NAME": db_name,
+        "RETRIEVAL_INDEX_DIR": os.path.join(scratch, "retrieval_index"),
+        "WRITE_BEHIND_SPILL_DIR": os.path.join(scratch, "spill"),
+    }
+    command = [sys.executable, *(["-X", "importtime"] if args.importtime else []), __file__, "--worker", str(time.time())]
+    if args.mongo_url:
+        env["MONGO_URL"] = args.mongo_url
+        command += ["--mongo-url", args.mongo_url]
+    return subprocess.Popen(command, cwd=BACKEND, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+def top_imports(stderr: str, limit: int = 15) -> list:
+    rows = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            self_us, _, name = line[len("import time:"):].split("|")
+            if self_us.strip().isdigit():
+                rows.append((int(self_us), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+async def drop_database(mongo_url: str, db_name: str):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(mongo_url)
+    await client.drop_database(db_name)
+    client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4, help="workers started at once per run")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--mongo-url", help="use this mongod (a throwaway database per run) instead of mongomock-motor")
+    parser.add_argument("--llm-provider", default="fake", help="LLM_PROVIDER for the workers (default fake)")
+    parser.add_argument("--importtime", action="store_true", help="list the slowest imports of the first worker")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--worker", metavar="SPAWNED_AT", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(asyncio.run(worker(args.worker, args.mongo_url))))
+        return
+
+    scratch = tempfile.mkdtemp(prefix="startup-benchmark-")
+    results = []
+    for run in range(args.runs):
+        db_name = f"startup_benchmark_{uuid.uuid4().hex[:8]}"
+        processes = [spawn(args, db_name, scratch) for _ in range(args.workers)]
+        for index, process in enumerate(processes):
+            stdout, stderr = process.communicate()
+            if process.returncode != 0:
+                sys.exit(f"worker exited with {process.returncode}:\n{stderr}")
+            results.append(json.loads(stdout.strip().splitlines()[-1]))
+            if args.importtime and run == 0 and index == 0:
+                print("Slowest imports (self time):")
+                for self_us, name in top_imports(stderr):
+                    print(f"  {self_us / 1000:8.1f} ms  {name}")
+        if args.mongo_url:
+            asyncio.run(drop_database(args.mongo_url, db_name))
+
+    summary = {
+        phase: {
+            "p50_ms": round(statistics.median(r[phase] for r in results) * 1000, 1),
+            "max_ms": round(max(r[phase] for r in results) * 1000, 1),
+        }
+        for phase in PHASES
+    }
+    bootstraps = {}
+    for r in results:
+        bootstraps[r["indexes"]] = bootstraps.get(r["indexes"], 0) + 1
+
+    print(f"{len(results)} worker starts ({args.runs} runs x {args.workers} workers, "
+          f"{'mongod' if args.mongo_url else 'mongomock'}, LLM_PROVIDER={args.llm_provider})")
+    for phase, stats in summary.items():
+        print(f"  {phase:<12} p50 {stats['p50_ms']:8.1f} ms   max {stats['max_ms']:8.1f} ms")
+    print(f"  index bootstrap: {', '.join(f'{count} {result}' for result, count in sorted(bootstraps.items()))}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "index_bootstrap": bootstraps, "workers": results}, f, indent=2)
+        print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Catalog taxonomy: the (stream, class_level, subject, topic) combinations that
+have approved books or videos.
+
+load_taxonomy() always reads Mongo; background jobs use it. TaxonomyCache keeps
+the whole taxonomy in memory for request paths, refreshed after a TTL and
+filled at startup, so a lookup is a scan of a few hundred tuples instead of an
+aggregation over both catalog collections.
+"""
+from typing import Dict, List, Optional, Tuple
+import os
+import time
+
+from database import books_collection, videos_collection
+
+TAXONOMY_FIELDS = ("stream", "class_level", "subject", "topic")
+TAXONOMY_CACHE_TTL = float(os.getenv("TAXONOMY_CACHE_TTL", "300"))  # seconds
+
+async def load_taxonomy(
+    stream: Optional[str] = None,
+    class_level: Optional[int] = None,
+    subject: Optional[str] = None,
+    topic: Optional[str] = None
+) -> List[Dict]:
+    """Distinct taxonomy entries across books and videos, sorted"""
+    match = {"approved": True}
+    for field, value in zip(TAXONOMY_FIELDS, (stream, class_level, subject, topic)):
+        if value:
+            match[field] = value
+
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": {field: f"${field}" for field in TAXONOMY_FIELDS}}},
+    ]
+    entries = set()
+    for collection in (books_collection, videos_collection):
+        async for doc in collection.aggregate(pipeline):
+            entries.add(tuple(doc["_id"][field] for field in TAXONOMY_FIELDS))
+
+    return [dict(zip(TAXONOMY_FIELDS, entry)) for entry in sorted(entries)]
+
+class TaxonomyCache:
+    def __init__(self, ttl: float = TAXONOMY_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: List[Tuple] = []
+        self._expires_at = 0.0
+
+    async def refresh(self) -> int:
+        entries = await load_taxonomy()
+        self._entries = [tuple(entry[field] for field in TAXONOMY_FIELDS) for entry in entries]
+        self._expires_at = time.monotonic() + self.ttl
+        return len(self._entries)
+
+    def add(self, doc: dict):
+        """Record an approved book or video created by this worker without waiting for the TTL"""
+        entry = tuple(doc[field] for field in TAXONOMY_FIELDS)
+        if entry not in self._entries:
+            self._entries = sorted([*self._entries, entry])
+
+    async def lookup(
+        self,
+        stream: Optional[str] = None,
+        class_level: Optional[int] = None,
+        subject: Optional[str] = None,
+        topic: Optional[str] = None
+    ) -> List[Dict]:
+        """Same result as load_taxonomy(), served from memory"""
+        if time.monotonic() >= self._expires_at:
+            await self.refresh()
+        wanted = [(i, value) for i, value in enumerate((stream, class_level, subject, topic)) if value]
+        return [
+            dict(zip(TAXONOMY_FIELDS, entry))
+            for entry in self._entries
+            if all(entry[i] == value for i, value in wanted)
+        ]
+
+taxonomy_cache = TaxonomyCache()
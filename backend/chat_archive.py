@@ -0,0 +1,295 @@
+"""
+Hot/cold tiering for chat sessions.
+
+Sessions idle for CHAT_ARCHIVE_IDLE_DAYS are moved out of chat_sessions by the
+"chat_archive" job, so the hot collection and its indexes stay small enough to
+remain in RAM. Each archived session is one compressed frame (a gzip member, or
+a zstd frame when CHAT_ARCHIVE_CODEC=zstd and zstandard is installed) holding a
+single JSON line, appended to a segment file under CHAT_ARCHIVE_DIR and
+fsync'd. Concatenated frames are still a valid .jsonl.gz / .jsonl.zst stream,
+so segments can be inspected with zcat. chat_archive_index maps each session
+to its segment, offset and length, plus the header fields the session list
+shows.
+
+Reads fall back to the archive when a session is not hot. A chat turn on an
+archived session restores it to chat_sessions first. Segments are append-only:
+restored sessions leave dead frames behind, which are not compacted.
+
+CHAT_ARCHIVE_DIR must be storage that every worker can read (a shared volume),
+since any worker may be asked for any archived session.
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+import uuid
+
+from pymongo import DeleteOne, ReplaceOne
+from pydantic_core import to_json
+
+from database import chat_archive_index_collection, chat_sessions_collection
+from jobs import JobContext, JobParamsInvalid, job_runner
+from models import ChatSession, Job
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CHAT_ARCHIVE_DIR = Path(os.getenv("CHAT_ARCHIVE_DIR", Path(__file__).parent / "chat_archive"))
+CHAT_ARCHIVE_IDLE_DAYS = float(os.getenv("CHAT_ARCHIVE_IDLE_DAYS", "30"))
+# Shortest idle_days a chat_archive job accepts; sessions idle this long are
+# marked opened_at when a chat turn loads them
+CHAT_ARCHIVE_MIN_IDLE_DAYS = float(os.getenv("CHAT_ARCHIVE_MIN_IDLE_DAYS", "1"))
+CHAT_ARCHIVE_BATCH_SIZE = int(os.getenv("CHAT_ARCHIVE_BATCH_SIZE", "500"))
+CHAT_ARCHIVE_SEGMENT_BYTES = int(os.getenv("CHAT_ARCHIVE_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+CHAT_ARCHIVE_CODEC = os.getenv("CHAT_ARCHIVE_CODEC", "gzip").lower()
+
+CODEC_SUFFIXES = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+
+# Copied into the index so the session list can show archived sessions
+HEADER_FIELDS = ("user_id", "subject", "topic", "created_at", "updated_at")
+
+class ArchiveUnavailable(Exception):
+    """An indexed session could not be read back from its segment"""
+
+def _codec_for(segment: str) -> str:
+    return "zstd" if segment.endswith(CODEC_SUFFIXES["zstd"]) else "gzip"
+
+def _compress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise ArchiveUnavailable("zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+def _append_frames(path: Path, frames: List[bytes]) -> List[Tuple[int, int]]:
+    """Append frames to a segment, fsync it, and return each frame's (offset, length)"""
+    created = not path.exists()
+    spans = []
+    with open(path, "ab") as handle:
+        offset = handle.tell()
+        for frame in frames:
+            handle.write(frame)
+            spans.append((offset, len(frame)))
+            offset += len(frame)
+        handle.flush()
+        os.fsync(handle.fileno())
+    if created:
+        # Make the new directory entry durable too
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    return spans
+
+def _read_frame(path: Path, offset: int, length: int) -> bytes:
+    with open(path, "rb") as handle:
+        handle.seek(offset)
+        frame = handle.read(length)
+    if len(frame) != length:
+        raise ArchiveUnavailable(f"Truncated frame in {path.name} at {offset}")
+    return frame
+
+class ChatArchive:
+    def __init__(
+        self,
+        archive_dir: Path = CHAT_ARCHIVE_DIR,
+        min_idle_days: float = CHAT_ARCHIVE_MIN_IDLE_DAYS,
+        segment_bytes: int = CHAT_ARCHIVE_SEGMENT_BYTES,
+        codec: str = CHAT_ARCHIVE_CODEC,
+    ):
+        if codec == "zstd" and zstandard is None:
+            logger.warning("CHAT_ARCHIVE_CODEC=zstd but zstandard is not installed; archiving with gzip")
+            codec = "gzip"
+        self.archive_dir = Path(archive_dir)
+        self.min_idle = timedelta(days=min_idle_days)
+        self.segment_bytes = segment_bytes
+        self.codec = codec
+        self._segment: Optional[Path] = None
+        self._write_lock = asyncio.Lock()
+
+    # ---------- reads ----------
+
+    async def find(self, session_id: str, user_id: Optional[str] = None) -> Optional[ChatSession]:
+        """An archived session, read back from its segment; None if it isn't archived"""
+        query = {"_id": session_id}
+        if user_id is not None:
+            query["user_id"] = user_id
+        entry = await chat_archive_index_collection.find_one(query)
+        if not entry:
+            return None
+
+        path = self.archive_dir / entry["segment"]
+        try:
+            frame = await asyncio.to_thread(_read_frame, path, entry["offset"], entry["length"])
+            line = await asyncio.to_thread(_decompress, _codec_for(entry["segment"]), frame)
+        except (OSError, EOFError, ValueError) as e:
+            raise ArchiveUnavailable(f"Cannot read archived session {session_id}: {str(e)}") from e
+        return ChatSession(**json.loads(line))
+
+    async def load(self, session_id: str, user_id: Optional[str] = None) -> Optional[ChatSession]:
+        """The session from the hot collection, or else from the archive"""
+        query = {"id": session_id}
+        if user_id is not None:
+            query["user_id"] = user_id
+        session_doc = await chat_sessions_collection.find_one(query)
+        if session_doc:
+            return ChatSession(**session_doc)
+        return await self.find(session_id, user_id)
+
+    async def load_for_update(self, session_id: str, user_id: Optional[str] = None) -> Optional[ChatSession]:
+        """Like load(), but the session is hot afterwards and won't be archived under the caller
+
+        Hot sessions idle for at least min_idle_days, the shortest cutoff a job
+        may use, get opened_at stamped, which keeps the archiver off them while a
+        chat turn is being answered. Archived sessions are restored.
+        """
+        query = {"id": session_id}
+        if user_id is not None:
+            query["user_id"] = user_id
+        session_doc = await chat_sessions_collection.find_one(query)
+        if session_doc:
+            now = datetime.utcnow()
+            if session_doc["updated_at"] < now - self.min_idle:
+                await chat_sessions_collection.update_one({"id": session_id}, {"$set": {"opened_at": now}})
+            return ChatSession(**session_doc)
+
+        session = await self.find(session_id, user_id)
+        if session:
+            await self.restore(session)
+        return session
+
+    async def list_headers(self, user_id: str, limit: int) -> List[Dict]:
+        """The user's most recently updated archived sessions, without their messages
+
+        Each header has archived set and the session's message_count.
+        """
+        projection = {field: 1 for field in HEADER_FIELDS + ("message_count",)}
+        cursor = chat_archive_index_collection.find({"user_id": user_id}, projection).sort("updated_at", -1).limit(limit)
+        return [
+            {"id": entry.pop("_id"), **entry, "archived": True}
+            for entry in await cursor.to_list(limit)
+        ]
+
+    # ---------- writes ----------
+
+    async def restore(self, session: ChatSession):
+        """Move an archived session back into chat_sessions"""
+        await chat_sessions_collection.update_one(
+            {"id": session.id},
+            {"$setOnInsert": {**session.dict(), "opened_at": datetime.utcnow()}},
+            upsert=True
+        )
+        await chat_archive_index_collection.delete_one({"_id": session.id})
+        logger.info(f"Restored archived chat session {session.id}")
+
+    def _segment_path(self) -> Path:
+        """The segment this worker appends to, rotated once it reaches segment_bytes"""
+        if self._segment is None or not self._segment.exists() or self._segment.stat().st_size >= self.segment_bytes:
+            name = f"sessions-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}{CODEC_SUFFIXES[self.codec]}"
+            self._segment = self.archive_dir / name
+        return self._segment
+
+    async def archive_batch(self, cutoff: datetime, limit: int = CHAT_ARCHIVE_BATCH_SIZE) -> Tuple[int, int]:
+        """Archive up to limit sessions idle since before cutoff; returns (archived, examined)"""
+        docs = await chat_sessions_collection.find(
+            {"updated_at": {"$lt": cutoff}, "opened_at": {"$not": {"$gte": cutoff}}}, {"_id": 0}
+        ).sort("updated_at", 1).limit(limit).to_list(limit)
+        if not docs:
+            return 0, 0
+
+        lines = [to_json(ChatSession(**doc)) + b"\n" for doc in docs]
+        frames = await asyncio.to_thread(lambda: [_compress(self.codec, line) for line in lines])
+        async with self._write_lock:
+            await asyncio.to_thread(self.archive_dir.mkdir, parents=True, exist_ok=True)
+            segment = self._segment_path()
+            spans = await asyncio.to_thread(_append_frames, segment, frames)
+
+        archived_at = datetime.utcnow()
+        await chat_archive_index_collection.bulk_write([
+            ReplaceOne({"_id": doc["id"]}, {
+                **{field: doc.get(field) for field in HEADER_FIELDS},
+                "segment": segment.name,
+                "offset": offset,
+                "length": length,
+                "message_count": len(doc.get("messages", [])),
+                "archived_at": archived_at,
+            }, upsert=True)
+            for doc, (offset, length) in zip(docs, spans)
+        ], ordered=False)
+
+        # Only delete sessions nobody wrote to or opened since they were read;
+        # those that were stay hot and lose their index entry
+        ids = [doc["id"] for doc in docs]
+        await chat_sessions_collection.bulk_write([
+            DeleteOne({"id": doc["id"], "updated_at": doc["updated_at"], "opened_at": doc.get("opened_at")})
+            for doc in docs
+        ], ordered=False)
+        still_hot = await chat_sessions_collection.distinct("id", {"id": {"$in": ids}})
+        if still_hot:
+            await chat_archive_index_collection.delete_many({"_id": {"$in": still_hot}})
+        return len(docs) - len(still_hot), len(docs)
+
+chat_archive = ChatArchive()
+
+def archive_settings(params: dict) -> Tuple[float, int, Optional[int]]:
+    """(idle days, batch size, max sessions or None) from chat_archive job params"""
+    try:
+        idle_days = float(params.get("idle_days", CHAT_ARCHIVE_IDLE_DAYS))
+        batch_size = int(params.get("batch_size", CHAT_ARCHIVE_BATCH_SIZE))
+        max_sessions = params.get("max_sessions")
+        max_sessions = None if max_sessions is None else int(max_sessions)
+    except (TypeError, ValueError):
+        raise JobParamsInvalid("idle_days must be a number; batch_size and max_sessions integers")
+    if not idle_days >= CHAT_ARCHIVE_MIN_IDLE_DAYS:
+        # Sessions younger than this aren't protected by opened_at while a turn is answered
+        raise JobParamsInvalid(f"idle_days must be at least {CHAT_ARCHIVE_MIN_IDLE_DAYS:g}")
+    if batch_size < 1 or (max_sessions is not None and max_sessions < 1):
+        raise JobParamsInvalid("batch_size and max_sessions must be positive")
+    return idle_days, batch_size, max_sessions
+
+def validate_chat_archive_params(params: dict):
+    archive_settings(params)
+
+@job_runner.register("chat_archive", validate=validate_chat_archive_params)
+async def archive_idle_sessions(job: Job, ctx: JobContext) -> dict:
+    """Move chat sessions idle for longer than the threshold to the archive
+
+    params: idle_days (default CHAT_ARCHIVE_IDLE_DAYS, at least
+    CHAT_ARCHIVE_MIN_IDLE_DAYS), batch_size (default CHAT_ARCHIVE_BATCH_SIZE),
+    max_sessions (stop after archiving this many).
+    """
+    idle_days, batch_size, max_sessions = archive_settings(job.params)
+    cutoff = datetime.utcnow() - timedelta(days=idle_days)
+
+    total = await chat_sessions_collection.count_documents({"updated_at": {"$lt": cutoff}})
+    if max_sessions is not None:
+        total = min(total, max_sessions)
+    archived, kept = 0, 0
+    while max_sessions is None or archived < max_sessions:
+        limit = batch_size if max_sessions is None else min(batch_size, max_sessions - archived)
+        moved, examined = await chat_archive.archive_batch(cutoff, limit)
+        if not examined:
+            break
+        archived += moved
+        kept += examined - moved
+        if examined > moved and not moved:
+            break  # every candidate in this batch is being written to right now
+        await ctx.report(archived * 100 / max(total, 1), f"{archived}/{total} sessions")
+
+    logger.info(f"Archived {archived} chat sessions idle since {cutoff.isoformat()}")
+    return {"archived": archived, "kept_hot": kept, "cutoff": cutoff.isoformat()}
@@ -0,0 +1,120 @@
+"""
+Token-budgeted prompt assembly for tutoring sessions.
+
+The prompt for a turn is the system message, a rolling summary of older turns
+(stored on the ChatSession) and as many recent turns as fit verbatim in
+CHAT_PROMPT_TOKEN_BUDGET. Older turns that are neither summarized nor recent are
+folded into the summary by a background refresh, so prompt size stays bounded
+however long the session gets. Until a refresh covers them they stay in the
+prompt verbatim, over budget if need be, so no turn is ever left out.
+
+The prompt carries the history itself, so every model call gets a one-off
+provider session id (turn_session_id): an SDK that also kept history per
+session id would otherwise send it twice.
+"""
+from typing import List, NamedTuple, Tuple
+import math
+import os
+import uuid
+
+from models import ChatMessage, ChatSession
+
+CHAT_PROMPT_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", "3000"))
+CHAT_SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKEN_BUDGET", "400"))
+# Refresh the summary once this many older messages have fallen out of the prompt
+CHAT_SUMMARY_REFRESH_MESSAGES = int(os.getenv("CHAT_SUMMARY_REFRESH_MESSAGES", "6"))
+
+MESSAGE_OVERHEAD_TOKENS = 4
+ROLE_LABELS = {"user": "Student", "assistant": "Tutor"}
+
+SUMMARY_SYSTEM_MESSAGE = (
+    "You maintain running notes of a tutoring conversation. Merge the existing notes with the new "
+    "messages into one concise summary: topics covered, what the student understood or struggled "
+    f"with, and open questions. Keep it under {CHAT_SUMMARY_TOKEN_BUDGET} tokens."
+)
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local estimate (~4 characters per token for English prose)"""
+    return math.ceil(len(text) / 4)
+
+def turn_session_id(session: ChatSession, purpose: str = "turn") -> str:
+    """Provider session id for a single call about this session"""
+    return f"{session.id}-{purpose}-{uuid.uuid4().hex[:12]}"
+
+def _format_message(message: ChatMessage) -> str:
+    return f"{ROLE_LABELS.get(message.role, message.role)}: {message.content}"
+
+class AssembledPrompt(NamedTuple):
+    system_message: str
+    estimated_tokens: int
+    # History messages [0, compactable_upto) may be folded into the summary
+    compactable_upto: int
+
+    def needs_summary_refresh(self, session: ChatSession) -> bool:
+        return self.compactable_upto - session.summary_upto >= CHAT_SUMMARY_REFRESH_MESSAGES
+
+def assemble_prompt(
+    base_system_message: str,
+    session: ChatSession,
+    user_text: str,
+    budget: int = CHAT_PROMPT_TOKEN_BUDGET
+) -> AssembledPrompt:
+    """Build the system message for the next turn; session.messages must end with the new user message"""
+    history = session.messages[:-1]
+    used = estimate_tokens(base_system_message) + estimate_tokens(user_text) + MESSAGE_OVERHEAD_TOKENS
+
+    summary_block = ""
+    if session.summary:
+        summary_block = f"\n\nSummary of the earlier conversation:\n{session.summary}"
+        used += estimate_tokens(summary_block)
+
+    # Walk back from the newest turn, keeping turns verbatim while they fit
+    recent: List[str] = []
+    start = len(history)
+    while start > session.summary_upto:
+        line = _format_message(history[start - 1])
+        cost = estimate_tokens(line) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        recent.append(line)
+        used += cost
+        start -= 1
+    compactable_upto = start
+
+    # Turns that didn't fit but aren't summarized yet go in anyway. Fewer than
+    # CHAT_SUMMARY_REFRESH_MESSAGES of them never trigger a refresh; beyond that a
+    # refresh is due and only the oldest wait for it
+    floor = max(session.summary_upto, start - (CHAT_SUMMARY_REFRESH_MESSAGES - 1))
+    while start > floor:
+        line = _format_message(history[start - 1])
+        recent.append(line)
+        used += estimate_tokens(line) + MESSAGE_OVERHEAD_TOKENS
+        start -= 1
+
+    system_message = base_system_message + summary_block
+    if recent:
+        system_message += "\n\nRecent conversation:\n" + "\n".join(reversed(recent))
+
+    return AssembledPrompt(system_message, used, compactable_upto)
+
+def summary_request(session: ChatSession, upto: int) -> Tuple[str, int]:
+    """Ask the model to fold messages from summary_upto towards upto into the summary
+
+    Catch-up is capped at CHAT_PROMPT_TOKEN_BUDGET per refresh, so a long session
+    that predates summaries is compacted over several turns. Returns the request
+    text and the index the new summary will cover up to.
+    """
+    lines = []
+    used = estimate_tokens(session.summary or "")
+    end = session.summary_upto
+    while end < upto:
+        line = _format_message(session.messages[end])
+        cost = estimate_tokens(line) + MESSAGE_OVERHEAD_TOKENS
+        if lines and used + cost > CHAT_PROMPT_TOKEN_BUDGET:
+            break
+        lines.append(line)
+        used += cost
+        end += 1
+
+    new_messages = "\n".join(lines)
+    return f"Existing notes:\n{session.summary or '(none)'}\n\nNew messages:\n{new_messages}", end
@@ -0,0 +1,192 @@
+"""
+Connection state for the chat WebSocket (/api/ws/chat).
+
+A connection authenticates once and then keeps the student and their current
+chat session in memory, so each message costs the LLM call plus one $push
+append. Outbound frames go through a bounded per-connection queue drained by a
+single sender task: a slow client stalls its own reply stream rather than
+buffering without limit. Heartbeats, idle timeouts and token expiry are handled
+by one registry sweep for all connections, which keeps an idle connection down
+to its receive loop and sender task.
+
+Frames are JSON objects with a "type":
+  client -> server: auth {token} (when not passed as ?token=), message {id,
+    message, session_id?, new_session?, subject?, topic?, stream?,
+    class_level?, context_type?}, cancel, typing, ping, pong
+  server -> client: ready, session {id, session_id}, chunk {id, delta},
+    done {id, session_id}, cancelled {id}, error {id?, status, detail}, ping, pong
+"""
+from datetime import datetime
+from typing import List, Optional, Set
+import asyncio
+import json
+import logging
+import os
+import time
+
+from fastapi import WebSocket
+from fastapi.encoders import jsonable_encoder
+
+from models import ChatSession, UserInDB
+
+logger = logging.getLogger(__name__)
+
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "25"))
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "90"))  # no frames, not even pongs
+WS_AUTH_TIMEOUT_SECONDS = float(os.getenv("WS_AUTH_TIMEOUT_SECONDS", "10"))
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+WS_STREAM_CHUNK_CHARS = int(os.getenv("WS_STREAM_CHUNK_CHARS", "48"))
+
+# Close codes in the application range (4000-4999)
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_IDLE = 4408
+CLOSE_TOKEN_EXPIRED = 4403
+CLOSE_TOO_SLOW = 4429
+CLOSE_SERVICE_RESTART = 1012  # worker draining for a deploy: reconnect (to another worker)
+
+def iter_chunks(text: str, size: int = WS_STREAM_CHUNK_CHARS) -> List[str]:
+    """Split a reply into roughly size-character pieces, breaking after whitespace"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            space = text.rfind(" ", start, end)
+            if space > start:
+                end = space + 1
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+class ChatConnection:
+    def __init__(self, websocket: WebSocket, user: UserInDB, token_expires_at: Optional[datetime] = None):
+        self.websocket = websocket
+        self.user = user
+        self.token_expires_at = token_expires_at
+        self.session: Optional[ChatSession] = None
+        self.reply_task: Optional[asyncio.Task] = None
+        self.last_seen = time.monotonic()
+        self.frames_sent = 0
+        self.frames_sent_at_sweep = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self._sender: Optional[asyncio.Task] = None
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def busy(self) -> bool:
+        return self.reply_task is not None and not self.reply_task.done()
+
+    def start(self):
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    async def send(self, frame: dict):
+        """Queue a frame, waiting while the client is behind"""
+        if not self._closed:
+            await self._queue.put(frame)
+
+    def try_send(self, frame: dict) -> bool:
+        """Queue a frame unless the queue is full; used for control frames"""
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def cancel_reply(self) -> bool:
+        if not self.busy:
+            return False
+        self.reply_task.cancel()
+        return True
+
+    async def _send_loop(self):
+        try:
+            while True:
+                frame = await self._queue.get()
+                await self.websocket.send_text(json.dumps(jsonable_encoder(frame)))
+                self.frames_sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Client went away mid-send; the receive loop notices the disconnect
+            logger.debug(f"Chat socket send failed for {self.user.id}: {str(e)}")
+
+    async def close(self, code: int = 1000):
+        if self._closed:
+            return
+        self._closed = True
+        self.cancel_reply()
+        if self._sender:
+            self._sender.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # already closed by the client
+
+class ChatConnectionRegistry:
+    """Open chat sockets in this worker, with one sweep for heartbeats and timeouts"""
+
+    def __init__(self, interval: float = WS_HEARTBEAT_SECONDS):
+        self.interval = interval
+        self.connections: Set[ChatConnection] = set()
+        self._task = None
+
+    @property
+    def depth(self) -> int:
+        """Open connections"""
+        return len(self.connections)
+
+    @property
+    def replies_in_flight(self) -> int:
+        return sum(1 for c in self.connections if c.busy)
+
+    def add(self, connection: ChatConnection):
+        self.connections.add(connection)
+
+    def discard(self, connection: ChatConnection):
+        self.connections.discard(connection)
+
+    def start(self):
+        self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self, code: int = 1001):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.gather(*(c.close(code) for c in list(self.connections)), return_exceptions=True)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Chat socket sweep failed: {str(e)}")
+
+    async def sweep(self):
+        now = time.monotonic()
+        utcnow = datetime.utcnow()
+        closing = []
+        for connection in list(self.connections):
+            if connection.token_expires_at and connection.token_expires_at <= utcnow:
+                closing.append(connection.close(CLOSE_TOKEN_EXPIRED))
+            elif now - connection.last_seen > WS_IDLE_TIMEOUT_SECONDS:
+                closing.append(connection.close(CLOSE_IDLE))
+            elif not connection.try_send({"type": "ping"}) and connection.frames_sent == connection.frames_sent_at_sweep:
+                # Queue full and nothing delivered for a whole heartbeat: the client isn't reading
+                closing.append(connection.close(CLOSE_TOO_SLOW))
+            connection.frames_sent_at_sweep = connection.frames_sent
+        if closing:
+            await asyncio.gather(*closing, return_exceptions=True)
+            self.connections = {c for c in self.connections if not c.closed}
+
+chat_connections = ChatConnectionRegistry()
@@ -1,31 +1,263 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
+from pymongo import IndexModel
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from typing import Dict, List
+import asyncio
+import hashlib
+import json
+import logging
 import os
+import random
+import socket
+import time
+
+from metrics import instrument
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
 db_name = os.environ.get('DB_NAME', 'ai_tutor')
+INDEX_PRUNE = os.environ.get('INDEX_PRUNE', 'false').lower() == 'true'
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))  # connections the driver keeps open
 
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, minPoolSize=MONGO_MIN_POOL_SIZE)
 db = client[db_name]
 
-# Collections
-users_collection = db.users
-books_collection = db.books
-videos_collection = db.videos
-quizzes_collection = db.quizzes
-quiz_attempts_collection = db.quiz_attempts
-chat_sessions_collection = db.chat_sessions
-topic_progress_collection = db.topic_progress
-student_profiles_collection = db.student_profiles
+# Collections (wrapped to record per-operation latency)
+users_collection = instrument(db.users)
+books_collection = instrument(db.books)
+videos_collection = instrument(db.videos)
+quizzes_collection = instrument(db.quizzes)
+quiz_attempts_collection = instrument(db.quiz_attempts)
+chat_sessions_collection = instrument(db.chat_sessions)
+chat_archive_index_collection = instrument(db.chat_archive_index)
+topic_progress_collection = instrument(db.topic_progress)
+student_profiles_collection = instrument(db.student_profiles)
+idempotency_keys_collection = instrument(db.idempotency_keys)
+jobs_collection = instrument(db.jobs)
+quiz_drafts_collection = instrument(db.quiz_drafts)
+topic_summaries_collection = instrument(db.topic_summaries)
+
+# Index registry: every index the app relies on, per collection. Add the index
+# here together with any new query shape (and add the shape to
+# tests/test_query_plans.py). Names are MongoDB's defaults, so indexes created
+# by earlier releases are recognised.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel("email", unique=True),
+        IndexModel("id", unique=True),
+    ],
+    "books": [
+        IndexModel("id", unique=True),
+        IndexModel([("approved", 1), ("stream", 1), ("class_level", 1), ("subject", 1), ("topic", 1)]),
+        IndexModel([("approved", 1), ("subject", 1), ("topic", 1)]),
+        IndexModel([("approved", 1), ("created_at", 1)]),  # retrieval sync
+    ],
+    "videos": [
+        IndexModel("id", unique=True),
+        IndexModel([("approved", 1), ("stream", 1), ("class_level", 1), ("subject", 1), ("topic", 1)]),
+        IndexModel([("approved", 1), ("subject", 1), ("topic", 1)]),
+        IndexModel([("approved", 1), ("created_at", 1)]),
+    ],
+    "quizzes": [
+        IndexModel("id", unique=True),
+        IndexModel([("stream", 1), ("class_level", 1), ("subject", 1), ("topic", 1)]),
+        IndexModel([("subject", 1), ("topic", 1)]),
+        IndexModel("created_at"),
+    ],
+    "quiz_attempts": [
+        IndexModel("id", unique=True),
+        IndexModel(
+            [("user_id", 1), ("client_attempt_id", 1)],
+            unique=True,
+            partialFilterExpression={"client_attempt_id": {"$type": "string"}}
+        ),
+        IndexModel([("user_id", 1), ("completed_at", -1)]),
+    ],
+    "chat_sessions": [
+        IndexModel("id", unique=True),
+        IndexModel([("user_id", 1), ("updated_at", -1)]),
+        IndexModel("updated_at"),  # archiver scans the idlest sessions
+    ],
+    "chat_archive_index": [
+        IndexModel([("user_id", 1), ("updated_at", -1)]),
+    ],
+    "topic_progress": [
+        IndexModel([("user_id", 1), ("subject", 1), ("topic", 1)]),
+    ],
+    "idempotency_keys": [
+        IndexModel("expires_at", expireAfterSeconds=0),
+    ],
+    "jobs": [
+        IndexModel("id", unique=True),
+        IndexModel([("status", 1), ("run_after", 1)]),
+        IndexModel([("status", 1), ("heartbeat_at", 1)]),  # expired leases
+        IndexModel([("status", 1), ("created_at", -1)]),
+        IndexModel([("created_at", -1)]),
+    ],
+    "topic_summaries": [
+        IndexModel(
+            [("subject", 1), ("topic", 1), ("stream", 1), ("class_level", 1), ("model_version", 1)],
+            unique=True
+        ),
+        IndexModel("model_version"),  # warmup scans one model version
+    ],
+    "quiz_drafts": [
+        IndexModel([("job_id", 1), ("stream", 1), ("class_level", 1), ("subject", 1), ("topic", 1)]),
+    ],
+}
+
+async def _sync_collection(name: str, models: List[IndexModel], prune: bool) -> Dict[str, List[str]]:
+    collection = db[name]
+    existing = await collection.index_information()
+    wanted = {model.document["name"] for model in models}
+    missing = [model for model in models if model.document["name"] not in existing]
+    created, dropped = [], []
+    for model in missing:
+        # One at a time: createIndexes with several specs is all-or-nothing, and
+        # mongomock drops partialFilterExpression from it
+        options = {k: v for k, v in model.document.items() if k != "key"}
+        created.append(await collection.create_index(list(model.document["key"].items()), **options))
+    if prune:
+        for index_name in existing:
+            if index_name != "_id_" and index_name not in wanted:
+                await collection.drop_index(index_name)
+                dropped.append(index_name)
+    unknown = [n for n in existing if n != "_id_" and n not in wanted and n not in dropped]
+    if created or dropped or unknown:
+        logger.info(f"Indexes on {name}: created {created}, dropped {dropped}, not in registry {unknown}")
+    return {"created": created, "dropped": dropped}
+
+async def sync_indexes(prune: bool = INDEX_PRUNE) -> Dict[str, Dict[str, List[str]]]:
+    """Create registry indexes that are missing; with prune, drop indexes the registry doesn't list
+
+    Idempotent: indexes that already exist under the same name are left alone.
+    Collections are synced concurrently. Returns the created and dropped index
+    names per collection.
+    """
+    results = await asyncio.gather(*(_sync_collection(name, models, prune) for name, models in INDEXES.items()))
+    return dict(zip(INDEXES, results))
+
+async def warm_pool(connections: int) -> int:
+    """Open up to this many pooled connections now rather than on the first requests"""
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(max(1, connections))))
+    return connections
 
 async def init_db():
     """Initialize database with indexes"""
-    # Create indexes for better query performance
-    await users_collection.create_index("email", unique=True)
-    await books_collection.create_index([("stream", 1), ("class_level", 1), ("subject", 1)])
-    await videos_collection.create_index([("stream", 1), ("class_level", 1), ("subject", 1)])
-    await quizzes_collection.create_index([("stream", 1), ("class_level", 1), ("subject", 1)])
-    await chat_sessions_collection.create_index("user_id")
-    await topic_progress_collection.create_index([("user_id", 1), ("subject", 1), ("topic", 1)])
+    await sync_indexes()
+
+# ---------- Index bootstrap for app workers ----------
+# Every worker calls bootstrap_indexes() in the background at startup. The
+# registry's fingerprint is stamped in schema_meta once the indexes exist, so
+# after the first deploy of a registry version workers only read one document.
+# When the stamp is stale, one worker takes a lease and syncs while the others
+# poll the stamp; an expired lease (crashed leader) is taken over. The leader
+# renews its lease while index builds run, however long they take. A failed
+# sync releases the lease and the worker tries again with backoff.
+
+INDEX_LEASE_SECONDS = float(os.environ.get('INDEX_LEASE_SECONDS', '300'))
+INDEX_POLL_SECONDS = float(os.environ.get('INDEX_POLL_SECONDS', '2'))
+INDEX_RETRY_BASE_SECONDS = float(os.environ.get('INDEX_RETRY_BASE_SECONDS', '1'))
+INDEX_RETRY_MAX_SECONDS = float(os.environ.get('INDEX_RETRY_MAX_SECONDS', '60'))
+
+schema_meta_collection = db.schema_meta
+
+def index_registry_version() -> str:
+    """Fingerprint of INDEXES; changes whenever an index is added, removed or altered"""
+    spec = {
+        name: sorted(json.dumps(model.document, sort_keys=True, default=str) for model in models)
+        for name, models in sorted(INDEXES.items())
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+INDEX_VERSION = index_registry_version()
+
+async def indexes_current() -> bool:
+    doc = await schema_meta_collection.find_one({"_id": "indexes"}, {"version": 1})
+    return bool(doc) and doc.get("version") == INDEX_VERSION
+
+async def _acquire_index_lease(owner: str) -> bool:
+    now = datetime.utcnow()
+    try:
+        await schema_meta_collection.update_one(
+            {
+                "_id": "indexes",
+                "version": {"$ne": INDEX_VERSION},
+                "$or": [{"lease_until": {"$not": {"$gt": now}}}, {"lease_owner": owner}],
+            },
+            {"$set": {"lease_owner": owner, "lease_until": now + timedelta(seconds=INDEX_LEASE_SECONDS)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False  # the stamp is current or another worker holds the lease
+
+async def _renew_index_lease(owner: str):
+    """Keep extending the lease while this worker builds indexes"""
+    while True:
+        await asyncio.sleep(INDEX_LEASE_SECONDS / 3)
+        try:
+            result = await schema_meta_collection.update_one(
+                {"_id": "indexes", "lease_owner": owner},
+                {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=INDEX_LEASE_SECONDS)}}
+            )
+        except Exception as e:
+            logger.warning(f"Could not renew the index lease: {str(e)}")
+            continue
+        if not result.matched_count:
+            logger.warning("Index lease lost while syncing; another worker may sync too")
+            return
+
+async def _sync_under_lease(owner: str):
+    started = time.perf_counter()
+    renewer = asyncio.create_task(_renew_index_lease(owner))
+    try:
+        await sync_indexes()
+    except BaseException:
+        renewer.cancel()
+        await schema_meta_collection.update_one(
+            {"_id": "indexes", "lease_owner": owner}, {"$set": {"lease_until": datetime.utcnow()}}
+        )
+        raise
+    finally:
+        renewer.cancel()
+    await schema_meta_collection.update_one(
+        {"_id": "indexes"},
+        {
+            "$set": {"version": INDEX_VERSION, "synced_at": datetime.utcnow(), "synced_by": owner},
+            "$unset": {"lease_owner": "", "lease_until": ""},
+        }
+    )
+    logger.info(f"Indexes synced to registry version {INDEX_VERSION} in {time.perf_counter() - started:.2f}s")
+
+async def bootstrap_indexes() -> str:
+    """Ensure the registry's indexes exist without every worker syncing them
+
+    Returns "current" when the stamp already matched, "synced" when this worker
+    built them, or "waited" when another worker did. Errors are retried with
+    backoff rather than raised, so a worker whose first attempt fails still
+    becomes ready once Mongo cooperates.
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    waited = False
+    failures = 0
+    while True:
+        try:
+            if await indexes_current():
+                return "waited" if waited else "current"
+            if await _acquire_index_lease(owner):
+                await _sync_under_lease(owner)
+                return "synced"
+            waited = True
+            delay = INDEX_POLL_SECONDS
+        except Exception as e:
+            failures += 1
+            ceiling = min(INDEX_RETRY_MAX_SECONDS, INDEX_RETRY_BASE_SECONDS * 2 ** (failures - 1))
+            delay = random.uniform(ceiling / 2, ceiling)
+            logger.error(f"Index bootstrap failed (attempt {failures}), retrying in {delay:.1f}s: {str(e)}")
+        await asyncio.sleep(delay)
@@ -0,0 +1,197 @@
+"""
+Response encoding negotiation as a pure ASGI middleware.
+
+JSON and text bodies above ENCODING_MIN_BYTES are compressed with brotli (when
+the brotli package is installed) or gzip, following the client's
+Accept-Encoding. Clients that send `Accept: application/msgpack` get JSON
+bodies re-encoded as MessagePack (when the msgpack package is installed).
+Encoded bodies of GET responses under ENCODING_CACHE_PREFIXES (the public
+catalog) are cached by content hash, so repeated hits skip recompression.
+Every compressible response carries `Vary: Accept, Accept-Encoding`, whether or
+not it was encoded. Streaming responses pass through untouched.
+"""
+from collections import OrderedDict
+from typing import Optional, Tuple
+import gzip
+import hashlib
+import json
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ENCODING_MIN_BYTES = int(os.getenv("ENCODING_MIN_BYTES", "1024"))
+ENCODING_GZIP_LEVEL = int(os.getenv("ENCODING_GZIP_LEVEL", "6"))
+ENCODING_BROTLI_QUALITY = int(os.getenv("ENCODING_BROTLI_QUALITY", "5"))
+ENCODING_CACHE_MAX_BYTES = int(os.getenv("ENCODING_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+ENCODING_CACHE_PREFIXES = tuple(
+    p for p in os.getenv(
+        "ENCODING_CACHE_PREFIXES", "/api/books,/api/videos,/api/quizzes,/api/metadata"
+    ).split(",") if p
+)
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+COMPRESSIBLE_TYPES = ("application/json", "application/msgpack", "text/", "application/javascript")
+
+def _accepted(header: str) -> dict:
+    """Media types or codings from an Accept-style header, mapped to their q-value"""
+    accepted = {}
+    for item in header.split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[name.lower()] = q
+    return accepted
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = _accepted(accept_encoding)
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", accepted.get("*", 0)) > 0:
+        return "gzip"
+    return None
+
+def wants_msgpack(accept: str) -> bool:
+    if msgpack is None:
+        return False
+    accepted = _accepted(accept)
+    return any(accepted.get(media_type, 0) > 0 for media_type in MSGPACK_TYPES)
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=ENCODING_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=ENCODING_GZIP_LEVEL, mtime=0)
+
+class EncodedBodyCache:
+    """LRU of encoded bodies keyed by (content hash, msgpack, encoding), bounded in bytes
+
+    Entries are (body, content type, content encoding or None).
+    """
+
+    def __init__(self, max_bytes: int = ENCODING_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, entry: tuple):
+        if len(entry[0]) > self.max_bytes // 8:
+            return
+        previous = self._entries.pop(key, None)
+        if previous:
+            self.size -= len(previous[0])
+        self._entries[key] = entry
+        self.size += len(entry[0])
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted[0])
+
+encoded_body_cache = EncodedBodyCache()
+
+class EncodingMiddleware:
+    def __init__(self, app, minimum_size: int = ENCODING_MIN_BYTES, cache: EncodedBodyCache = encoded_body_cache):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = choose_encoding(headers.get("accept-encoding", ""))
+        as_msgpack = wants_msgpack(headers.get("accept", ""))
+        # Even unencoded responses go through the responder, so shared caches see Vary on them too
+        cacheable = scope["method"] == "GET" and scope["path"].startswith(ENCODING_CACHE_PREFIXES)
+        responder = _EncodingResponder(send, encoding, as_msgpack, self.minimum_size, self.cache if cacheable else None)
+        await self.app(scope, receive, responder.send)
+
+class _EncodingResponder:
+    def __init__(self, send, encoding: Optional[str], as_msgpack: bool, minimum_size: int, cache: Optional[EncodedBodyCache]):
+        self._send = send
+        self.encoding = encoding
+        self.as_msgpack = as_msgpack
+        self.minimum_size = minimum_size
+        self.cache = cache
+        self._start = None
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self._start = message
+            return
+        if message["type"] == "http.response.body" and self._start is not None:
+            start, self._start = self._start, None
+            if message.get("more_body", False):
+                # Streaming response: leave it alone
+                await self._send(start)
+                await self._send(message)
+                return
+            start, body = self.encode(start, message.get("body", b""))
+            await self._send(start)
+            await self._send({"type": "http.response.body", "body": body})
+            return
+        await self._send(message)
+
+    def encode(self, start: dict, body: bytes) -> Tuple[dict, bytes]:
+        headers = MutableHeaders(raw=list(start["headers"]))
+        content_type = headers.get("content-type", "")
+        if (not body or "content-encoding" in headers or start["status"] < 200 or start["status"] in (204, 304)
+                or not content_type.startswith(COMPRESSIBLE_TYPES)):
+            return start, body
+
+        msgpack_body = self.as_msgpack and content_type.startswith("application/json")
+        if msgpack is not None:
+            headers.add_vary_header("Accept")
+        headers.add_vary_header("Accept-Encoding")
+        if not msgpack_body and (self.encoding is None or len(body) < self.minimum_size):
+            return {**start, "headers": headers.raw}, body
+        encoding = self.encoding
+
+        entry = None
+        key = None
+        if self.cache is not None:
+            key = (hashlib.blake2b(body, digest_size=16).digest(), msgpack_body, encoding)
+            entry = self.cache.get(key)
+        if entry is None:
+            entry = self.encode_body(body, content_type, msgpack_body, encoding)
+            if key is not None:
+                self.cache.put(key, entry)
+        body, content_type, encoding = entry
+
+        headers["content-type"] = content_type
+        if encoding:
+            headers["content-encoding"] = encoding
+        headers["content-length"] = str(len(body))
+        return {**start, "headers": headers.raw}, body
+
+    def encode_body(
+        self, body: bytes, content_type: str, msgpack_body: bool, encoding: Optional[str]
+    ) -> Tuple[bytes, str, Optional[str]]:
+        if msgpack_body:
+            body = msgpack.packb(json.loads(body))
+            content_type = MSGPACK_TYPES[0]
+        if encoding is None or len(body) < self.minimum_size:
+            return body, content_type, None
+        return compress(body, encoding), content_type, encoding
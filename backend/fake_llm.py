@@ -0,0 +1,57 @@
+"""
+Local stand-in for the emergentintegrations chat client, selected with LLM_PROVIDER=fake.
+
+Replies are canned, with configurable latency and injected failures so timeouts,
+retries, hedging and the circuit breaker in llm.py can be exercised without
+calling a real provider. The module-level settings may be changed at runtime,
+e.g. by a benchmark script flipping FAILURE_RATE mid-run. SLOW_NEXT and
+FAIL_NEXT make the next N calls stall or fail, for deterministic tests.
+"""
+import asyncio
+import os
+import random
+
+LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "200"))
+JITTER_MS = float(os.getenv("FAKE_LLM_JITTER_MS", "100"))
+SLOW_RATE = float(os.getenv("FAKE_LLM_SLOW_RATE", "0"))  # fraction of calls that stall
+SLOW_MS = float(os.getenv("FAKE_LLM_SLOW_MS", "10000"))
+FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE", "0"))
+SLOW_NEXT = 0
+FAIL_NEXT = 0
+
+class FakeProviderError(Exception):
+    pass
+
+class UserMessage:
+    def __init__(self, text: str):
+        self.text = text
+
+class LlmChat:
+    def __init__(self, api_key: str = None, session_id: str = None, system_message: str = None):
+        self.session_id = session_id
+        self.system_message = system_message
+        self.provider = "fake"
+        self.model = "fake"
+
+    def with_model(self, provider: str, model: str) -> "LlmChat":
+        self.provider = provider
+        self.model = model
+        return self
+
+    async def send_message(self, message: UserMessage) -> str:
+        global SLOW_NEXT, FAIL_NEXT
+        if SLOW_NEXT > 0:
+            SLOW_NEXT -= 1
+            latency = SLOW_MS
+        elif random.random() < SLOW_RATE:
+            latency = SLOW_MS
+        else:
+            latency = max(0.0, LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS))
+        fail = FAIL_NEXT > 0
+        if fail:
+            FAIL_NEXT -= 1
+        await asyncio.sleep(latency / 1000)
+
+        if fail or random.random() < FAILURE_RATE:
+            raise FakeProviderError("503 Service Unavailable (injected by fake provider)")
+        return f"[{self.model}] Here is an explanation for: {message.text[:200]}"
@@ -0,0 +1,391 @@
+"""
+Synthetic data generator for benchmarking at production size.
+
+Unlike seed_data.py (a handful of hand-written demo documents), this builds a
+whole deployment from a few parameters: schools with teachers and students, a
+catalog of books, videos and quizzes, quiz attempts, topic progress and chat
+sessions. Documents come from the pydantic models in models.py, so they have
+the same shape the API writes.
+
+Generation is deterministic by --seed. Every entity draws from its own random
+stream keyed by (seed, kind, index), so the output does not depend on
+--workers or batch sizes. Students are split into shards that worker
+processes generate and stream into Mongo with unordered insert_many batches.
+The catalog is small and is regenerated in each worker from the same seed
+instead of being shipped between processes. Indexes are created after the
+bulk load (init_db), which is much faster than maintaining them during it.
+
+All generated users share the password "password123". It is hashed once,
+because bcrypt per user would dominate the run.
+
+    python generate_data.py --schools 50 --students-per-school 2000 --attempts-per-student 100 --workers 8 --drop
+"""
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from typing import Dict, Iterator, List, Tuple
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from models import (
+    Book, ChatMessage, ChatSession, DifficultyLevel, Quiz, QuizAttempt, QuizQuestion, Stream,
+    StudentProfile, TopicProgress, UserInDB, UserRole, Video
+)
+
+load_dotenv()
+
+PASSWORD = "password123"
+
+SUBJECTS = {
+    "Mathematics": ["Quadratic Equations", "Trigonometry", "Probability", "Calculus", "Coordinate Geometry", "Statistics"],
+    "Physics": ["Newton's Laws of Motion", "Kinematics", "Work and Energy", "Gravitation", "Electrostatics", "Optics"],
+    "Chemistry": ["Chemical Kinetics", "Atomic Structure", "Chemical Bonding", "Thermodynamics", "Organic Basics"],
+    "Biology": ["Cell Structure", "Photosynthesis", "Genetics", "Human Physiology", "Ecology"],
+    "English": ["Tenses and Verb Forms", "Reported Speech", "Comprehension", "Essay Writing"],
+}
+TOPICS = [(subject, topic) for subject, topics in SUBJECTS.items() for topic in topics]
+CLASS_LEVELS = [8, 9, 10, 11, 12]
+FIRST_NAMES = ["Aarav", "Diya", "Ishaan", "Ananya", "Kabir", "Meera", "Rohan", "Saanvi", "Vivaan", "Zara", "Arjun", "Priya"]
+LAST_NAMES = ["Sharma", "Iyer", "Khan", "Das", "Patel", "Reddy", "Singh", "Fernandes", "Gupta", "Nair"]
+QUESTIONS = [
+    "Can you explain {topic} with an example?",
+    "Why does {topic} matter for the board exam?",
+    "I got a {topic} question wrong, can you walk me through it?",
+    "Summarise {topic} in five points",
+]
+
+def rng_for(seed: int, kind: str, index: int) -> random.Random:
+    # str seeds are hashed with SHA-512, so streams are stable across runs and processes
+    return random.Random(f"{seed}:{kind}:{index}")
+
+def stable_id(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+class Generator:
+    """Deterministic documents for one configuration"""
+
+    def __init__(self, config: argparse.Namespace, password_hash: str):
+        self.config = config
+        self.password_hash = password_hash
+        self.until = datetime.fromisoformat(config.until)
+        self.quizzes = [self.quiz(i) for i in range(config.quizzes)]
+        self.quizzes_by_cohort: Dict[Tuple[str, int], List[Quiz]] = {}
+        for quiz in self.quizzes:
+            self.quizzes_by_cohort.setdefault((quiz.stream.value, quiz.class_level), []).append(quiz)
+
+    def moment(self, rng: random.Random) -> datetime:
+        return self.until - timedelta(seconds=rng.randrange(self.config.days * 86400))
+
+    def school_stream(self, school: int) -> Stream:
+        return rng_for(self.config.seed, "school", school).choice(list(Stream))
+
+    def teacher_id(self, index: int) -> str:
+        return stable_id(rng_for(self.config.seed, "teacher", index))
+
+    # ---------- catalog ----------
+
+    def teachers(self) -> Iterator[dict]:
+        for i in range(self.config.schools * self.config.teachers_per_school):
+            rng = rng_for(self.config.seed, "teacher", i)
+            teacher = UserInDB(
+                id=stable_id(rng),
+                email=f"teacher{i}@school{i // self.config.teachers_per_school}.example.com",
+                full_name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                role=UserRole.TEACHER,
+                password_hash=self.password_hash,
+                created_at=self.moment(rng),
+                profile_data={"school": f"School {i // self.config.teachers_per_school}"},
+            )
+            yield teacher.dict()
+
+    def _content(self, rng: random.Random) -> dict:
+        subject, topic = rng.choice(TOPICS)
+        teacher_count = self.config.schools * self.config.teachers_per_school
+        return {
+            "stream": rng.choice(list(Stream)),
+            "class_level": rng.choice(CLASS_LEVELS),
+            "subject": subject,
+            "topic": topic,
+            "uploaded_by": self.teacher_id(rng.randrange(teacher_count)),
+            "created_at": self.moment(rng),
+        }
+
+    def books(self) -> Iterator[dict]:
+        for i in range(self.config.books):
+            rng = rng_for(self.config.seed, "book", i)
+            common = self._content(rng)
+            book = Book(
+                id=stable_id(rng),
+                title=f"{common['topic']} - Study Notes {i}",
+                author=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                summary=f"Concepts, worked examples and exercises on {common['topic']} for {common['subject']}.",
+                tags=[common["subject"].lower(), common["topic"].lower()],
+                approved=rng.random() < 0.95,
+                **common,
+            )
+            yield book.dict()
+
+    def videos(self) -> Iterator[dict]:
+        for i in range(self.config.videos):
+            rng = rng_for(self.config.seed, "video", i)
+            common = self._content(rng)
+            video = Video(
+                id=stable_id(rng),
+                title=f"{common['topic']} - Lecture {i}",
+                teacher_name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                video_url=f"https://www.youtube.com/embed/{stable_id(rng)[:11]}",
+                duration=rng.randrange(300, 3600),
+                difficulty=rng.choice(list(DifficultyLevel)),
+                description=f"Lecture on {common['topic']}",
+                tags=[common["subject"].lower()],
+                approved=rng.random() < 0.95,
+                **common,
+            )
+            yield video.dict()
+
+    def quiz(self, i: int) -> Quiz:
+        rng = rng_for(self.config.seed, "quiz", i)
+        common = self._content(rng)
+        created_by = common.pop("uploaded_by")
+        return Quiz(
+            id=stable_id(rng),
+            title=f"{common['topic']} - Practice Quiz {i}",
+            difficulty=rng.choice(list(DifficultyLevel)),
+            questions=[
+                QuizQuestion(
+                    question=f"{common['topic']}: question {q + 1}",
+                    options=[f"Option {o + 1}" for o in range(4)],
+                    correct_answer=rng.randrange(4),
+                    explanation=f"Follows from the definition used in {common['topic']}.",
+                )
+                for q in range(self.config.questions_per_quiz)
+            ],
+            created_by=created_by,
+            **common,
+        )
+
+    # ---------- per-student data ----------
+
+    def student(self, i: int) -> Iterator[Tuple[str, dict]]:
+        """(collection, document) pairs for student i: user, profile, attempts, progress, chat sessions"""
+        config = self.config
+        rng = rng_for(config.seed, "student", i)
+        school = i // config.students_per_school
+        stream = self.school_stream(school)
+        class_level = rng.choice(CLASS_LEVELS)
+        user_id = stable_id(rng)
+        joined = self.moment(rng)
+
+        yield "users", UserInDB(
+            id=user_id,
+            email=f"student{i}@school{school}.example.com",
+            full_name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            role=UserRole.STUDENT,
+            password_hash=self.password_hash,
+            created_at=joined,
+            profile_data={"school": f"School {school}"},
+        ).dict()
+        subjects = rng.sample(list(SUBJECTS), k=3)
+        yield "student_profiles", StudentProfile(
+            user_id=user_id, stream=stream, class_level=class_level, subjects=subjects,
+            learning_pace=rng.choice(["slow", "steady", "fast"]),
+        ).dict()
+
+        # Attempts: high volume, so models are built without re-validating generated values
+        skill = rng.uniform(0.3, 0.95)
+        quizzes = self.quizzes_by_cohort.get((stream.value, class_level)) or self.quizzes
+        progress: Dict[Tuple[str, str], list] = {}  # (subject, topic) -> [attempts, score total, last]
+        for _ in range(config.attempts_per_student):
+            quiz = rng.choice(quizzes)
+            answers = [
+                q.correct_answer if rng.random() < skill else rng.randrange(4) for q in quiz.questions
+            ]
+            correct = sum(a == q.correct_answer for a, q in zip(answers, quiz.questions))
+            score = correct / len(quiz.questions) * 100 if quiz.questions else 0
+            completed_at = self.moment(rng)
+            yield "quiz_attempts", QuizAttempt.model_construct(
+                id=stable_id(rng), quiz_id=quiz.id, user_id=user_id, answers=answers,
+                question_ids=None, score=score, client_attempt_id=None, completed_at=completed_at,
+            ).dict()
+            entry = progress.setdefault((quiz.subject, quiz.topic), [0, 0.0, completed_at])
+            entry[0] += 1
+            entry[1] += score
+            entry[2] = max(entry[2], completed_at)
+
+        for (subject, topic), (attempts, total, last) in progress.items():
+            average = total / attempts
+            yield "topic_progress", TopicProgress.model_construct(
+                user_id=user_id, stream=stream, class_level=class_level, subject=subject, topic=topic,
+                mastery_level=average, time_spent=rng.randrange(10, 600), quiz_attempts=attempts,
+                average_score=average, last_accessed=last,
+            ).dict()
+
+        for _ in range(config.sessions_per_student):
+            subject, topic = rng.choice(TOPICS)
+            started = self.moment(rng)
+            messages = []
+            for turn in range(config.turns_per_session):
+                at = started + timedelta(minutes=2 * turn)
+                messages.append(ChatMessage.model_construct(
+                    role="user", content=rng.choice(QUESTIONS).format(topic=topic), timestamp=at
+                ))
+                messages.append(ChatMessage.model_construct(
+                    role="assistant",
+                    content=f"Here is how to think about {topic}: start from the definition, then work one example step by step.",
+                    timestamp=at + timedelta(seconds=rng.randrange(2, 20)),
+                ))
+            yield "chat_sessions", ChatSession.model_construct(
+                id=stable_id(rng), user_id=user_id, topic=topic, subject=subject, messages=messages,
+                summary=None, summary_upto=0, created_at=started,
+                updated_at=messages[-1].timestamp if messages else started,
+            ).dict()
+
+# ---------- loading ----------
+
+class BatchWriter:
+    """Buffers documents per collection and flushes with unordered insert_many"""
+
+    def __init__(self, db, batch_size: int):
+        self.db = db
+        self.batch_size = batch_size
+        self.buffers: Dict[str, List[dict]] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, collection: str, doc: dict):
+        buffer = self.buffers.setdefault(collection, [])
+        buffer.append(doc)
+        if len(buffer) >= self.batch_size:
+            self.flush(collection)
+
+    def flush(self, collection: str):
+        buffer = self.buffers.get(collection)
+        if buffer:
+            self.db[collection].insert_many(buffer, ordered=False)
+            self.counts[collection] = self.counts.get(collection, 0) + len(buffer)
+            self.buffers[collection] = []
+
+    def close(self) -> Dict[str, int]:
+        for collection in list(self.buffers):
+            self.flush(collection)
+        return self.counts
+
+def _open_db(config: argparse.Namespace):
+    return MongoClient(config.mongo_url)[config.db_name]
+
+def load_catalog(config: argparse.Namespace, password_hash: str) -> Dict[str, int]:
+    generator = Generator(config, password_hash)
+    db = _open_db(config)
+    writer = BatchWriter(db, config.batch_size)
+    for doc in generator.teachers():
+        writer.add("users", doc)
+    for doc in generator.books():
+        writer.add("books", doc)
+    for doc in generator.videos():
+        writer.add("videos", doc)
+    for quiz in generator.quizzes:
+        writer.add("quizzes", quiz.dict())
+    counts = writer.close()
+    db.client.close()
+    return counts
+
+# Per-process state, set up once by the pool initializer
+_worker_generator = None
+_worker_db = None
+
+def _init_worker(config: argparse.Namespace, password_hash: str):
+    global _worker_generator, _worker_db
+    _worker_generator = Generator(config, password_hash)
+    _worker_db = _open_db(config)
+
+def load_students(shard: Tuple[int, int]) -> Dict[str, int]:
+    """Generate and insert students [start, stop); returns documents written per collection"""
+    start, stop = shard
+    writer = BatchWriter(_worker_db, _worker_generator.config.batch_size)
+    for i in range(start, stop):
+        for collection, doc in _worker_generator.student(i):
+            writer.add(collection, doc)
+    return writer.close()
+
+def _merge(total: Dict[str, int], counts: Dict[str, int]):
+    for collection, count in counts.items():
+        total[collection] = total.get(collection, 0) + count
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic dataset")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--schools", type=int, default=10)
+    parser.add_argument("--students-per-school", type=int, default=500)
+    parser.add_argument("--teachers-per-school", type=int, default=10)
+    parser.add_argument("--books", type=int, default=2000)
+    parser.add_argument("--videos", type=int, default=2000)
+    parser.add_argument("--quizzes", type=int, default=1000)
+    parser.add_argument("--questions-per-quiz", type=int, default=10)
+    parser.add_argument("--attempts-per-student", type=int, default=20)
+    parser.add_argument("--sessions-per-student", type=int, default=3)
+    parser.add_argument("--turns-per-session", type=int, default=4)
+    parser.add_argument("--days", type=int, default=180, help="spread timestamps over this many days")
+    parser.add_argument("--until", default="2026-01-01T00:00:00", help="latest timestamp (fixed for determinism)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes; 1 runs in-process")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--shard-size", type=int, default=500, help="students per work unit")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017/"))
+    parser.add_argument("--db-name", default=os.environ.get("DB_NAME", "ai_tutor"))
+    parser.add_argument("--drop", action="store_true", help="drop the generated collections first")
+    parser.add_argument("--skip-indexes", action="store_true", help="don't run init_db after loading")
+    config = parser.parse_args()
+
+    from auth import get_password_hash
+    password_hash = get_password_hash(PASSWORD)
+
+    if config.drop:
+        db = _open_db(config)
+        for collection in ("users", "student_profiles", "books", "videos", "quizzes",
+                           "quiz_attempts", "topic_progress", "chat_sessions"):
+            db.drop_collection(collection)
+        db.client.close()
+
+    started = time.perf_counter()
+    totals = load_catalog(config, password_hash)
+    print(f"✓ Catalog: {totals}")
+
+    students = config.schools * config.students_per_school
+    shards = [(start, min(start + config.shard_size, students)) for start in range(0, students, config.shard_size)]
+    done = 0
+    if config.workers <= 1:
+        _init_worker(config, password_hash)
+        results = map(load_students, shards)
+        pool = None
+    else:
+        pool = get_context("spawn").Pool(config.workers, initializer=_init_worker, initargs=(config, password_hash))
+        results = pool.imap_unordered(load_students, shards)
+    try:
+        for counts in results:
+            _merge(totals, counts)
+            done += 1
+            elapsed = time.perf_counter() - started
+            written = sum(totals.values())
+            print(f"  {done}/{len(shards)} shards, {written} documents, {written / elapsed:,.0f} docs/s", flush=True)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.perf_counter() - started
+    print(f"✓ Loaded {sum(totals.values())} documents in {elapsed:.1f}s: {totals}")
+
+    if not config.skip_indexes:
+        os.environ["MONGO_URL"] = config.mongo_url
+        os.environ["DB_NAME"] = config.db_name
+        from database import init_db
+        index_started = time.perf_counter()
+        asyncio.run(init_db())
+        print(f"✓ Indexes built in {time.perf_counter() - index_started:.1f}s")
+
+if __name__ == "__main__":
+    main()
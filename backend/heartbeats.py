@@ -0,0 +1,123 @@
+"""
+In-memory coalescing of study-time heartbeats.
+
+Clients report watch/reading time every 15-30 s. Heartbeats only bump a counter
+per (user, subject, topic); a background task periodically turns the totals into
+one batched $inc upsert per key, so the Mongo write rate depends on the number
+of active topics per flush interval rather than on the heartbeat rate.
+
+time_spent is stored in whole minutes. The sub-minute remainder of a key is
+carried to the next flush while heartbeats keep arriving for it, and dropped
+once the key has been quiet for HEARTBEAT_CARRY_SECONDS or the worker stops:
+at most 59 s per study stretch goes unrecorded, and nothing is ever rounded up.
+"""
+from typing import Dict, List
+import asyncio
+import logging
+import os
+import time
+
+from pymongo.errors import BulkWriteError
+
+from database import topic_progress_collection
+from progress import ProgressKey, time_spent_update
+from tracing import background_task
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_FLUSH_SECONDS = float(os.getenv("HEARTBEAT_FLUSH_SECONDS", "10"))
+HEARTBEAT_MAX_SECONDS = int(os.getenv("HEARTBEAT_MAX_SECONDS", "120"))  # cap per heartbeat
+HEARTBEAT_CARRY_SECONDS = float(os.getenv("HEARTBEAT_CARRY_SECONDS", "300"))
+
+class HeartbeatCoalescer:
+    """Accumulates seconds per progress key and flushes whole minutes in bulk"""
+
+    def __init__(
+        self, flush_interval: float = HEARTBEAT_FLUSH_SECONDS, carry_seconds: float = HEARTBEAT_CARRY_SECONDS
+    ):
+        self.flush_interval = flush_interval
+        self.carry_seconds = carry_seconds
+        self._pending: Dict[ProgressKey, List] = {}  # key -> [stream, class_level, seconds, last heartbeat]
+        self._task = None
+        self._stopping = False
+        self._wakeup = None
+
+    @property
+    def depth(self) -> int:
+        """Progress keys with unflushed time"""
+        return len(self._pending)
+
+    def record(self, key: ProgressKey, stream: str, class_level: int, seconds: int):
+        self._add(key, stream, class_level, max(0, min(seconds, HEARTBEAT_MAX_SECONDS)), time.monotonic())
+
+    def _add(self, key: ProgressKey, stream: str, class_level: int, seconds: int, seen: float):
+        """Add already-accepted seconds, without the per-heartbeat cap"""
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [stream, class_level, seconds, seen]
+        else:
+            entry[2] += seconds
+            entry[3] = max(entry[3], seen)
+
+    def start(self):
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = background_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the flush loop and write out every pending whole minute
+
+        The loop is not cancelled: a flush being written finishes (or puts its
+        minutes back) first, so nothing swapped out of _pending is lost.
+        """
+        self._stopping = True
+        if self._task:
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush(final=True)
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                return
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Heartbeat flush failed, will retry: {str(e)}")
+
+    async def flush(self, final: bool = False):
+        """Write whole pending minutes; remainders are carried, or dropped when stale or final"""
+        pending, self._pending = self._pending, {}
+        quiet_since = time.monotonic() - self.carry_seconds
+
+        operations = []
+        written = []  # (key, stream, class_level, minutes, seen) per operation
+        for key, (stream, class_level, seconds, seen) in pending.items():
+            minutes, remainder = divmod(seconds, 60)
+            if remainder and not final and seen >= quiet_since:
+                self._add(key, stream, class_level, remainder, seen)
+            if minutes:
+                operations.append(time_spent_update(key, stream, class_level, minutes))
+                written.append((key, stream, class_level, minutes, seen))
+
+        if not operations:
+            return
+        try:
+            await topic_progress_collection.bulk_write(operations, ordered=False)
+        except BaseException as e:
+            # Put back the minutes that weren't written so the next flush retries them;
+            # a BulkWriteError says which operations failed, anything else may have written none
+            if isinstance(e, BulkWriteError):
+                failed = [written[error["index"]] for error in e.details.get("writeErrors", [])]
+            else:
+                failed = written
+            for key, stream, class_level, minutes, seen in failed:
+                self._add(key, stream, class_level, minutes * 60, seen)
+            raise
+
+heartbeat_coalescer = HeartbeatCoalescer()
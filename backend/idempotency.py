@@ -0,0 +1,161 @@
+"""
+Idempotency-Key support for non-idempotent POST handlers.
+
+The first request for a key claims it in idempotency_keys_collection and runs
+the handler; its JSON response is stored for IDEMPOTENCY_TTL_SECONDS (a TTL
+index expires it). Duplicates that arrive while the original is still running
+wait for its result, in-process via a shared future or across workers by
+polling the stored record. Completed keys replay the stored response.
+
+A claim holds a lease (IDEMPOTENCY_LEASE_SECONDS) that the running request
+keeps renewing. If its worker dies mid-handler the lease runs out, and the next
+request with the key takes the claim over and runs the handler, instead of
+every retry getting a 409 until the record expires.
+"""
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+
+from database import idempotency_keys_collection
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "120"))
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "30"))
+IDEMPOTENCY_POLL_SECONDS = 0.25
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+# Requests currently running in this worker, keyed by scoped idempotency key
+_in_flight: Dict[str, asyncio.Future] = {}
+
+def request_fingerprint(payload: Any) -> str:
+    """Stable hash of a request body, used to reject key reuse with a different body"""
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+def _lease_until() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+
+async def _take_over(scoped_key: str, owner: str) -> bool:
+    """Claim an in-progress key whose lease has run out (its worker died mid-handler)"""
+    record = await idempotency_keys_collection.find_one_and_update(
+        {"_id": scoped_key, "status": "in_progress", "lease_until": {"$not": {"$gte": datetime.utcnow()}}},
+        {"$set": {"owner": owner, "lease_until": _lease_until()}}
+    )
+    return record is not None
+
+async def _renew_lease(scoped_key: str, owner: str):
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_LEASE_SECONDS / 3)
+        await idempotency_keys_collection.update_one(
+            {"_id": scoped_key, "owner": owner}, {"$set": {"lease_until": _lease_until()}}
+        )
+
+async def _wait_for_stored(scoped_key: str, owner: str) -> Tuple[Optional[dict], bool]:
+    """(completed record, False), (None, False) once the key is released, or (None, True) after a takeover"""
+    deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        if await _take_over(scoped_key, owner):
+            return None, True
+        if asyncio.get_running_loop().time() >= deadline:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+        record = await idempotency_keys_collection.find_one({"_id": scoped_key})
+        if not record:
+            # Original failed and released the key
+            return None, False
+        if record.get("status") == "completed":
+            return record, False
+
+async def run_idempotent(
+    idempotency_key: Optional[str],
+    user_id: str,
+    scope: str,
+    payload: Any,
+    handler: Callable[[], Awaitable[Any]]
+) -> Any:
+    """Run handler at most once per (user, scope, key) and replay its response afterwards"""
+    if not idempotency_key:
+        return await handler()
+    if len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+
+    scoped_key = f"{user_id}:{scope}:{idempotency_key}"
+    fingerprint = request_fingerprint(payload)
+    owner = uuid.uuid4().hex
+
+    while True:
+        # Same worker: share the original's result directly
+        in_flight = _in_flight.get(scoped_key)
+        if in_flight is not None:
+            try:
+                fingerprint_in_flight, result = await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if in_flight.cancelled():
+                    # Original was abandoned (e.g. client disconnected); claim the key instead
+                    continue
+                raise
+            if fingerprint_in_flight != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was reused with a different request")
+            return result
+
+        try:
+            await idempotency_keys_collection.insert_one({
+                "_id": scoped_key,
+                "status": "in_progress",
+                "fingerprint": fingerprint,
+                "owner": owner,
+                "lease_until": _lease_until(),
+                "expires_at": datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+            })
+            break
+        except DuplicateKeyError:
+            pass
+
+        record = await idempotency_keys_collection.find_one({"_id": scoped_key})
+        if record and record.get("fingerprint") != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was reused with a different request")
+        if record and record.get("status") == "in_progress":
+            record, claimed = await _wait_for_stored(scoped_key, owner)
+            if claimed:
+                break
+        if record:
+            return record["response"]
+        # Key was released by a failed original; try to claim it ourselves
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[scoped_key] = future
+    renewer = asyncio.create_task(_renew_lease(scoped_key, owner))
+    try:
+        result = await handler()
+        response = jsonable_encoder(result)
+        renewer.cancel()
+        await idempotency_keys_collection.update_one(
+            {"_id": scoped_key, "owner": owner},
+            {
+                "$set": {"status": "completed", "response": response, "completed_at": datetime.utcnow()},
+                "$unset": {"lease_until": ""},
+            }
+        )
+        future.set_result((fingerprint, response))
+        return response
+    except BaseException as e:
+        # Let the client retry a failed request with the same key, unless another request took it over
+        renewer.cancel()
+        await idempotency_keys_collection.delete_one({"_id": scoped_key, "owner": owner})
+        if isinstance(e, asyncio.CancelledError):
+            future.cancel()
+        else:
+            future.set_exception(e)
+            # Mark retrieved so failures without waiters don't log "exception never retrieved"
+            future.exception()
+        raise
+    finally:
+        renewer.cancel()
+        _in_flight.pop(scoped_key, None)
@@ -0,0 +1,235 @@
+"""
+In-process background job runner backed by jobs_collection.
+
+Jobs are claimed atomically with find_one_and_update, so several workers can
+share one queue. Failures are retried with exponential backoff and jitter up to
+max_attempts, except for JobParamsInvalid, which fails the job at once; job
+types can register a params validator so bad params are rejected at enqueue
+time instead. Handlers report progress through JobContext.report(), which also
+refreshes the job's lease and raises JobCancelled once cancellation has been
+requested. Jobs whose lease expires (the worker died) are claimed again; jobs
+still running when a worker is stopped are put straight back on the queue.
+"""
+from pymongo import ReturnDocument
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+import os
+import random
+import uuid
+
+from database import jobs_collection
+from models import Job, JobStatus
+from tracing import background_task
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "600"))
+
+class JobCancelled(Exception):
+    pass
+
+class JobParamsInvalid(ValueError):
+    """The job's params can't be used; retrying wouldn't help"""
+
+class JobContext:
+    def __init__(self, job: Job):
+        self.job = job
+
+    async def report(self, progress: float, message: Optional[str] = None):
+        """Record progress and renew the lease; raises JobCancelled if cancellation was requested"""
+        now = datetime.utcnow()
+        doc = await jobs_collection.find_one_and_update(
+            {"id": self.job.id},
+            {"$set": {
+                "progress": round(min(max(progress, 0), 100), 2),
+                "progress_message": message,
+                "heartbeat_at": now,
+                "updated_at": now,
+            }},
+            projection={"_id": 0, "cancel_requested": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if doc and doc.get("cancel_requested"):
+            raise JobCancelled()
+
+JobHandler = Callable[[Job, JobContext], Awaitable[Optional[dict]]]
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with equal jitter: at least half the ceiling, so retries never come straight back"""
+    ceiling = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return random.uniform(ceiling / 2, ceiling)
+
+class JobRunner:
+    def __init__(self, concurrency: int = JOB_WORKER_CONCURRENCY):
+        self.concurrency = concurrency
+        self.worker_id = str(uuid.uuid4())
+        self.handlers: Dict[str, JobHandler] = {}
+        self.validators: Dict[str, Callable[[dict], None]] = {}
+        self._workers = []
+        self._running: Dict[str, asyncio.Task] = {}  # job id -> task running its handler
+        self._wakeup = asyncio.Event()
+        self._claiming = False
+
+    @property
+    def depth(self) -> int:
+        """Jobs currently executing in this worker"""
+        return len(self._running)
+
+    def register(self, job_type: str, validate: Optional[Callable[[dict], None]] = None):
+        """Register a handler; validate(params) raises JobParamsInvalid for params it can't run with"""
+        def decorator(handler: JobHandler) -> JobHandler:
+            self.handlers[job_type] = handler
+            if validate is not None:
+                self.validators[job_type] = validate
+            return handler
+        return decorator
+
+    def validate(self, job_type: str, params: dict):
+        validator = self.validators.get(job_type)
+        if validator is not None:
+            validator(params)
+
+    async def enqueue(self, job: Job) -> Job:
+        await jobs_collection.insert_one(job.dict())
+        self._wakeup.set()
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        """Cancel a queued job immediately, or flag a running one to stop at its next report"""
+        now = datetime.utcnow()
+        doc = await jobs_collection.find_one_and_update(
+            {"id": job_id, "status": JobStatus.QUEUED},
+            {"$set": {"status": JobStatus.CANCELLED, "cancel_requested": True, "updated_at": now}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if doc:
+            return doc
+
+        doc = await jobs_collection.find_one_and_update(
+            {"id": job_id, "status": JobStatus.RUNNING},
+            {"$set": {"cancel_requested": True, "updated_at": now}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        task = self._running.get(job_id)
+        if task:
+            task.cancel()
+        return doc or await jobs_collection.find_one({"id": job_id}, {"_id": 0})
+
+    def start(self):
+        self._claiming = True
+        self._workers = [background_task(self._worker_loop()) for _ in range(self.concurrency)]
+
+    def pause(self):
+        """Stop claiming new jobs; running ones carry on"""
+        self._claiming = False
+        self._wakeup.set()
+
+    async def stop(self, timeout: float = 0):
+        """Stop claiming, give running jobs up to timeout seconds, then cancel and requeue the rest"""
+        self.pause()
+        if self._workers and timeout > 0:
+            await asyncio.wait(self._workers, timeout=timeout)
+        interrupted = list(self._running)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if interrupted:
+            await self._requeue(interrupted)
+
+    async def _requeue(self, job_ids: List[str]):
+        """Hand interrupted jobs to another worker now instead of after their lease expires"""
+        now = datetime.utcnow()
+        result = await jobs_collection.update_many(
+            {"id": {"$in": job_ids}, "worker_id": self.worker_id, "status": JobStatus.RUNNING},
+            {
+                "$set": {"status": JobStatus.QUEUED, "run_after": now, "updated_at": now},
+                "$inc": {"attempts": -1},  # the interruption isn't the job's fault
+            }
+        )
+        logger.info(f"Requeued {result.modified_count} interrupted jobs")
+
+    async def _claim(self) -> Optional[Job]:
+        now = datetime.utcnow()
+        doc = await jobs_collection.find_one_and_update(
+            {
+                "type": {"$in": list(self.handlers)},
+                "$or": [
+                    {"status": JobStatus.QUEUED, "run_after": {"$lte": now}},
+                    {"status": JobStatus.RUNNING, "heartbeat_at": {"$lt": now - timedelta(seconds=JOB_LEASE_SECONDS)}},
+                ],
+            },
+            {
+                "$set": {"status": JobStatus.RUNNING, "worker_id": self.worker_id, "heartbeat_at": now, "updated_at": now},
+                "$inc": {"attempts": 1},
+            },
+            projection={"_id": 0},
+            sort=[("run_after", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        return Job(**doc) if doc else None
+
+    async def _worker_loop(self):
+        while self._claiming:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                logger.error(f"Job claim failed: {str(e)}")
+                job = None
+
+            if job is None:
+                await self._idle()
+                continue
+
+            await self._run(job)
+
+    async def _idle(self):
+        """Wait for the poll interval or until a job is enqueued, whichever comes first"""
+        timer = asyncio.get_running_loop().call_later(JOB_POLL_SECONDS, self._wakeup.set)
+        try:
+            await self._wakeup.wait()
+        finally:
+            timer.cancel()
+        self._wakeup.clear()
+
+    async def _run(self, job: Job):
+        task = asyncio.create_task(self.handlers[job.type](job, JobContext(job)))
+        self._running[job.id] = task
+        try:
+            result = await asyncio.shield(task)
+            await self._finish(job, {"status": JobStatus.SUCCEEDED, "progress": 100, "result": result})
+        except (JobCancelled, asyncio.CancelledError):
+            if not task.done():
+                # The worker itself is being stopped; leave the lease to expire so another worker resumes it
+                task.cancel()
+                raise
+            await self._finish(job, {"status": JobStatus.CANCELLED})
+        except JobParamsInvalid as e:
+            logger.error(f"Job {job.id} ({job.type}) has invalid params: {str(e)}")
+            await self._finish(job, {"status": JobStatus.FAILED, "error": str(e)})
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.type}) attempt {job.attempts} failed: {str(e)}")
+            if job.attempts < job.max_attempts:
+                await self._finish(job, {
+                    "status": JobStatus.QUEUED,
+                    "error": str(e),
+                    "run_after": datetime.utcnow() + timedelta(seconds=retry_delay(job.attempts)),
+                })
+            else:
+                await self._finish(job, {"status": JobStatus.FAILED, "error": str(e)})
+        finally:
+            self._running.pop(job.id, None)
+
+    async def _finish(self, job: Job, update: dict):
+        update["updated_at"] = datetime.utcnow()
+        await jobs_collection.update_one({"id": job.id, "worker_id": self.worker_id}, {"$set": update})
+
+job_runner = JobRunner()
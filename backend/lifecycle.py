@@ -0,0 +1,249 @@
+"""
+Worker lifecycle: warm up before reporting ready, drain before shutting down.
+
+Startup: once the app's components are started, the registered warm-up steps
+(index bootstrap, connection pools, in-memory caches, the LLM SDK import) run
+concurrently in the background, each with WARMUP_TIMEOUT_SECONDS unless
+registered with its own timeout. A step registered with timeout=None (the index
+bootstrap) has no deadline and is not cancelled by a drain, since interrupting
+an index build only makes the next worker start it again. The worker reports
+ready at /api/ready when every required step has succeeded and the probes
+pass. Optional steps that fail or time out are logged, and their only cost is
+a cold first request.
+
+Shutdown: drain() stops readiness, rejects new HTTP requests and WebSockets
+with 503 / close 1012 (clients retry on another worker) and runs the drain
+hooks (e.g. stop claiming jobs). It then waits up to DRAIN_TIMEOUT_SECONDS for
+every busy counter to reach zero: in-flight requests, chat replies, jobs and
+LLM calls. The shutdown hook tears the rest down afterwards.
+
+uvicorn closes open WebSockets as soon as it begins shutting down, before the
+app's shutdown hook runs, which would cut chat replies off mid-answer. So on
+SIGTERM the worker drains first and then hands over to uvicorn's graceful
+shutdown by sending itself SIGINT. A second SIGTERM skips what is left of the
+drain.
+"""
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+import asyncio
+import logging
+import os
+import signal
+import threading
+import time
+
+from starlette.responses import JSONResponse
+
+from chat_socket import CLOSE_SERVICE_RESTART
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "30"))
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "25"))
+DRAIN_ON_SIGTERM = os.getenv("DRAIN_ON_SIGTERM", "true").lower() == "true"
+READY_PROBE_TIMEOUT_SECONDS = float(os.getenv("READY_PROBE_TIMEOUT_SECONDS", "2"))
+DRAIN_POLL_SECONDS = 0.05
+
+# Still served while draining: probes and scrapes must see the worker go unready
+EXEMPT_PATHS = {"/api/health", "/api/ready", "/metrics"}
+
+class WarmupStep(NamedTuple):
+    name: str
+    run: Callable[[], Awaitable]  # may return a status string or a count for /api/ready
+    required: bool
+    timeout: Optional[float]  # None: no deadline, and left running when a drain cancels warm-up
+
+class Lifecycle:
+    """starting -> ready -> draining -> stopped"""
+
+    def __init__(self):
+        self.state = "starting"
+        self.checks: Dict[str, str] = {}
+        self.in_flight = 0  # HTTP requests, counted by LifecycleMiddleware
+        self._steps: List[WarmupStep] = []
+        self._passed = set()
+        self._probes: Dict[str, Callable[[], Awaitable]] = {}
+        self._drain_hooks: List[Callable[[], None]] = []
+        self._busy: Dict[str, Callable[[], int]] = {"http_requests": lambda: self.in_flight}
+        self._warmup_task: Optional[asyncio.Task] = None
+        self._unbounded: Set[asyncio.Task] = set()
+        self._drain_task: Optional[asyncio.Task] = None
+        self._started = time.perf_counter()
+
+    # ---------- registration ----------
+
+    def warm_up(
+        self, name: str, run: Callable[[], Awaitable], required: bool = False,
+        timeout: Optional[float] = WARMUP_TIMEOUT_SECONDS
+    ):
+        self._steps.append(WarmupStep(name, run, required, timeout))
+
+    def probe(self, name: str, check: Callable[[], Awaitable]):
+        """Checked on every readiness request; raising means not ready"""
+        self._probes[name] = check
+
+    def on_drain(self, hook: Callable[[], None]):
+        """Called once when draining begins"""
+        self._drain_hooks.append(hook)
+
+    def busy(self, name: str, count: Callable[[], int]):
+        """In-flight work the drain waits for"""
+        self._busy[name] = count
+
+    # ---------- startup ----------
+
+    @property
+    def accepting(self) -> bool:
+        return self.state in ("starting", "ready")
+
+    def start(self):
+        """Begin warm-up in the background; call after the app's components are started"""
+        self._started = time.perf_counter()
+        for step in self._steps:
+            self.checks[step.name] = "pending"
+        self._warmup_task = asyncio.create_task(self._warm_up())
+        if DRAIN_ON_SIGTERM:
+            self._install_signal_handler()
+
+    async def _run_step(self, step: WarmupStep):
+        started = time.perf_counter()
+        try:
+            if step.timeout is None:
+                task = asyncio.create_task(step.run())
+                self._unbounded.add(task)  # referenced here so a drain can't orphan it
+                task.add_done_callback(self._unbounded.discard)
+                detail = await asyncio.shield(task)
+            else:
+                detail = await asyncio.wait_for(step.run(), step.timeout)
+        except asyncio.TimeoutError:
+            self.checks[step.name] = "timeout"
+            logger.error(f"Warm-up step {step.name} timed out after {step.timeout:.0f}s")
+            return
+        except Exception as e:
+            self.checks[step.name] = "failed"
+            logger.error(f"Warm-up step {step.name} failed: {str(e)}")
+            return
+        if isinstance(detail, str):
+            self.checks[step.name] = detail
+        else:
+            self.checks[step.name] = "ok" if detail is None else f"ok ({detail})"
+        self._passed.add(step.name)
+        logger.info(f"Warm-up step {step.name}: {self.checks[step.name]} in {time.perf_counter() - started:.2f}s")
+
+    async def _warm_up(self):
+        await asyncio.gather(*(self._run_step(step) for step in self._steps))
+        if self.state != "starting":
+            return
+        failed = [step.name for step in self._steps if step.required and step.name not in self._passed]
+        if failed:
+            logger.error(f"Not ready: required warm-up steps failed: {failed}")
+            return
+        self.state = "ready"
+        logger.info(f"Ready {time.perf_counter() - self._started:.2f}s after startup")
+
+    async def readiness(self) -> Tuple[bool, Dict[str, str]]:
+        checks = {"state": self.state, **self.checks}
+        probes_ok = True
+        for name, check in self._probes.items():
+            try:
+                await asyncio.wait_for(check(), READY_PROBE_TIMEOUT_SECONDS)
+                checks[name] = "ok"
+            except Exception as e:
+                checks[name] = f"error: {type(e).__name__}"
+                probes_ok = False
+        return self.state == "ready" and probes_ok, checks
+
+    # ---------- shutdown ----------
+
+    def drain(self) -> asyncio.Task:
+        """Start draining (once); await the result to wait for it"""
+        if self._drain_task is None:
+            self._drain_task = asyncio.create_task(self._drain())
+        return self._drain_task
+
+    def busy_counts(self) -> Dict[str, int]:
+        counts = {}
+        for name, count in self._busy.items():
+            value = count()
+            if value:
+                counts[name] = value
+        return counts
+
+    async def _drain(self):
+        self.state = "draining"
+        if self._warmup_task and not self._warmup_task.done():
+            self._warmup_task.cancel()
+        for hook in self._drain_hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Drain hook failed: {str(e)}")
+
+        started = time.perf_counter()
+        deadline = started + DRAIN_TIMEOUT_SECONDS
+        logger.info(f"Draining: {self.busy_counts() or 'nothing'} in flight")
+        while True:
+            busy = self.busy_counts()
+            if not busy:
+                logger.info(f"Drained in {time.perf_counter() - started:.2f}s")
+                return
+            if time.perf_counter() >= deadline:
+                logger.warning(f"Drain deadline of {DRAIN_TIMEOUT_SECONDS:.0f}s reached with {busy} still in flight")
+                return
+            await asyncio.sleep(DRAIN_POLL_SECONDS)
+
+    def stopped(self):
+        self.state = "stopped"
+        if DRAIN_ON_SIGTERM and threading.current_thread() is threading.main_thread():
+            try:
+                asyncio.get_running_loop().remove_signal_handler(signal.SIGTERM)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    def _install_signal_handler(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self._on_sigterm)
+        except (NotImplementedError, RuntimeError):
+            pass  # no loop signal support (e.g. Windows); shutdown still drains, minus open WebSockets
+
+    def _on_sigterm(self):
+        if self._drain_task is not None:
+            logger.info("Second SIGTERM: shutting down without waiting for the drain")
+            os.kill(os.getpid(), signal.SIGINT)
+            return
+        logger.info("SIGTERM: draining before shutdown")
+        self.drain().add_done_callback(lambda _: os.kill(os.getpid(), signal.SIGINT))
+
+lifecycle = Lifecycle()
+
+class LifecycleMiddleware:
+    """Counts in-flight HTTP requests and turns new work away while draining"""
+
+    def __init__(self, app, lifecycle: Lifecycle = lifecycle):
+        self.app = app
+        self.lifecycle = lifecycle
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        if not self.lifecycle.accepting and scope["path"] not in EXEMPT_PATHS:
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": CLOSE_SERVICE_RESTART})
+            else:
+                response = JSONResponse(
+                    {"detail": "Server is restarting, please retry"},
+                    status_code=503,
+                    headers={"Retry-After": "1", "Connection": "close"}
+                )
+                await response(scope, receive, send)
+            return
+        if scope["type"] == "websocket":
+            await self.app(scope, receive, send)  # chat replies are counted by the connection registry
+            return
+        self.lifecycle.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.lifecycle.in_flight -= 1
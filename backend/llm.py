@@ -0,0 +1,449 @@
+"""
+Shared entry point for LLM calls.
+
+All generation goes through generate() so interactive chat and background jobs
+draw from one concurrency budget. Background work may only use the slots left
+after LLM_INTERACTIVE_RESERVE, and never jumps ahead of a waiting chat request.
+
+Each call has a deadline; retryable provider errors are retried with jittered
+backoff inside it, and interactive calls may send a hedged second request once
+the first has run longer than the recent p95 latency. A circuit breaker opens
+when the recent error rate spikes, so callers fail fast with LlmUnavailable
+instead of queueing behind a provider that is down.
+"""
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, NamedTuple, Optional, Tuple
+import asyncio
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+import httpx
+
+from metrics import llm_request_duration_seconds, llm_requests_total
+from tracing import inject_trace_headers, record as record_span, span
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-5.2")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_INTERACTIVE_RESERVE = int(os.getenv("LLM_INTERACTIVE_RESERVE", "8"))
+
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "45"))
+LLM_BACKGROUND_TIMEOUT_SECONDS = float(os.getenv("LLM_BACKGROUND_TIMEOUT_SECONDS", "180"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE", "false").lower() == "true"
+LLM_HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "2"))
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))
+
+logger = logging.getLogger(__name__)
+
+class ModelSpec(NamedTuple):
+    provider: str
+    model: str
+
+    @classmethod
+    def parse(cls, value: str) -> "ModelSpec":
+        """'openai/gpt-5.2' -> ModelSpec('openai', 'gpt-5.2')"""
+        provider, _, model = value.partition("/")
+        if not provider or not model:
+            raise ValueError(f"Expected 'provider/model', got {value!r}")
+        return cls(provider, model)
+
+    def __str__(self) -> str:
+        return f"{self.provider}/{self.model}"
+
+DEFAULT_MODEL = ModelSpec(LLM_PROVIDER, LLM_MODEL)
+
+class LlmUnavailable(Exception):
+    """The provider failed, timed out or is short-circuited; callers should degrade gracefully"""
+
+    def __init__(self, message: str, retry_after: float = 0, short_circuited: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.short_circuited = short_circuited  # rejected by an open circuit without calling the provider
+
+class LlmConcurrencyBudget:
+    """Concurrency limit for LLM calls with slots reserved for interactive traffic"""
+
+    def __init__(self, limit: int = LLM_MAX_CONCURRENCY, interactive_reserve: int = LLM_INTERACTIVE_RESERVE):
+        self.limit = limit
+        self.background_limit = max(1, limit - interactive_reserve)
+        self.in_use = 0
+        self.interactive_waiting = 0
+        self._condition = asyncio.Condition()
+
+    def _available(self, background: bool) -> bool:
+        if background:
+            return self.in_use < self.background_limit and not self.interactive_waiting
+        return self.in_use < self.limit
+
+    @asynccontextmanager
+    async def slot(self, background: bool = False):
+        async with self._condition:
+            if not background:
+                self.interactive_waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self._available(background))
+            finally:
+                if not background:
+                    self.interactive_waiting -= 1
+            self.in_use += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_use -= 1
+                self._condition.notify_all()
+
+class LatencyTracker:
+    """Rolling window of successful call latencies"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+def _current_task() -> Optional[asyncio.Task]:
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None  # no running loop
+
+class CircuitBreaker:
+    """Opens when the error rate over the last `window` calls reaches `error_rate`
+
+    While open every call is rejected until the cooldown passes; then a single
+    probe call is let through, which closes the breaker on success or reopens it.
+    """
+
+    def __init__(
+        self,
+        window: int = LLM_BREAKER_WINDOW,
+        error_rate: float = LLM_BREAKER_ERROR_RATE,
+        cooldown: float = LLM_BREAKER_COOLDOWN_SECONDS
+    ):
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._probe_task: Optional[asyncio.Task] = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._probing or time.monotonic() >= self._opened_at + self.cooldown:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self._opened_at is None:
+            return 0
+        return max(0.0, self._opened_at + self.cooldown - time.monotonic())
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if self._probing or time.monotonic() < self._opened_at + self.cooldown:
+            return False
+        self._probing = True
+        self._probe_task = _current_task()
+        return True
+
+    def abandon_probe(self):
+        """The calling task's probe was cancelled before it produced an outcome
+
+        A no-op for any other task, so cancelling an ordinary call can't free
+        the probe slot while a real probe is still in flight.
+        """
+        if self._probing and self._probe_task is _current_task():
+            self._probing = False
+            self._probe_task = None
+
+    def record_success(self):
+        self._outcomes.append(True)
+        if self._opened_at is not None:
+            logger.info("LLM circuit closed")
+            self._opened_at = None
+            self._probing = False
+            self._probe_task = None
+            self._outcomes.clear()
+
+    def record_failure(self):
+        self._outcomes.append(False)
+        if self._probing:
+            self._open()
+        elif self._opened_at is None and len(self._outcomes) == self._outcomes.maxlen:
+            failures = self._outcomes.count(False)
+            if failures / len(self._outcomes) >= self.error_rate:
+                self._open()
+
+    def _open(self):
+        logger.warning(f"LLM circuit opened for {self.cooldown:.0f}s")
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self._probe_task = None
+
+llm_budget = LlmConcurrencyBudget()
+# Latency and failures are tracked per model so one degraded model doesn't trip the others
+llm_latency: Dict[ModelSpec, LatencyTracker] = defaultdict(LatencyTracker)
+llm_breakers: Dict[ModelSpec, CircuitBreaker] = defaultdict(CircuitBreaker)
+
+_RETRYABLE_MESSAGE_RE = re.compile(
+    r"\b(408|429|500|502|503|504)\b|rate.?limit|timed? ?out|overloaded|temporarily|unavailable|connection",
+    re.IGNORECASE
+)
+
+def is_retryable(error: Exception) -> bool:
+    """Transient provider errors: timeouts, connection failures, rate limits and 5xx responses"""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    name = type(error).__name__
+    if any(part in name for part in ("Timeout", "Connection", "RateLimit", "ServiceUnavailable", "InternalServer")):
+        return True
+    return bool(_RETRYABLE_MESSAGE_RE.search(str(error)))
+
+def hedge_delay(model: ModelSpec) -> Optional[float]:
+    """How long to wait before hedging, or None until there are enough latency samples"""
+    latency = llm_latency[model]
+    if not LLM_HEDGE_ENABLED or len(latency) < LLM_HEDGE_MIN_SAMPLES:
+        return None
+    return max(LLM_HEDGE_MIN_SECONDS, latency.percentile(0.95))
+
+_sdk: Optional[Tuple[type, type]] = None
+_sdk_lock = threading.Lock()
+
+def load_sdk() -> Tuple[type, type]:
+    """(LlmChat, UserMessage), imported on first use
+
+    The provider SDK pulls in litellm and every provider client, which takes
+    seconds to import; workers that never call an LLM never pay for it.
+    Thread-safe, so LlmClientPool.preload() can import it off the event loop.
+    """
+    global _sdk
+    if _sdk is None:
+        with _sdk_lock:
+            if _sdk is None:
+                if LLM_PROVIDER == "fake":
+                    from fake_llm import LlmChat, UserMessage
+                else:
+                    from emergentintegrations.llm.chat import LlmChat, UserMessage
+                _sdk = (LlmChat, UserMessage)
+    return _sdk
+
+class LlmClientPool:
+    """Process-wide LLM client state, created once at startup
+
+    Holds the API key (read once instead of per call) and a keep-alive
+    httpx.AsyncClient shared by all calls. The provider SDK is pointed at that
+    client through litellm.aclient_session when litellm is importable, so
+    requests reuse pooled TLS connections instead of handshaking per chat turn.
+    LlmChat keeps conversation history on the instance, so handles stay
+    per-call: they are cheap once the key and connections are shared.
+    The SDK itself is imported lazily (load_sdk); start() only builds the HTTP
+    client, and preload() imports the SDK in a thread after startup.
+    """
+
+    def __init__(self):
+        self.api_key: Optional[str] = None
+        self.http_client: Optional[httpx.AsyncClient] = None
+        self._attached = False
+
+    async def start(self):
+        self.api_key = os.getenv("EMERGENT_LLM_KEY")
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONCURRENCY * 2,  # room for hedged requests
+                max_keepalive_connections=LLM_MAX_CONCURRENCY,
+                keepalive_expiry=LLM_KEEPALIVE_SECONDS
+            ),
+            timeout=httpx.Timeout(LLM_BACKGROUND_TIMEOUT_SECONDS, connect=10),
+            event_hooks={"request": [inject_trace_headers]}
+        )
+        if _sdk is not None:
+            self._attach()
+
+    async def preload(self):
+        """Import the SDK off the event loop so the first chat turn doesn't pay for it"""
+        started = time.perf_counter()
+        await asyncio.to_thread(load_sdk)
+        self._attach()
+        logger.info(f"LLM SDK loaded in {time.perf_counter() - started:.2f}s")
+
+    def _attach(self):
+        """Point litellm at the shared client; needs the SDK (and so litellm) imported"""
+        if self._attached or self.http_client is None:
+            return
+        self._attached = True
+        try:
+            import litellm
+            litellm.aclient_session = self.http_client
+        except ImportError:
+            logger.info("litellm not importable; provider SDK keeps its own HTTP client")
+
+    async def close(self):
+        if self.http_client is None:
+            return
+        litellm = sys.modules.get("litellm")  # never import it just to detach
+        if litellm is not None and getattr(litellm, "aclient_session", None) is self.http_client:
+            litellm.aclient_session = None
+        await self.http_client.aclose()
+        self.http_client = None
+        self._attached = False
+
+    def handle(self, model: ModelSpec, session_id: str, system_message: str):
+        if self.api_key is None:
+            # Used before startup (scripts); read once and keep it
+            self.api_key = os.getenv("EMERGENT_LLM_KEY")
+        LlmChat, _ = load_sdk()
+        self._attach()
+        return LlmChat(
+            api_key=self.api_key,
+            session_id=session_id,
+            system_message=system_message
+        ).with_model(model.provider, model.model)
+
+llm_clients = LlmClientPool()
+
+async def _send(model: ModelSpec, session_id: str, system_message: str, text: str) -> str:
+    llm_chat = llm_clients.handle(model, session_id, system_message)
+    _, UserMessage = load_sdk()
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        reply = await llm_chat.send_message(UserMessage(text=text))
+        outcome = "ok"
+        return reply
+    except asyncio.CancelledError:
+        outcome = "cancelled"  # lost a hedge race or the caller went away
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        llm_request_duration_seconds.labels(str(model), outcome).observe(duration)
+        record_span("llm.send", started, duration, model=str(model), outcome=outcome)
+
+async def _attempt(
+    model: ModelSpec, session_id: str, system_message: str, text: str, timeout: float, hedge: bool
+) -> str:
+    """One logical request, optionally hedged; the first successful reply wins"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    pending = {asyncio.create_task(_send(model, session_id, system_message, text))}
+    try:
+        delay = hedge_delay(model) if hedge else None
+        if delay is not None and delay < timeout:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                pending.add(asyncio.create_task(_send(model, session_id, system_message, text)))
+
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=max(0, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                raise asyncio.TimeoutError()
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def generate(
+    session_id: str,
+    system_message: str,
+    text: str,
+    background: bool = False,
+    model: ModelSpec = DEFAULT_MODEL
+) -> str:
+    """Send one user message and return the assistant's reply
+
+    Raises LlmUnavailable when the model's circuit is open, the deadline passes
+    or the provider keeps failing.
+    """
+    breaker = llm_breakers[model]
+    if not breaker.allow():
+        llm_requests_total.labels(str(model), "short_circuited").inc()
+        raise LlmUnavailable(
+            f"LLM circuit is open for {model}", retry_after=breaker.retry_after(), short_circuited=True
+        )
+    try:
+        with span("llm.generate", model=str(model)):
+            reply = await _generate_with_retries(model, breaker, session_id, system_message, text, background)
+    except asyncio.CancelledError:
+        breaker.abandon_probe()
+        raise
+    except LlmUnavailable:
+        llm_requests_total.labels(str(model), "unavailable").inc()
+        raise
+    llm_requests_total.labels(str(model), "ok").inc()
+    return reply
+
+async def _generate_with_retries(
+    model: ModelSpec, breaker: CircuitBreaker, session_id: str, system_message: str, text: str, background: bool
+) -> str:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (LLM_BACKGROUND_TIMEOUT_SECONDS if background else LLM_TIMEOUT_SECONDS)
+    last_error: Exception = None
+    async with llm_budget.slot(background):
+        for attempt in range(1, LLM_MAX_ATTEMPTS + 1):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+
+            started = loop.time()
+            try:
+                reply = await _attempt(model, session_id, system_message, text, remaining, hedge=not background)
+            except asyncio.TimeoutError as e:
+                # The whole deadline is spent
+                breaker.record_failure()
+                last_error = e
+                break
+            except Exception as e:
+                breaker.record_failure()
+                last_error = e
+                if not is_retryable(e) or not breaker.allow():
+                    break
+                delay = random.uniform(0, LLM_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+                if loop.time() + delay >= deadline:
+                    break
+                logger.warning(f"LLM attempt {attempt} failed, retrying in {delay:.2f}s: {str(e)}")
+                await asyncio.sleep(delay)
+                continue
+
+            llm_latency[model].record(loop.time() - started)
+            breaker.record_success()
+            return reply
+
+    # A probe granted to this call (first attempt or a retry) that never reached
+    # the provider produced no outcome; free the slot for the next caller
+    breaker.abandon_probe()
+    if last_error is None:
+        reason = "deadline passed before an attempt could start"
+    else:
+        reason = str(last_error) or type(last_error).__name__
+    raise LlmUnavailable(f"LLM request failed: {reason}", retry_after=breaker.retry_after()) from last_error
@@ -0,0 +1,378 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms are plain Python objects updated inline (a dict
+lookup and a few additions per observation) and rendered on demand at /metrics.
+MetricsMiddleware records per-route latency and status counts keyed by the
+route template, not the raw path, so label cardinality stays bounded.
+InstrumentedCollection wraps a Motor collection and times every operation by
+collection and operation name (and adds each call to the request's trace);
+the LLM layer records its own call durations.
+Gauges can be backed by a function, which is how queue depths are exposed
+without the queues knowing about metrics.
+"""
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import math
+import os
+import time
+
+from starlette.responses import Response
+
+from tracing import record as record_span
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 45.0, 60.0, 120.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from function at scrape time"""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The child for these label values; hold on to it on hot paths"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self._samples(),
+        ]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_label_text(self.labelnames, values)} {_format_value(child.value)}"
+            for values, child in list(self._children.items())
+        ]
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_label_text(self.labelnames, values)} {_format_value(child.get())}"
+            for values, child in list(self._children.items())
+        ]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        bucket_labels = self.labelnames + ("le",)
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_label_text(bucket_labels, values + (_format_value(bound),))} {cumulative}"
+                )
+            labels = _label_text(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+http_requests_total = registry.counter(
+    "http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")
+)
+http_request_duration_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+)
+http_requests_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests currently being served")
+mongo_operation_duration_seconds = registry.histogram(
+    "mongo_operation_duration_seconds", "Mongo operation latency", ("collection", "operation"), MONGO_BUCKETS
+)
+mongo_operation_errors_total = registry.counter(
+    "mongo_operation_errors_total", "Mongo operations that raised", ("collection", "operation")
+)
+llm_request_duration_seconds = registry.histogram(
+    "llm_request_duration_seconds", "Single LLM provider calls, including hedged duplicates",
+    ("model", "outcome"), LLM_BUCKETS
+)
+llm_requests_total = registry.counter(
+    "llm_requests_total", "Logical LLM requests by final outcome", ("model", "outcome")
+)
+queue_depth = registry.gauge("queue_depth", "Items waiting in in-process queues", ("queue",))
+
+def metrics_response() -> Response:
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+class MetricsMiddleware:
+    """Per-route latency and status counts; the route template comes from the matched APIRoute"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            http_request_duration_seconds.labels(method, template).observe(time.perf_counter() - started)
+            http_requests_total.labels(method, template, str(status)).inc()
+
+# ---------- Mongo instrumentation ----------
+
+TIMED_OPERATIONS = {
+    "find_one", "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "find_one_and_update", "find_one_and_replace", "find_one_and_delete",
+    "bulk_write", "count_documents", "estimated_document_count", "distinct", "create_index",
+    "create_indexes", "drop_index", "index_information",
+}
+CURSOR_OPERATIONS = {"find", "aggregate"}
+
+class _TimedCursor:
+    """Cursor wrapper timing to_list() and full async iteration; chained calls keep the wrapper"""
+
+    def __init__(self, cursor, histogram: _HistogramChild, errors: _CounterChild, span_name: str, collection: str):
+        self._cursor = cursor
+        self._histogram = histogram
+        self._errors = errors
+        self._span_name = span_name
+        self._collection = collection
+
+    def _done(self, started: float):
+        duration = time.perf_counter() - started
+        self._histogram.observe(duration)
+        record_span(self._span_name, started, duration, collection=self._collection)
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        def chained(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return self if result is self._cursor else result
+        return chained
+
+    async def to_list(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.to_list(*args, **kwargs)
+        except Exception:
+            self._errors.inc()
+            raise
+        finally:
+            self._done(started)
+
+    async def _iterate(self):
+        started = time.perf_counter()
+        try:
+            async for doc in self._cursor:
+                yield doc
+        except Exception:
+            self._errors.inc()
+            raise
+        finally:
+            self._done(started)
+
+    def __aiter__(self):
+        return self._iterate()
+
+class InstrumentedCollection:
+    """Proxy for a Motor collection that records operation latency and errors"""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._name = collection.name
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in TIMED_OPERATIONS:
+            wrapped = self._timed(name, attr)
+        elif name in CURSOR_OPERATIONS:
+            wrapped = self._cursor(name, attr)
+        else:
+            return attr
+        setattr(self, name, wrapped)  # later lookups skip __getattr__
+        return wrapped
+
+    def _timed(self, operation: str, method):
+        histogram = mongo_operation_duration_seconds.labels(self._name, operation)
+        errors = mongo_operation_errors_total.labels(self._name, operation)
+        span_name = f"mongo.{operation}"
+        collection = self._name
+
+        async def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                duration = time.perf_counter() - started
+                histogram.observe(duration)
+                record_span(span_name, started, duration, collection=collection)
+        return call
+
+    def _cursor(self, operation: str, method):
+        histogram = mongo_operation_duration_seconds.labels(self._name, operation)
+        errors = mongo_operation_errors_total.labels(self._name, operation)
+
+        def call(*args, **kwargs):
+            return _TimedCursor(method(*args, **kwargs), histogram, errors, f"mongo.{operation}", self._name)
+        return call
+
+def instrument(collection):
+    return InstrumentedCollection(collection) if METRICS_ENABLED else collection
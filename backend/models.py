@@ -123,9 +123,29 @@ class QuizAttempt(BaseModel):
     quiz_id: str
     user_id: str
     answers: List[int]  # list of selected options
+    question_ids: Optional[List[int]] = None  # served question order, when started via an attempt token
     score: float
+    client_attempt_id: Optional[str] = None  # client-supplied idempotency id for offline sync
     completed_at: datetime = Field(default_factory=datetime.utcnow)
 
+class QuizAttemptSubmission(BaseModel):
+    client_attempt_id: str
+    quiz_id: str
+    answers: List[int]
+    attempt_token: Optional[str] = None
+    completed_at: Optional[datetime] = None
+
+class QuizAttemptBatch(BaseModel):
+    attempts: List[QuizAttemptSubmission]
+
+# Batch Read Models
+class BatchSubRequest(BaseModel):
+    id: Optional[str] = None  # echoed back so the client can match responses
+    path: str  # e.g. "/api/progress" or "/api/books?subject=Physics"
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest]
+
 # Chat Models
 class ChatMessage(BaseModel):
     role: str  # 'user' or 'assistant'
@@ -138,14 +158,28 @@ class ChatSession(BaseModel):
     topic: Optional[str] = None
     subject: Optional[str] = None
     messages: List[ChatMessage] = []
+    summary: Optional[str] = None  # rolling summary of messages[:summary_upto]
+    summary_upto: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class ChatSessionListItem(ChatSession):
+    """A row of GET /chat/sessions
+
+    Archived sessions are listed without their messages (they load when the
+    session is opened): archived is true, messages is empty and message_count
+    is the stored count. Hot sessions carry their messages as before.
+    """
+    archived: bool = False
+    message_count: int = 0
+
 class ChatRequest(BaseModel):
     message: str
     session_id: Optional[str] = None
     subject: Optional[str] = None
     topic: Optional[str] = None
+    stream: Optional[Stream] = None
+    class_level: Optional[int] = None
     context_type: Optional[str] = "doubt"  # 'summary', 'doubt', 'quiz'
 
 # Progress Tracking
@@ -161,6 +195,13 @@ class TopicProgress(BaseModel):
     average_score: float = 0.0
     last_accessed: datetime = Field(default_factory=datetime.utcnow)
 
+class StudyHeartbeat(BaseModel):
+    stream: Stream
+    class_level: int
+    subject: str
+    topic: str
+    seconds: int = Field(default=30, ge=0)  # time since the previous heartbeat
+
 # Search/Filter Models
 class ContentFilter(BaseModel):
     stream: Optional[Stream] = None
@@ -169,3 +210,37 @@ class ContentFilter(BaseModel):
     topic: Optional[str] = None
     difficulty: Optional[DifficultyLevel] = None
     search_query: Optional[str] = None
+
+# Background Jobs
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+class JobCreate(BaseModel):
+    type: str
+    params: Dict[str, Any] = {}
+    max_attempts: int = Field(default=3, ge=1, le=10)
+
+class Job(JobCreate):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    status: JobStatus = JobStatus.QUEUED
+    progress: float = 0.0  # 0-100
+    progress_message: Optional[str] = None
+    attempts: int = 0
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    cancel_requested: bool = False
+    created_by: str
+    run_after: datetime = Field(default_factory=datetime.utcnow)
+    heartbeat_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class QuizDraft(QuizBase):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    job_id: str
+    status: str = "draft"  # 'draft', 'published', 'rejected'
+    created_at: datetime = Field(default_factory=datetime.utcnow)
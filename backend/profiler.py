@@ -0,0 +1,200 @@
+"""
+On-demand statistical profiler for a live worker.
+
+While a profile runs, the worker's stacks are sampled at a fixed interval and
+folded into the collapsed format ("frame;frame;frame count") that
+flamegraph.pl, speedscope and inferno read directly. Nothing is installed
+between profiles.
+
+The default sampler is a SIGPROF interval timer. It fires on CPU time, and its
+handler runs on the main thread (where uvicorn runs the event loop) with the
+exact frame that was executing, so pydantic validation, bcrypt or JSON encoding
+show up where the CPU actually went. Other threads (the threadpool) are sampled
+from sys._current_frames() on the same tick. When the loop is not on the main
+thread, or setitimer is unavailable, a sampler thread snapshots
+sys._current_frames() instead. That is cheaper to set up but biased towards
+code that releases the GIL (syscalls, select), so its stacks are less precise.
+
+Route filtering: request handlers run as coroutines on the event loop thread,
+so a sample of that thread belongs to whichever asyncio task is current.
+ProfilerMiddleware remembers each request task's ASGI scope while a profile is
+active, and only event-loop samples whose task is serving the requested route
+are kept (matched on the route template, e.g. /api/books/{book_id}, or on the
+raw path).
+"""
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+import asyncio
+import os
+import signal
+import sys
+import sysconfig
+import threading
+import time
+
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_DEFAULT_INTERVAL_MS = float(os.getenv("PROFILE_DEFAULT_INTERVAL_MS", "5"))
+
+_PATH_PREFIXES = sorted(
+    {
+        str(Path(__file__).resolve().parent) + os.sep,
+        *(path + os.sep for path in sys.path if path.endswith(("site-packages", "dist-packages"))),
+        sysconfig.get_paths()["stdlib"] + os.sep,
+    },
+    key=len,
+    reverse=True,
+)
+
+class ProfilerBusy(Exception):
+    pass
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+def _fold(frame) -> List[str]:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+class Profile:
+    def __init__(self, route: Optional[str], interval: float, mode: str):
+        self.route = route
+        self.interval = interval
+        self.mode = mode
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = time.time()
+        self.duration = 0.0
+
+    def add(self, thread_name: str, frame):
+        self.stacks[";".join([thread_name, *_fold(frame)])] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+class _Sampler:
+    def __init__(self, profile: Profile, loop: asyncio.AbstractEventLoop, task_scopes: Dict):
+        self.profile = profile
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.task_scopes = task_scopes
+        self._names: Dict[int, str] = {}
+
+    def _thread_name(self, thread_id: int) -> str:
+        if thread_id not in self._names:
+            self._names = {thread.ident: thread.name for thread in threading.enumerate()}
+        return self._names.get(thread_id, str(thread_id))
+
+    def _serving_route(self) -> bool:
+        task = asyncio.current_task(self.loop)
+        scope = self.task_scopes.get(task) if task is not None else None
+        if scope is None:
+            return False
+        route = scope.get("route")
+        return self.profile.route in (getattr(route, "path", None), scope.get("path"))
+
+    def sample(self, loop_frame=None, skip_thread: Optional[int] = None):
+        """Record one tick; loop_frame is the interrupted event-loop frame when the caller has it"""
+        if self.profile.route is not None:
+            if self._serving_route():
+                frame = loop_frame or sys._current_frames().get(self.loop_thread_id)
+                if frame is not None:
+                    self.profile.add(self._thread_name(self.loop_thread_id), frame)
+            return
+        frames = sys._current_frames()
+        if loop_frame is not None:
+            frames[self.loop_thread_id] = loop_frame
+        for thread_id, frame in frames.items():
+            if thread_id != skip_thread:
+                self.profile.add(self._thread_name(thread_id), frame)
+        del frames
+
+class SignalSampler(_Sampler):
+    """SIGPROF timer on the main thread; samples land on the code that was burning CPU"""
+
+    def start(self):
+        self._previous = signal.signal(signal.SIGPROF, self._handle)
+        signal.setitimer(signal.ITIMER_PROF, self.profile.interval, self.profile.interval)
+
+    def _handle(self, signum, frame):
+        self.sample(loop_frame=frame)
+
+    async def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+
+class ThreadSampler(_Sampler):
+    """Wall-clock sampling from a daemon thread, for loops off the main thread"""
+
+    def start(self):
+        self._finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._finished.wait(self.profile.interval):
+            self.sample(skip_thread=own_id)
+
+    async def stop(self):
+        self._finished.set()
+        await asyncio.to_thread(self._thread.join)
+
+class Profiler:
+    """One profile at a time per worker"""
+
+    def __init__(self):
+        self.active = False
+        self.task_scopes: Dict[asyncio.Task, dict] = {}
+
+    async def run(self, seconds: float, interval_ms: float = PROFILE_DEFAULT_INTERVAL_MS, route: Optional[str] = None) -> Profile:
+        if self.active:
+            raise ProfilerBusy()
+        seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+        use_signal = hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+        profile = Profile(route, max(0.001, interval_ms / 1000), "signal" if use_signal else "thread")
+        sampler_type = SignalSampler if use_signal else ThreadSampler
+        sampler = sampler_type(profile, asyncio.get_running_loop(), self.task_scopes)
+
+        self.active = True
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await sampler.stop()
+            self.active = False
+            self.task_scopes.clear()
+        profile.duration = time.perf_counter() - started
+        return profile
+
+profiler = Profiler()
+
+class ProfilerMiddleware:
+    """Maps request tasks to their scope while a profile is running; a flag check otherwise"""
+
+    def __init__(self, app, profiler: Profiler = profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if not self.profiler.active or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        task = asyncio.current_task()
+        self.profiler.task_scopes[task] = scope
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.task_scopes.pop(task, None)
@@ -0,0 +1,84 @@
+"""
+Write operations for topic progress that can be batched.
+
+Each helper returns a pymongo write model so callers can merge many updates and
+send them with one bulk_write instead of a read-modify-write per attempt.
+"""
+from pymongo import UpdateOne
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+ProgressKey = Tuple[str, str, str]  # (user_id, subject, topic)
+
+class QuizProgressDelta:
+    """Quiz results for one (user, subject, topic), merged before writing"""
+
+    __slots__ = ("stream", "class_level", "attempts", "score_sum")
+
+    def __init__(self, stream: str, class_level: int):
+        self.stream = stream
+        self.class_level = class_level
+        self.attempts = 0
+        self.score_sum = 0.0
+
+    def add(self, score: float):
+        self.attempts += 1
+        self.score_sum += score
+
+def merge_quiz_scores(results: Iterable[Tuple[str, str, int, str, str, float]]) -> Dict[ProgressKey, QuizProgressDelta]:
+    """Group (user_id, stream, class_level, subject, topic, score) rows by progress key"""
+    merged: Dict[ProgressKey, QuizProgressDelta] = {}
+    for user_id, stream, class_level, subject, topic, score in results:
+        key = (user_id, subject, topic)
+        delta = merged.get(key)
+        if delta is None:
+            delta = merged[key] = QuizProgressDelta(stream, class_level)
+        delta.add(score)
+    return merged
+
+def quiz_progress_update(key: ProgressKey, delta: QuizProgressDelta) -> UpdateOne:
+    """Upsert that folds several quiz scores into the running average in one write"""
+    user_id, subject, topic = key
+    attempts = {"$ifNull": ["$quiz_attempts", 0]}
+    average = {"$ifNull": ["$average_score", 0]}
+
+    return UpdateOne(
+        {"user_id": user_id, "subject": subject, "topic": topic},
+        [
+            {"$set": {
+                "stream": {"$ifNull": ["$stream", delta.stream]},
+                "class_level": {"$ifNull": ["$class_level", delta.class_level]},
+                "time_spent": {"$ifNull": ["$time_spent", 0]},
+                "average_score": {"$divide": [
+                    {"$add": [{"$multiply": [average, attempts]}, delta.score_sum]},
+                    {"$add": [attempts, delta.attempts]}
+                ]},
+                "quiz_attempts": {"$add": [attempts, delta.attempts]},
+                "last_accessed": datetime.utcnow(),
+            }},
+            {"$set": {"mastery_level": {"$min": ["$average_score", 100]}}},
+        ],
+        upsert=True
+    )
+
+def quiz_progress_updates(merged: Dict[ProgressKey, QuizProgressDelta]) -> List[UpdateOne]:
+    return [quiz_progress_update(key, delta) for key, delta in merged.items()]
+
+def time_spent_update(key: ProgressKey, stream: str, class_level: int, minutes: int) -> UpdateOne:
+    """Upsert that adds study time without reading the progress document"""
+    user_id, subject, topic = key
+    return UpdateOne(
+        {"user_id": user_id, "subject": subject, "topic": topic},
+        {
+            "$inc": {"time_spent": minutes},
+            "$set": {"last_accessed": datetime.utcnow()},
+            "$setOnInsert": {
+                "stream": stream,
+                "class_level": class_level,
+                "mastery_level": 0.0,
+                "quiz_attempts": 0,
+                "average_score": 0.0,
+            },
+        },
+        upsert=True
+    )
@@ -0,0 +1,192 @@
+"""
+Signed quiz attempt tokens and the in-process answer-key cache.
+
+Starting a quiz samples and orders its questions and hands the client a signed
+token describing exactly what was served. Submissions are graded from that
+token plus a cached answer key, so no per-attempt state is kept on the server.
+JWT claims are readable by whoever holds the token, so the answer-key digest in
+it is an HMAC keyed with JWT_SECRET: without the secret, guesses at the answers
+can't be checked against it.
+"""
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import hashlib
+import hmac
+import os
+import random
+import time
+
+from auth import JWT_SECRET, JWT_ALGORITHM
+from database import quizzes_collection
+
+ATTEMPT_TOKEN_EXPIRE_MINUTES = int(os.getenv("ATTEMPT_TOKEN_EXPIRE_MINUTES", "180"))
+ANSWER_KEY_CACHE_SIZE = int(os.getenv("ANSWER_KEY_CACHE_SIZE", "2048"))
+ANSWER_KEY_CACHE_TTL = int(os.getenv("ANSWER_KEY_CACHE_TTL", "600"))  # seconds
+
+ATTEMPT_TOKEN_TYPE = "quiz_attempt"
+
+ANSWER_KEY_PROJECTION = {
+    "_id": 0, "id": 1, "stream": 1, "class_level": 1, "subject": 1, "topic": 1,
+    "questions.correct_answer": 1
+}
+
+def answer_digest(quiz_id: str, answers: Tuple[int, ...], question_ids: List[int]) -> str:
+    """Short keyed digest of the correct answers for the given questions, in order"""
+    material = quiz_id + "|" + ",".join(f"{i}:{answers[i]}" for i in question_ids)
+    return hmac.new(JWT_SECRET.encode(), material.encode(), hashlib.sha256).hexdigest()[:16]
+
+class AnswerKey(NamedTuple):
+    quiz_id: str
+    stream: str
+    class_level: int
+    subject: str
+    topic: str
+    answers: Tuple[int, ...]
+
+    @classmethod
+    def from_doc(cls, quiz_doc: dict) -> "AnswerKey":
+        return cls(
+            quiz_id=quiz_doc["id"],
+            stream=quiz_doc["stream"],
+            class_level=quiz_doc["class_level"],
+            subject=quiz_doc["subject"],
+            topic=quiz_doc["topic"],
+            answers=tuple(q["correct_answer"] for q in quiz_doc.get("questions", [])),
+        )
+
+    def covers(self, question_ids: List[int]) -> bool:
+        return all(0 <= i < len(self.answers) for i in question_ids)
+
+    def digest(self, question_ids: List[int]) -> str:
+        return answer_digest(self.quiz_id, self.answers, question_ids)
+
+    def matches(self, question_ids: List[int], digest: str) -> bool:
+        """Check the key still agrees with the one the attempt token was issued against"""
+        return self.covers(question_ids) and hmac.compare_digest(self.digest(question_ids), digest)
+
+    def grade(self, answers: List[int], question_ids: Optional[List[int]] = None) -> Tuple[int, int, float]:
+        """Return (correct, total, score) for answers given in served order"""
+        if question_ids is None:
+            question_ids = list(range(len(self.answers)))
+
+        correct_count = 0
+        for position, answer in enumerate(answers):
+            if position < len(question_ids) and answer == self.answers[question_ids[position]]:
+                correct_count += 1
+
+        total = len(question_ids)
+        score = (correct_count / total) * 100 if total else 0
+        return correct_count, total, score
+
+class AnswerKeyCache:
+    """LRU + TTL cache of quiz answer keys, filled from quizzes_collection on miss"""
+
+    def __init__(self, max_size: int = ANSWER_KEY_CACHE_SIZE, ttl: int = ANSWER_KEY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, AnswerKey]]" = OrderedDict()
+
+    def put(self, answer_key: AnswerKey) -> AnswerKey:
+        self._entries[answer_key.quiz_id] = (time.monotonic() + self.ttl, answer_key)
+        self._entries.move_to_end(answer_key.quiz_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return answer_key
+
+    def peek(self, quiz_id: str) -> Optional[AnswerKey]:
+        entry = self._entries.get(quiz_id)
+        if entry is None:
+            return None
+        expires_at, answer_key = entry
+        if expires_at < time.monotonic():
+            del self._entries[quiz_id]
+            return None
+        self._entries.move_to_end(quiz_id)
+        return answer_key
+
+    def invalidate(self, quiz_id: str):
+        self._entries.pop(quiz_id, None)
+
+    async def get(self, quiz_id: str, refresh: bool = False) -> Optional[AnswerKey]:
+        if not refresh:
+            answer_key = self.peek(quiz_id)
+            if answer_key is not None:
+                return answer_key
+
+        quiz_doc = await quizzes_collection.find_one({"id": quiz_id}, ANSWER_KEY_PROJECTION)
+        if not quiz_doc:
+            self.invalidate(quiz_id)
+            return None
+        return self.put(AnswerKey.from_doc(quiz_doc))
+
+    async def get_many(self, quiz_ids: List[str]) -> Dict[str, AnswerKey]:
+        """Resolve several answer keys, loading all misses with a single query"""
+        found = {}
+        missing = []
+        for quiz_id in dict.fromkeys(quiz_ids):
+            answer_key = self.peek(quiz_id)
+            if answer_key is not None:
+                found[quiz_id] = answer_key
+            else:
+                missing.append(quiz_id)
+
+        if missing:
+            async for quiz_doc in quizzes_collection.find({"id": {"$in": missing}}, ANSWER_KEY_PROJECTION):
+                found[quiz_doc["id"]] = self.put(AnswerKey.from_doc(quiz_doc))
+        return found
+
+    async def warm(self, limit: int) -> int:
+        """Load the answer keys of the most recently created quizzes"""
+        limit = min(limit, self.max_size)
+        if limit <= 0:
+            return 0
+        cursor = quizzes_collection.find({}, ANSWER_KEY_PROJECTION).sort("created_at", -1).limit(limit)
+        loaded = 0
+        async for quiz_doc in cursor:
+            self.put(AnswerKey.from_doc(quiz_doc))
+            loaded += 1
+        return loaded
+
+answer_key_cache = AnswerKeyCache()
+
+def select_questions(question_count: int, count: Optional[int] = None, shuffle: bool = True) -> List[int]:
+    """Pick the question indices to serve, sampled and/or permuted"""
+    question_ids = list(range(question_count))
+    if count is not None and 0 < count < question_count:
+        question_ids = random.sample(question_ids, count)
+        if not shuffle:
+            question_ids.sort()
+    elif shuffle:
+        random.shuffle(question_ids)
+    return question_ids
+
+def create_attempt_token(user_id: str, answer_key: AnswerKey, question_ids: List[int]) -> Tuple[str, datetime]:
+    """Sign the served question order together with a digest of its answer key"""
+    expires_at = datetime.utcnow() + timedelta(minutes=ATTEMPT_TOKEN_EXPIRE_MINUTES)
+    claims = {
+        "typ": ATTEMPT_TOKEN_TYPE,
+        "uid": user_id,
+        "qz": answer_key.quiz_id,
+        "q": question_ids,
+        "d": answer_key.digest(question_ids),
+        "exp": expires_at,
+    }
+    from jose import jwt
+    return jwt.encode(claims, JWT_SECRET, algorithm=JWT_ALGORITHM), expires_at
+
+def decode_attempt_token(token: str, user_id: str, quiz_id: str) -> Optional[Dict]:
+    """Verify an attempt token and check it was issued to this user for this quiz"""
+    from jose import JWTError, jwt
+    try:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except JWTError:
+        return None
+
+    if claims.get("typ") != ATTEMPT_TOKEN_TYPE:
+        return None
+    if claims.get("uid") != user_id or claims.get("qz") != quiz_id:
+        return None
+    if not isinstance(claims.get("q"), list) or not isinstance(claims.get("d"), str):
+        return None
+    return claims
@@ -0,0 +1,435 @@
+"""
+Local BM25 retrieval over catalog text, used to ground tutor answers.
+
+Passages come from Book.summary, Video.description and QuizQuestion.explanation.
+The index has two segments: a base segment stored on disk as CSR postings
+(.npy files opened memory-mapped) and an in-memory delta segment that new
+content is appended to. persist() merges the delta into a new base segment.
+sync() picks up catalog documents created since the last sync, so the index is
+built incrementally instead of re-reading the whole catalog.
+
+Every worker on a host shares RETRIEVAL_INDEX_DIR. Only the worker holding the
+writer lock merges and writes a new base; the merge and the .npy writes run in
+a thread, off the event loop. Other workers just reload the base whenever it
+changes and keep the delta passages it doesn't cover yet. The directory swap
+and readers take a second lock, so nobody opens a half-swapped index.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import re
+import uuid
+
+import numpy as np
+
+from chat_context import estimate_tokens
+from database import books_collection, videos_collection, quizzes_collection
+from tracing import background_task
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_INDEX_DIR = Path(os.getenv("RETRIEVAL_INDEX_DIR", Path(__file__).parent / "retrieval_index"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "600"))
+RETRIEVAL_SYNC_SECONDS = float(os.getenv("RETRIEVAL_SYNC_SECONDS", "300"))
+# Overlap between syncs so documents inserted mid-sync are not missed (duplicates are skipped)
+SYNC_OVERLAP = timedelta(seconds=60)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the this to was "
+    "were what when where which who why will with you your i me my we our can do does explain "
+    "tell about please".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS and len(t) > 1]
+
+def _remove_dir(path: Path):
+    if path.exists():
+        for child in path.iterdir():
+            child.unlink()
+        path.rmdir()
+
+def _lock(path: Path, exclusive: bool, blocking: bool = True):
+    """flock on path; returns the open handle (close it to unlock), or None if busy"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handle = open(path, "a")
+    flags = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
+    try:
+        fcntl.flock(handle.fileno(), flags)
+    except BlockingIOError:
+        handle.close()
+        return None
+    return handle
+
+class Passage(NamedTuple):
+    source: str  # 'book', 'video' or 'quiz'
+    source_id: str
+    title: str
+    subject: str
+    topic: str
+    text: str
+
+class RetrievedPassage(NamedTuple):
+    passage: Passage
+    score: float
+
+class BaseSegment(NamedTuple):
+    stamp: Tuple[int, int]  # (inode, mtime) of meta.json; changes with every write
+    passages: List[Passage]
+    terms: Dict[str, int]
+    offsets: np.ndarray
+    docs: np.ndarray
+    tfs: np.ndarray
+    lengths: np.ndarray
+    synced_until: Optional[datetime]
+
+def catalog_passages(doc: dict, source: str) -> List[Passage]:
+    """Passages contributed by one book, video or quiz document"""
+    if source == "book":
+        texts = [doc.get("summary")]
+    elif source == "video":
+        texts = [doc.get("description")]
+    else:
+        texts = [q.get("explanation") for q in doc.get("questions", [])]
+
+    return [
+        Passage(source, doc["id"], doc.get("title", ""), doc.get("subject", ""), doc.get("topic", ""), text)
+        for text in texts if text
+    ]
+
+def _lock_path(index_dir: Path, kind: str) -> Path:
+    return index_dir.with_name(f"{index_dir.name}.{kind}.lock")
+
+def _base_stamp(index_dir: Path) -> Optional[Tuple[int, int]]:
+    try:
+        stat = (index_dir / "meta.json").stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+def _read_base(index_dir: Path) -> Optional[BaseSegment]:
+    """Open the on-disk base segment memory-mapped; None when there is none yet"""
+    with _lock(_lock_path(index_dir, "swap"), exclusive=False):
+        stamp = _base_stamp(index_dir)
+        if stamp is None:
+            return None
+        with open(index_dir / "meta.json", "r", encoding="utf-8") as handle:
+            meta = json.load(handle)
+        return BaseSegment(
+            stamp=stamp,
+            passages=[Passage(**p) for p in meta["passages"]],
+            terms={term: i for i, term in enumerate(meta["terms"])},
+            offsets=np.load(index_dir / "offsets.npy", mmap_mode="r"),
+            docs=np.load(index_dir / "docs.npy", mmap_mode="r"),
+            tfs=np.load(index_dir / "tfs.npy", mmap_mode="r"),
+            lengths=np.load(index_dir / "lengths.npy", mmap_mode="r"),
+            synced_until=datetime.fromisoformat(meta["synced_until"]) if meta["synced_until"] else None,
+        )
+
+def _write_base(
+    index_dir: Path,
+    base: BaseSegment,
+    delta_passages: List[Passage],
+    delta_postings: Dict[str, List[Tuple[int, int]]],
+    delta_lengths: List[int],
+    synced_until: Optional[datetime]
+):
+    """Merge base and delta into a new base segment on disk; call holding the writer lock"""
+    # Leftovers of a writer that crashed mid-persist
+    for leftover in [*index_dir.parent.glob(f"{index_dir.name}.tmp-*"), *index_dir.parent.glob(f"{index_dir.name}.old-*")]:
+        _remove_dir(leftover)
+
+    passages = base.passages + delta_passages
+    postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+    for term, term_id in base.terms.items():
+        start, end = base.offsets[term_id], base.offsets[term_id + 1]
+        postings[term].extend(zip(base.docs[start:end].tolist(), base.tfs[start:end].tolist()))
+    shift = len(base.passages)
+    for term, entries in delta_postings.items():
+        postings[term].extend((doc_id + shift, tf) for doc_id, tf in entries)
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    for i, term in enumerate(terms):
+        offsets[i + 1] = offsets[i] + len(postings[term])
+    docs = np.fromiter((d for t in terms for d, _ in postings[t]), dtype=np.int32, count=int(offsets[-1]))
+    tfs = np.fromiter((f for t in terms for _, f in postings[t]), dtype=np.float32, count=int(offsets[-1]))
+    lengths = np.concatenate([base.lengths, np.asarray(delta_lengths, dtype=np.float32)])
+
+    # Write into a fresh directory and swap it in, so readers never see a partial index
+    suffix = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    staging = index_dir.with_name(f"{index_dir.name}.tmp-{suffix}")
+    staging.mkdir(parents=True)
+    np.save(staging / "offsets.npy", offsets)
+    np.save(staging / "docs.npy", docs)
+    np.save(staging / "tfs.npy", tfs)
+    np.save(staging / "lengths.npy", lengths)
+    with open(staging / "meta.json", "w", encoding="utf-8") as handle:
+        json.dump({
+            "terms": terms,
+            "passages": [p._asdict() for p in passages],
+            "synced_until": synced_until.isoformat() if synced_until else None,
+        }, handle)
+
+    previous = index_dir.with_name(f"{index_dir.name}.old-{suffix}")
+    with _lock(_lock_path(index_dir, "swap"), exclusive=True):
+        if index_dir.exists():
+            index_dir.rename(previous)
+        staging.rename(index_dir)
+    _remove_dir(previous)  # open memory maps of the old files stay valid
+
+class RetrievalIndex:
+    def __init__(self, index_dir: Path = RETRIEVAL_INDEX_DIR):
+        self.index_dir = Path(index_dir)
+        self.synced_until: Optional[datetime] = None
+
+        # Base segment (memory-mapped, read-only)
+        self._base_passages: List[Passage] = []
+        self._base_terms: Dict[str, int] = {}
+        self._base_offsets = np.zeros(1, dtype=np.int64)
+        self._base_docs = np.zeros(0, dtype=np.int32)
+        self._base_tfs = np.zeros(0, dtype=np.float32)
+        self._base_lengths = np.zeros(0, dtype=np.float32)
+        self._base_stamp: Optional[Tuple[int, int]] = None
+
+        # Delta segment (in memory): term -> [(local doc id, tf)]
+        self._delta_passages: List[Passage] = []
+        self._delta_postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._delta_lengths: List[int] = []
+
+        self._indexed_sources = set()
+
+    def __len__(self) -> int:
+        return len(self._base_passages) + len(self._delta_passages)
+
+    @property
+    def delta_size(self) -> int:
+        return len(self._delta_passages)
+
+    # ----- building -----
+
+    def add(self, passages: List[Passage]):
+        for passage in passages:
+            key = (passage.source, passage.source_id, hash(passage.text))
+            if key in self._indexed_sources:
+                continue
+            self._indexed_sources.add(key)
+
+            doc_id = len(self._delta_passages)
+            terms = Counter(tokenize(passage.text + " " + passage.topic))
+            for term, tf in terms.items():
+                self._delta_postings[term].append((doc_id, tf))
+            self._delta_passages.append(passage)
+            self._delta_lengths.append(sum(terms.values()))
+
+    def add_document(self, doc: dict, source: str):
+        self.add(catalog_passages(doc, source))
+
+    async def sync(self):
+        """Index catalog documents created since the previous sync"""
+        started = datetime.utcnow()
+        created = {"$gt": self.synced_until} if self.synced_until else {"$exists": True}
+
+        sources = [
+            ("book", books_collection, {"approved": True, "summary": {"$nin": [None, ""]}}, {"summary": 1}),
+            ("video", videos_collection, {"approved": True, "description": {"$nin": [None, ""]}}, {"description": 1}),
+            ("quiz", quizzes_collection, {}, {"questions.explanation": 1}),
+        ]
+        added = 0
+        for source, collection, query, fields in sources:
+            projection = {"_id": 0, "id": 1, "title": 1, "subject": 1, "topic": 1, **fields}
+            async for doc in collection.find({**query, "created_at": created}, projection):
+                before = len(self)
+                self.add_document(doc, source)
+                added += len(self) - before
+
+        self.synced_until = started - SYNC_OVERLAP
+        return added
+
+    # ----- persistence -----
+
+    async def persist(self) -> bool:
+        """Merge the delta into a new on-disk base, unless another worker is writing one
+
+        Returns whether this worker wrote. Either way the newest base on disk is
+        loaded afterwards.
+        """
+        writer = await asyncio.to_thread(_lock, _lock_path(self.index_dir, "writer"), True, False)
+        if writer is None:
+            await self.refresh()
+            return False
+        try:
+            # Merge onto whatever another worker wrote last
+            await self.refresh()
+            if not self._delta_passages:
+                return False
+            base = BaseSegment(
+                self._base_stamp, list(self._base_passages), self._base_terms, self._base_offsets,
+                self._base_docs, self._base_tfs, self._base_lengths, None
+            )
+            delta_postings = {term: list(entries) for term, entries in self._delta_postings.items()}
+            await asyncio.to_thread(
+                _write_base, self.index_dir, base, list(self._delta_passages), delta_postings,
+                list(self._delta_lengths), self.synced_until
+            )
+        finally:
+            writer.close()
+        await self.refresh()
+        return True
+
+    def load(self) -> bool:
+        """Open the on-disk base segment; returns False when there is none yet"""
+        base = _read_base(self.index_dir)
+        if base is None:
+            return False
+        self._apply_base(base)
+        return True
+
+    async def refresh(self) -> bool:
+        """Load the on-disk base if it changed since this worker last loaded it"""
+        stamp = await asyncio.to_thread(_base_stamp, self.index_dir)
+        if stamp is None or stamp == self._base_stamp:
+            return False
+        base = await asyncio.to_thread(_read_base, self.index_dir)
+        if base is None:
+            return False
+        self._apply_base(base)
+        return True
+
+    def _apply_base(self, base: BaseSegment):
+        """Switch to a new base segment, keeping delta passages it doesn't cover"""
+        pending = self._delta_passages
+        self._base_stamp = base.stamp
+        self._base_passages = base.passages
+        self._base_terms = base.terms
+        self._base_offsets = base.offsets
+        self._base_docs = base.docs
+        self._base_tfs = base.tfs
+        self._base_lengths = base.lengths
+        if self.synced_until is None:
+            self.synced_until = base.synced_until  # a running worker's own sync point is at least as complete
+
+        self._delta_passages = []
+        self._delta_postings = defaultdict(list)
+        self._delta_lengths = []
+        self._indexed_sources = {(p.source, p.source_id, hash(p.text)) for p in self._base_passages}
+        self.add(pending)
+
+    # ----- search -----
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Doc ids (in the combined id space) and term frequencies for a term"""
+        doc_parts, tf_parts = [], []
+        term_id = self._base_terms.get(term)
+        if term_id is not None:
+            start, end = self._base_offsets[term_id], self._base_offsets[term_id + 1]
+            doc_parts.append(np.asarray(self._base_docs[start:end]))
+            tf_parts.append(np.asarray(self._base_tfs[start:end]))
+        delta = self._delta_postings.get(term)
+        if delta:
+            entries = np.asarray(delta, dtype=np.float64)
+            doc_parts.append(entries[:, 0].astype(np.int32) + len(self._base_passages))
+            tf_parts.append(entries[:, 1].astype(np.float32))
+        if not doc_parts:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        return np.concatenate(doc_parts), np.concatenate(tf_parts)
+
+    def search(
+        self,
+        query: str,
+        k: int = RETRIEVAL_TOP_K,
+        subject: Optional[str] = None,
+        topic: Optional[str] = None
+    ) -> List[RetrievedPassage]:
+        total = len(self)
+        terms = set(tokenize(query))
+        if not total or not terms:
+            return []
+
+        lengths = self._base_lengths
+        if self._delta_lengths:
+            lengths = np.concatenate([lengths, np.asarray(self._delta_lengths, dtype=np.float32)])
+        avg_length = float(lengths.mean()) or 1.0
+
+        scores = np.zeros(total, dtype=np.float32)
+        for term in terms:
+            docs, tfs = self._postings(term)
+            if not len(docs):
+                continue
+            idf = np.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = tfs + BM25_K1 * (1 - BM25_B + BM25_B * lengths[docs] / avg_length)
+            scores[docs] += idf * tfs * (BM25_K1 + 1) / norm
+
+        candidates = np.flatnonzero(scores)
+        if not len(candidates):
+            return []
+        # Over-fetch so subject/topic filtering still leaves k results
+        fetch = min(len(candidates), k * 4 if (subject or topic) else k)
+        top = candidates[np.argpartition(-scores[candidates], fetch - 1)[:fetch]]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for doc_id in top.tolist():
+            passage = self._passage(doc_id)
+            if subject and passage.subject != subject:
+                continue
+            if topic and passage.topic != topic:
+                continue
+            results.append(RetrievedPassage(passage, float(scores[doc_id])))
+            if len(results) == k:
+                break
+        return results
+
+    def _passage(self, doc_id: int) -> Passage:
+        if doc_id < len(self._base_passages):
+            return self._base_passages[doc_id]
+        return self._delta_passages[doc_id - len(self._base_passages)]
+
+def format_context(results: List[RetrievedPassage], budget: int = RETRIEVAL_TOKEN_BUDGET) -> str:
+    """Render retrieved passages for the system prompt, stopping at the token budget"""
+    blocks = []
+    used = 0
+    for result in results:
+        passage = result.passage
+        block = f"- [{passage.source}: {passage.title} / {passage.topic}] {passage.text}"
+        cost = estimate_tokens(block)
+        if used + cost > budget:
+            break
+        blocks.append(block)
+        used += cost
+    if not blocks:
+        return ""
+    return (
+        "\n\nRelevant material from our course catalog (prefer it over general knowledge "
+        "and keep answers consistent with it):\n" + "\n".join(blocks)
+    )
+
+retrieval_index = RetrievalIndex()
+
+async def _sync_loop():
+    while True:
+        try:
+            added = await retrieval_index.sync()
+            if added:
+                logger.info(f"Retrieval index: {added} new passages")
+            if retrieval_index.delta_size:
+                await retrieval_index.persist()
+        except Exception as e:
+            logger.error(f"Retrieval index sync failed: {str(e)}")
+        await asyncio.sleep(RETRIEVAL_SYNC_SECONDS)
+
+def start_retrieval_sync() -> asyncio.Task:
+    """Open the persisted index and keep it in sync with the catalog in the background"""
+    retrieval_index.load()
+    return background_task(_sync_loop())
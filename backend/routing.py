@@ -0,0 +1,183 @@
+"""
+Model routing for tutor chat.
+
+Requests are classified cheaply into a tier ("fast", "standard" or "deep") from
+the message length and shape, context_type, subject and how well the catalog
+retrieval matched. Each tier maps to a configurable model. The router keeps an
+EWMA of latency and error rate per model and shifts a tier's traffic to the next
+healthy model while its own is degraded, leaving a small probe share so the
+model can recover.
+"""
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import logging
+import os
+import random
+import re
+import time
+
+import llm
+from llm import ModelSpec
+from retrieval import RetrievedPassage, tokenize
+
+logger = logging.getLogger(__name__)
+
+TIER_MODELS: Dict[str, ModelSpec] = {
+    "fast": ModelSpec.parse(os.getenv("LLM_FAST_MODEL", "openai/gpt-5-mini")),
+    "standard": ModelSpec.parse(os.getenv("LLM_STANDARD_MODEL", str(llm.DEFAULT_MODEL))),
+    "deep": ModelSpec.parse(os.getenv("LLM_DEEP_MODEL", str(llm.DEFAULT_MODEL))),
+}
+# Where a tier's traffic goes, in order, when its own model is degraded
+TIER_FALLBACKS = {
+    "fast": ["fast", "standard", "deep"],
+    "standard": ["standard", "deep", "fast"],
+    "deep": ["deep", "standard", "fast"],
+}
+# Latency EWMA above which a model counts as degraded for the tier
+TIER_LATENCY_BUDGET_SECONDS = {
+    "fast": float(os.getenv("LLM_FAST_LATENCY_BUDGET_SECONDS", "8")),
+    "standard": float(os.getenv("LLM_STANDARD_LATENCY_BUDGET_SECONDS", "20")),
+    "deep": float(os.getenv("LLM_DEEP_LATENCY_BUDGET_SECONDS", "40")),
+}
+
+ROUTING_EWMA_ALPHA = float(os.getenv("LLM_ROUTING_EWMA_ALPHA", "0.2"))
+ROUTING_MAX_ERROR_RATE = float(os.getenv("LLM_ROUTING_MAX_ERROR_RATE", "0.3"))
+ROUTING_PROBE_RATE = float(os.getenv("LLM_ROUTING_PROBE_RATE", "0.05"))
+ROUTING_MIN_SAMPLES = 5
+
+FAST_MAX_CHARS = int(os.getenv("LLM_ROUTING_FAST_MAX_CHARS", "160"))
+DEEP_MIN_CHARS = int(os.getenv("LLM_ROUTING_DEEP_MIN_CHARS", "600"))
+CONFIDENT_RETRIEVAL_SCORE = float(os.getenv("LLM_ROUTING_CONFIDENT_SCORE", "2.5"))  # per query term
+DEEP_SUBJECTS = {
+    s.strip().lower()
+    for s in os.getenv("LLM_ROUTING_DEEP_SUBJECTS", "Mathematics,Maths,Physics,Chemistry").split(",")
+    if s.strip()
+}
+
+_DEFINITION_RE = re.compile(
+    r"^(what\s+(is|are|does)|define|definition\s+of|meaning\s+of|who\s+(is|was)|full\s+form\s+of|when\s+(is|was|did))\b"
+)
+_REASONING_RE = re.compile(
+    r"\b(prove|proof|derive|derivation|step[\s-]by[\s-]step|solve|calculate|evaluate|integrate|differentiate|"
+    r"why\s+does|compare|contrast|explain\s+how)\b"
+)
+_MATH_RE = re.compile(r"[=^√∫∑]|\d\s*[-+*/]\s*\d|\b(sin|cos|tan|log)\b")
+
+class Route(NamedTuple):
+    tier: str
+    reason: str
+
+def retrieval_confidence(results: List[RetrievedPassage], query: str) -> float:
+    """Top BM25 score per distinct query term, so long and short questions compare"""
+    terms = set(tokenize(query))
+    if not results or not terms:
+        return 0.0
+    return results[0].score / len(terms)
+
+def classify_request(
+    message: str,
+    context_type: Optional[str] = None,
+    subject: Optional[str] = None,
+    confidence: float = 0.0
+) -> Route:
+    """Pick a tier from cheap signals only; no model call"""
+    text = " ".join(message.lower().split())
+    reasoning = bool(_REASONING_RE.search(text))
+    mathematical = bool(_MATH_RE.search(text))
+
+    if len(text) >= DEEP_MIN_CHARS:
+        return Route("deep", "long")
+    if reasoning and (mathematical or (subject or "").lower() in DEEP_SUBJECTS):
+        return Route("deep", "multi-step")
+    if context_type == "summary" or reasoning or mathematical:
+        return Route("standard", "default")
+    if _DEFINITION_RE.match(text) and len(text) <= FAST_MAX_CHARS:
+        return Route("fast", "definition")
+    if confidence >= CONFIDENT_RETRIEVAL_SCORE and len(text) <= FAST_MAX_CHARS:
+        return Route("fast", "grounded")
+    return Route("standard", "default")
+
+class ModelHealth:
+    """Exponentially weighted latency and error rate of one model"""
+
+    def __init__(self, alpha: float = ROUTING_EWMA_ALPHA):
+        self.alpha = alpha
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples = 0
+
+    def record(self, seconds: float, ok: bool):
+        self.samples += 1
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.alpha * (seconds - self.latency)
+        self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+
+class ModelRouter:
+    def __init__(self, tiers: Dict[str, ModelSpec] = TIER_MODELS):
+        self.tiers = tiers
+        self.health: Dict[ModelSpec, ModelHealth] = defaultdict(ModelHealth)
+        self._degraded: Dict[ModelSpec, bool] = {}
+
+    def is_degraded(self, model: ModelSpec, tier: str) -> bool:
+        if llm.llm_breakers[model].state == "open":
+            return True
+        health = self.health[model]
+        if health.samples < ROUTING_MIN_SAMPLES:
+            return False
+        return health.error_rate > ROUTING_MAX_ERROR_RATE or health.latency > TIER_LATENCY_BUDGET_SECONDS[tier]
+
+    def candidates(self, tier: str) -> List[ModelSpec]:
+        """Models to try for a tier, healthiest first"""
+        models = []
+        for fallback in TIER_FALLBACKS[tier]:
+            model = self.tiers[fallback]
+            if model not in models:
+                models.append(model)
+
+        healthy = [m for m in models if not self.is_degraded(m, tier)]
+        degraded = [m for m in models if m not in healthy]
+        self._note_shift(tier, models[0], models[0] in degraded)
+        if healthy and degraded and degraded[0] == models[0] and random.random() < ROUTING_PROBE_RATE:
+            # Keep a trickle of traffic on the preferred model so its health can recover
+            healthy.insert(0, degraded.pop(0))
+        return healthy + degraded
+
+    def _note_shift(self, tier: str, preferred: ModelSpec, degraded: bool):
+        if degraded != self._degraded.get(preferred, False):
+            self._degraded[preferred] = degraded
+            if degraded:
+                health = self.health[preferred]
+                logger.warning(
+                    f"Routing {tier} traffic away from {preferred} "
+                    f"(latency {health.latency or 0:.2f}s, error rate {health.error_rate:.0%})"
+                )
+            else:
+                logger.info(f"Routing {tier} traffic back to {preferred}")
+
+    async def generate(
+        self,
+        route: Route,
+        session_id: str,
+        system_message: str,
+        text: str,
+        background: bool = False
+    ) -> Tuple[str, ModelSpec]:
+        """Generate with the route's tier; returns the reply and the model that produced it"""
+        models = self.candidates(route.tier)
+        for index, model in enumerate(models):
+            started = time.monotonic()
+            try:
+                reply = await llm.generate(session_id, system_message, text, background=background, model=model)
+            except llm.LlmUnavailable as e:
+                if not e.short_circuited:
+                    self.health[model].record(time.monotonic() - started, ok=False)
+                if index + 1 < len(models) and (e.short_circuited or self.is_degraded(model, route.tier)):
+                    # Nothing was sent, or this was a probe of a degraded model: use the next one
+                    continue
+                raise
+            self.health[model].record(time.monotonic() - started, ok=True)
+            return reply, model
+
+model_router = ModelRouter()
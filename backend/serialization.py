@@ -0,0 +1,50 @@
+"""
+Trusted-read fast path for list endpoints.
+
+Documents in our own collections were written from validated models, so list
+endpoints don't need to rebuild a pydantic model per row and have FastAPI
+validate it again against response_model. TrustedReader projects exactly the
+model's fields, fills in defaults for fields older documents may lack, and the
+rows are encoded straight to JSON by pydantic-core (datetime, enum and UUID
+aware). Returning a Response skips FastAPI's response_model validation, while
+response_model still documents the shape in OpenAPI.
+"""
+from typing import Any, Callable, Dict, Iterable, List, Type
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic_core import PydanticUndefined, to_json
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered by pydantic-core instead of jsonable_encoder + json.dumps"""
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+class TrustedReader:
+    """Projection and default-filling for documents of one model"""
+
+    def __init__(self, model: Type[BaseModel]):
+        self.model = model
+        self.projection = {"_id": 0, **{name: 1 for name in model.model_fields}}
+        self._defaults: Dict[str, Any] = {}
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        for name, field in model.model_fields.items():
+            if field.default_factory is not None:
+                self._factories[name] = field.default_factory
+            elif field.default is not PydanticUndefined:
+                self._defaults[name] = field.default
+
+    def row(self, doc: dict) -> dict:
+        if self._defaults:
+            doc = {**self._defaults, **doc}
+        for name, factory in self._factories.items():
+            if name not in doc:
+                doc[name] = factory()
+        return doc
+
+    def rows(self, docs: Iterable[dict]) -> List[dict]:
+        return [self.row(doc) for doc in docs]
+
+def trusted_response(reader: TrustedReader, docs: Iterable[dict]) -> FastJSONResponse:
+    return FastJSONResponse(reader.rows(docs))
@@ -1,21 +1,52 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, UploadFile, File, WebSocket, WebSocketDisconnect, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
 from pathlib import Path
+from pydantic import ValidationError
 import os
 import logging
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
 from datetime import datetime
 import asyncio
+import json
 
 from models import *
 from auth import verify_password, get_password_hash, create_access_token, decode_access_token
 from database import (
     db, users_collection, books_collection, videos_collection,
     quizzes_collection, quiz_attempts_collection, chat_sessions_collection,
-    topic_progress_collection, student_profiles_collection, init_db
+    topic_progress_collection, student_profiles_collection, jobs_collection,
+    bootstrap_indexes, warm_pool, client as mongo_client
 )
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+from progress import merge_quiz_scores, quiz_progress_updates
+from chat_context import SUMMARY_SYSTEM_MESSAGE, assemble_prompt, summary_request, turn_session_id
+from heartbeats import heartbeat_coalescer
+from jobs import JobParamsInvalid, job_runner
+import ai_jobs  # registers job handlers
+from encoding import EncodingMiddleware
+from metrics import MetricsMiddleware, metrics_response, queue_depth
+from tracing import TracingMiddleware, background_task, span
+from profiler import ProfilerBusy, ProfilerMiddleware, profiler
+from serialization import TrustedReader, trusted_response
+from batch import BatchDispatcher, memoized
+from retrieval import retrieval_index, start_retrieval_sync, format_context
+from routing import classify_request, model_router, retrieval_confidence
+from chat_socket import (
+    CLOSE_SERVICE_RESTART, CLOSE_UNAUTHORIZED, WS_AUTH_TIMEOUT_SECONDS, ChatConnection, chat_connections, iter_chunks
+)
+from catalog import taxonomy_cache
+from chat_archive import ArchiveUnavailable, chat_archive
+from summaries import is_summary_request, resolve_key, summary_store
+from idempotency import run_idempotent
+from write_behind import quiz_write_behind
+from lifecycle import LifecycleMiddleware, lifecycle
+from quiz_sessions import (
+    AnswerKey, answer_key_cache, select_questions, create_attempt_token, decode_attempt_token
+)
+import llm
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -26,6 +57,14 @@ app = FastAPI(title="AI Tutor Platform")
 # Create router with /api prefix
 api_router = APIRouter(prefix="/api")
 
+# List endpoints return stored documents without re-validating them
+book_reader = TrustedReader(Book)
+video_reader = TrustedReader(Video)
+quiz_reader = TrustedReader(Quiz)
+progress_reader = TrustedReader(TopicProgress)
+chat_session_reader = TrustedReader(ChatSession)
+chat_session_list_reader = TrustedReader(ChatSessionListItem)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -38,21 +77,26 @@ async def get_current_user(authorization: Optional[str] = Header(None)) -> UserI
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    token = authorization.split(" ")[1]
-    payload = decode_access_token(token)
-    
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
-    user_id = payload.get("sub")
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
-    user_doc = await users_collection.find_one({"id": user_id})
-    if not user_doc:
-        raise HTTPException(status_code=401, detail="User not found")
-    
-    return UserInDB(**user_doc)
+    user, _ = await authenticate_token(authorization.split(" ")[1])
+    return user
+
+async def authenticate_token(token: str) -> Tuple[UserInDB, dict]:
+    """Resolve an access token to its user; returns the user and the token claims"""
+    with span("auth"):
+        payload = decode_access_token(token)
+        
+        if not payload:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        
+        user_id = payload.get("sub")
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        
+        user_doc = await users_collection.find_one({"id": user_id})
+        if not user_doc:
+            raise HTTPException(status_code=401, detail="User not found")
+        
+        return UserInDB(**user_doc), payload
 
 # ============= Authentication Routes =============
 @api_router.post("/auth/register")
@@ -124,6 +168,9 @@ async def create_book(book: BookCreate, current_user: UserInDB = Depends(get_cur
         book_doc.approved = True
     
     await books_collection.insert_one(book_doc.dict())
+    if book_doc.approved:
+        retrieval_index.add_document(book_doc.dict(), "book")
+        taxonomy_cache.add(book_doc.dict())
     return book_doc
 
 @api_router.get("/books", response_model=List[Book])
@@ -151,8 +198,8 @@ async def get_books(
             {"tags": {"$regex": search, "$options": "i"}}
         ]
     
-    books = await books_collection.find(query).to_list(100)
-    return [Book(**book) for book in books]
+    books = await books_collection.find(query, book_reader.projection).to_list(100)
+    return trusted_response(book_reader, books)
 
 @api_router.get("/books/{book_id}", response_model=Book)
 async def get_book(book_id: str):
@@ -173,6 +220,9 @@ async def create_video(video: VideoCreate, current_user: UserInDB = Depends(get_
         video_doc.approved = True
     
     await videos_collection.insert_one(video_doc.dict())
+    if video_doc.approved:
+        retrieval_index.add_document(video_doc.dict(), "video")
+        taxonomy_cache.add(video_doc.dict())
     return video_doc
 
 @api_router.get("/videos", response_model=List[Video])
@@ -203,8 +253,8 @@ async def get_videos(
             {"tags": {"$regex": search, "$options": "i"}}
         ]
     
-    videos = await videos_collection.find(query).to_list(100)
-    return [Video(**video) for video in videos]
+    videos = await videos_collection.find(query, video_reader.projection).to_list(100)
+    return trusted_response(video_reader, videos)
 
 @api_router.get("/videos/{video_id}", response_model=Video)
 async def get_video(video_id: str):
@@ -221,6 +271,8 @@ async def create_quiz(quiz: QuizCreate, current_user: UserInDB = Depends(get_cur
     
     quiz_doc = Quiz(**quiz.dict(), created_by=current_user.id)
     await quizzes_collection.insert_one(quiz_doc.dict())
+    answer_key_cache.put(AnswerKey.from_doc(quiz_doc.dict()))
+    retrieval_index.add_document(quiz_doc.dict(), "quiz")
     return quiz_doc
 
 @api_router.get("/quizzes", response_model=List[Quiz])
@@ -241,13 +293,14 @@ async def get_quizzes(
     if topic:
         query["topic"] = topic
     
-    quizzes = await quizzes_collection.find(query).to_list(100)
-    return [Quiz(**quiz) for quiz in quizzes]
+    quizzes = await quizzes_collection.find(query, quiz_reader.projection).to_list(100)
+    return trusted_response(quiz_reader, quizzes)
 
-@api_router.post("/quizzes/{quiz_id}/attempt")
-async def submit_quiz(
+@api_router.post("/quizzes/{quiz_id}/start")
+async def start_quiz(
     quiz_id: str,
-    answers: List[int],
+    count: Optional[int] = None,
+    shuffle: bool = True,
     current_user: UserInDB = Depends(get_current_user)
 ):
     quiz_doc = await quizzes_collection.find_one({"id": quiz_id})
@@ -255,128 +308,527 @@ async def submit_quiz(
         raise HTTPException(status_code=404, detail="Quiz not found")
     
     quiz = Quiz(**quiz_doc)
+    answer_key = answer_key_cache.put(AnswerKey.from_doc(quiz_doc))
     
-    # Calculate score
-    correct_count = 0
-    for i, answer in enumerate(answers):
-        if i < len(quiz.questions) and answer == quiz.questions[i].correct_answer:
-            correct_count += 1
+    # Sample/permute questions and sign what was served
+    question_ids = select_questions(len(quiz.questions), count, shuffle)
+    attempt_token, expires_at = create_attempt_token(current_user.id, answer_key, question_ids)
     
-    score = (correct_count / len(quiz.questions)) * 100 if quiz.questions else 0
+    return {
+        "attempt_token": attempt_token,
+        "expires_at": expires_at,
+        "quiz_id": quiz.id,
+        "title": quiz.title,
+        "subject": quiz.subject,
+        "topic": quiz.topic,
+        "difficulty": quiz.difficulty,
+        "questions": [
+            {"question": quiz.questions[i].question, "options": quiz.questions[i].options}
+            for i in question_ids
+        ]
+    }
+
+@api_router.post("/quizzes/{quiz_id}/attempt")
+async def submit_quiz(
+    quiz_id: str,
+    answers: List[int],
+    x_attempt_token: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    return await run_idempotent(
+        idempotency_key,
+        current_user.id,
+        f"quiz_attempt:{quiz_id}",
+        {"answers": answers, "attempt_token": x_attempt_token},
+        lambda: grade_quiz_attempt(quiz_id, answers, x_attempt_token, current_user)
+    )
+
+async def grade_quiz_attempt(
+    quiz_id: str,
+    answers: List[int],
+    x_attempt_token: Optional[str],
+    current_user: UserInDB
+):
+    question_ids = None
+    
+    if x_attempt_token:
+        claims = decode_attempt_token(x_attempt_token, current_user.id, quiz_id)
+        if not claims:
+            raise HTTPException(status_code=400, detail="Invalid attempt token")
+        question_ids = claims["q"]
+        
+        answer_key = await answer_key_cache.get(quiz_id)
+        if answer_key and not answer_key.matches(question_ids, claims["d"]):
+            # Cached key may be stale; re-read once before rejecting
+            answer_key = await answer_key_cache.get(quiz_id, refresh=True)
+            if answer_key and not answer_key.matches(question_ids, claims["d"]):
+                raise HTTPException(status_code=409, detail="Quiz has changed since the attempt started")
+    else:
+        answer_key = await answer_key_cache.get(quiz_id)
+    
+    if not answer_key:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    
+    # Calculate score
+    correct_count, total, score = answer_key.grade(answers, question_ids)
     
     attempt = QuizAttempt(
         quiz_id=quiz_id,
         user_id=current_user.id,
         answers=answers,
+        question_ids=question_ids,
         score=score
     )
     
-    await quiz_attempts_collection.insert_one(attempt.dict())
-    
-    # Update progress
-    await update_topic_progress(
-        current_user.id,
-        quiz.stream,
-        quiz.class_level,
-        quiz.subject,
-        quiz.topic,
-        score
-    )
+    if quiz_write_behind:
+        # Acknowledge once durable locally; Mongo writes happen in group commits
+        await quiz_write_behind.submit(
+            attempt, answer_key.stream, answer_key.class_level, answer_key.subject, answer_key.topic
+        )
+    else:
+        await quiz_attempts_collection.insert_one(attempt.dict())
+        
+        # Update progress
+        await update_topic_progress(
+            current_user.id,
+            answer_key.stream,
+            answer_key.class_level,
+            answer_key.subject,
+            answer_key.topic,
+            score
+        )
     
     return {
         "score": score,
         "correct": correct_count,
-        "total": len(quiz.questions),
+        "total": total,
         "attempt_id": attempt.id
     }
 
+MAX_ATTEMPT_BATCH_SIZE = int(os.getenv("MAX_ATTEMPT_BATCH_SIZE", "500"))
+
+@api_router.post("/quizzes/attempts/batch")
+async def submit_quiz_batch(
+    batch: QuizAttemptBatch,
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Grade and store many attempts at once, e.g. when an offline device syncs"""
+    if len(batch.attempts) > MAX_ATTEMPT_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_ATTEMPT_BATCH_SIZE} attempts per batch")
+    
+    # Drop replays within the batch, then replays of earlier syncs
+    submissions = list({s.client_attempt_id: s for s in batch.attempts}.values())
+    results = {}
+    
+    existing = quiz_attempts_collection.find(
+        {"user_id": current_user.id, "client_attempt_id": {"$in": [s.client_attempt_id for s in submissions]}},
+        {"_id": 0, "id": 1, "client_attempt_id": 1, "score": 1}
+    )
+    async for doc in existing:
+        results[doc["client_attempt_id"]] = {
+            "status": "duplicate", "attempt_id": doc["id"], "score": doc["score"]
+        }
+    
+    pending = [s for s in submissions if s.client_attempt_id not in results]
+    answer_keys = await answer_key_cache.get_many([s.quiz_id for s in pending])
+    
+    graded = []
+    for submission in pending:
+        answer_key = answer_keys.get(submission.quiz_id)
+        if not answer_key:
+            results[submission.client_attempt_id] = {"status": "rejected", "detail": "Quiz not found"}
+            continue
+        
+        question_ids = None
+        if submission.attempt_token:
+            claims = decode_attempt_token(submission.attempt_token, current_user.id, submission.quiz_id)
+            if not claims:
+                results[submission.client_attempt_id] = {"status": "rejected", "detail": "Invalid attempt token"}
+                continue
+            question_ids = claims["q"]
+            if not answer_key.matches(question_ids, claims["d"]):
+                results[submission.client_attempt_id] = {
+                    "status": "rejected", "detail": "Quiz has changed since the attempt started"
+                }
+                continue
+        
+        correct_count, total, score = answer_key.grade(submission.answers, question_ids)
+        attempt = QuizAttempt(
+            quiz_id=submission.quiz_id,
+            user_id=current_user.id,
+            answers=submission.answers,
+            question_ids=question_ids,
+            score=score,
+            client_attempt_id=submission.client_attempt_id,
+            completed_at=submission.completed_at or datetime.utcnow()
+        )
+        graded.append((attempt, answer_key))
+        results[submission.client_attempt_id] = {
+            "status": "accepted", "attempt_id": attempt.id, "score": score,
+            "correct": correct_count, "total": total
+        }
+    
+    # Single unordered write; a concurrent replay surfaces as a duplicate key error
+    stored = graded
+    if graded:
+        try:
+            await quiz_attempts_collection.bulk_write(
+                [InsertOne(attempt.dict()) for attempt, _ in graded], ordered=False
+            )
+        except BulkWriteError as e:
+            failed = set()
+            for err in e.details.get("writeErrors", []):
+                failed.add(err["index"])
+                client_attempt_id = graded[err["index"]][0].client_attempt_id
+                if err.get("code") == 11000:
+                    results[client_attempt_id] = {"status": "duplicate"}
+                else:
+                    results[client_attempt_id] = {"status": "rejected", "detail": err.get("errmsg")}
+            stored = [item for index, item in enumerate(graded) if index not in failed]
+    
+    # One merged progress update per (user, subject, topic)
+    merged = merge_quiz_scores(
+        (attempt.user_id, key.stream, key.class_level, key.subject, key.topic, attempt.score)
+        for attempt, key in stored
+    )
+    if merged:
+        await topic_progress_collection.bulk_write(quiz_progress_updates(merged), ordered=False)
+    
+    statuses = [results[s.client_attempt_id]["status"] for s in submissions]
+    return {
+        "results": [{"client_attempt_id": s.client_attempt_id, **results[s.client_attempt_id]} for s in submissions],
+        "accepted": statuses.count("accepted"),
+        "duplicates": statuses.count("duplicate"),
+        "rejected": statuses.count("rejected")
+    }
+
 # ============= AI Chat Routes =============
 @api_router.post("/chat")
 async def chat_with_ai(
     chat_request: ChatRequest,
+    idempotency_key: Optional[str] = Header(None),
     current_user: UserInDB = Depends(get_current_user)
 ):
+    return await run_idempotent(
+        idempotency_key,
+        current_user.id,
+        "chat",
+        chat_request,
+        lambda: generate_chat_reply(chat_request, current_user)
+    )
+
+async def generate_chat_reply(chat_request: ChatRequest, current_user: UserInDB):
     try:
         # Get or create session
+        session = None
         if chat_request.session_id:
-            session_doc = await chat_sessions_collection.find_one({"id": chat_request.session_id})
-            if session_doc:
-                session = ChatSession(**session_doc)
-            else:
-                session = ChatSession(user_id=current_user.id, subject=chat_request.subject, topic=chat_request.topic)
-        else:
+            session = await chat_archive.load_for_update(chat_request.session_id, current_user.id)
+        if session is None:
             session = ChatSession(user_id=current_user.id, subject=chat_request.subject, topic=chat_request.topic)
         
         # Add user message to session
         user_message = ChatMessage(role="user", content=chat_request.message)
         session.messages.append(user_message)
         
-        # Create AI chat instance
-        emergent_llm_key = os.getenv("EMERGENT_LLM_KEY")
-        
-        # Build system message based on context
-        if chat_request.context_type == "summary":
-            system_message = f"You are an expert AI tutor for {chat_request.subject or 'various subjects'}. Provide clear, concise summaries of educational topics. Focus on key concepts and make them easy to understand for students."
-        elif chat_request.context_type == "doubt":
-            system_message = f"You are an AI tutor helping students with doubts and questions about {chat_request.subject or 'their subjects'}. Provide detailed explanations with examples. Be patient, encouraging, and thorough."
-        else:
-            system_message = "You are a helpful AI tutor. Assist students with their learning needs."
-        
-        # Create LLM chat
-        llm_chat = LlmChat(
-            api_key=emergent_llm_key,
-            session_id=session.id,
-            system_message=system_message
-        ).with_model("openai", "gpt-5.2")
-        
-        # Get AI response
-        ai_response_text = await llm_chat.send_message(
-            UserMessage(text=chat_request.message)
-        )
+        ai_response_text, prompt = await answer_chat(chat_request, session)
         
         # Add AI response to session
         ai_message = ChatMessage(role="assistant", content=ai_response_text)
         session.messages.append(ai_message)
         session.updated_at = datetime.utcnow()
         
-        # Save session
+        # Save session (the summary fields are owned by the background refresh)
         await chat_sessions_collection.update_one(
             {"id": session.id},
-            {"$set": session.dict()},
+            {"$set": session.dict(exclude={"summary", "summary_upto"})},
             upsert=True
         )
         
+        if prompt and prompt.needs_summary_refresh(session):
+            schedule_summary_refresh(session, prompt.compactable_upto)
+        
         return {
             "response": ai_response_text,
             "session_id": session.id
         }
         
+    except llm.LlmUnavailable as e:
+        # Fail fast with something the student can act on instead of a raw 500
+        logger.warning(f"Chat degraded: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail=CHAT_DEGRADED_MESSAGE,
+            headers={"Retry-After": str(max(1, round(e.retry_after)))}
+        )
+    except ArchiveUnavailable as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=503, detail="This chat session is temporarily unavailable")
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
-@api_router.get("/chat/sessions")
+CHAT_DEGRADED_MESSAGE = "The AI tutor is busy right now. Please try again in a moment."
+
+async def answer_chat(chat_request: ChatRequest, session: ChatSession):
+    """Reply to the session's latest message; returns (text, assembled prompt or None)"""
+    # Plain "summarize this topic" requests are served from the stored summaries
+    summary_key = None
+    if (chat_request.context_type == "summary" and chat_request.subject and chat_request.topic
+            and is_summary_request(chat_request.message, chat_request.topic)):
+        summary_key = await resolve_key(
+            chat_request.subject,
+            chat_request.topic,
+            chat_request.stream.value if chat_request.stream else None,
+            chat_request.class_level
+        )
+    
+    if summary_key:
+        return await summary_store.get(summary_key), None
+    return await generate_tutor_reply(chat_request, session)
+
+async def generate_tutor_reply(chat_request: ChatRequest, session: ChatSession):
+    """Ask the model for a reply to the session's latest message; returns (text, assembled prompt)"""
+    # Build system message based on context
+    if chat_request.context_type == "summary":
+        system_message = f"You are an expert AI tutor for {chat_request.subject or 'various subjects'}. Provide clear, concise summaries of educational topics. Focus on key concepts and make them easy to understand for students."
+    elif chat_request.context_type == "doubt":
+        system_message = f"You are an AI tutor helping students with doubts and questions about {chat_request.subject or 'their subjects'}. Provide detailed explanations with examples. Be patient, encouraging, and thorough."
+    else:
+        system_message = "You are a helpful AI tutor. Assist students with their learning needs."
+    
+    # Ground the answer in our own catalog when we have relevant material
+    retrieved = retrieval_index.search(chat_request.message, subject=chat_request.subject)
+    system_message += format_context(retrieved)
+    
+    # Keep the prompt within budget: summary of older turns plus recent turns verbatim
+    prompt = assemble_prompt(system_message, session, chat_request.message)
+    
+    # Simple questions go to a fast model, multi-step ones to the strongest
+    route = classify_request(
+        chat_request.message,
+        chat_request.context_type,
+        chat_request.subject,
+        retrieval_confidence(retrieved, chat_request.message)
+    )
+    
+    # Get AI response
+    ai_response_text, _ = await model_router.generate(
+        route, turn_session_id(session), prompt.system_message, chat_request.message
+    )
+    return ai_response_text, prompt
+
+# Background summary refreshes in flight, one per session
+_summary_refreshes: Dict[str, asyncio.Task] = {}
+
+def schedule_summary_refresh(session: ChatSession, upto: int):
+    if session.id in _summary_refreshes:
+        return
+    task = background_task(refresh_chat_summary(session, upto))
+    _summary_refreshes[session.id] = task
+    task.add_done_callback(lambda _: _summary_refreshes.pop(session.id, None))
+
+async def refresh_chat_summary(session: ChatSession, upto: int):
+    """Fold turns that no longer fit the prompt into the session's rolling summary"""
+    try:
+        request_text, covered_upto = summary_request(session, upto)
+        summary = await llm.generate(
+            turn_session_id(session, "summary"), SUMMARY_SYSTEM_MESSAGE, request_text, background=True
+        )
+        
+        # Never replace a summary that already covers more of the session
+        result = await chat_sessions_collection.update_one(
+            {"id": session.id, "$or": [
+                {"summary_upto": {"$lt": covered_upto}},
+                {"summary_upto": {"$exists": False}}
+            ]},
+            {"$set": {"summary": summary, "summary_upto": covered_upto}}
+        )
+        if result.modified_count:
+            # Sessions held by a chat socket keep using this object
+            session.summary = summary
+            session.summary_upto = covered_upto
+    except Exception as e:
+        logger.error(f"Chat summary refresh failed for {session.id}: {str(e)}")
+
+@api_router.get("/chat/sessions", response_model=List[ChatSessionListItem])
 async def get_chat_sessions(current_user: UserInDB = Depends(get_current_user)):
     sessions = await chat_sessions_collection.find(
-        {"user_id": current_user.id}
+        {"user_id": current_user.id}, chat_session_reader.projection
     ).sort("updated_at", -1).to_list(50)
+    for session in sessions:
+        session["message_count"] = len(session.get("messages", []))
     
-    return [ChatSession(**session) for session in sessions]
+    if len(sessions) < 50:
+        # Top up with archived sessions; their messages load when one is opened
+        hot_ids = {session["id"] for session in sessions}
+        archived = await chat_archive.list_headers(current_user.id, 50)
+        sessions += [header for header in archived if header["id"] not in hot_ids][:50 - len(sessions)]
+    
+    return trusted_response(chat_session_list_reader, sessions)
 
 @api_router.get("/chat/sessions/{session_id}")
 async def get_chat_session(
     session_id: str,
     current_user: UserInDB = Depends(get_current_user)
 ):
-    session_doc = await chat_sessions_collection.find_one({
-        "id": session_id,
-        "user_id": current_user.id
-    })
+    try:
+        session = await chat_archive.load(session_id, current_user.id)
+    except ArchiveUnavailable as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=503, detail="This chat session is temporarily unavailable")
     
-    if not session_doc:
+    if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    return ChatSession(**session_doc)
+    return session
+
+# ============= Chat WebSocket =============
+@api_router.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket, token: Optional[str] = None):
+    """Persistent chat connection; see chat_socket.py for the frame protocol"""
+    await websocket.accept()
+    try:
+        if token is None:
+            # Browsers can't set headers on a WebSocket: accept the token as the first frame too
+            frame = json.loads(await asyncio.wait_for(websocket.receive_text(), WS_AUTH_TIMEOUT_SECONDS))
+            token = frame.get("token") if frame.get("type") == "auth" else None
+        if not token:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        user, claims = await authenticate_token(token)
+    except (HTTPException, asyncio.TimeoutError, ValueError, AttributeError, WebSocketDisconnect):
+        await websocket.close(code=CLOSE_UNAUTHORIZED)
+        return
+    
+    connection = ChatConnection(websocket, user, datetime.utcfromtimestamp(claims["exp"]) if "exp" in claims else None)
+    connection.start()
+    chat_connections.add(connection)
+    await connection.send({"type": "ready", "user_id": user.id})
+    try:
+        while True:
+            text = await websocket.receive_text()
+            connection.touch()
+            try:
+                frame = json.loads(text)
+                frame_type = frame.get("type")
+            except (ValueError, AttributeError):
+                connection.try_send({"type": "error", "status": 400, "detail": "Frames must be JSON objects"})
+                continue
+            
+            if frame_type == "ping":
+                connection.try_send({"type": "pong"})
+            elif frame_type in ("pong", "typing"):
+                pass  # only keeps the connection alive
+            elif frame_type == "cancel":
+                connection.cancel_reply()
+            elif frame_type == "message":
+                if not lifecycle.accepting:
+                    connection.try_send({
+                        "type": "error", "id": frame.get("id"), "status": 503,
+                        "detail": "Server is restarting, please reconnect and resend"
+                    })
+                elif connection.busy:
+                    connection.try_send({
+                        "type": "error", "id": frame.get("id"), "status": 409,
+                        "detail": "A reply is still in progress"
+                    })
+                else:
+                    connection.reply_task = asyncio.create_task(reply_over_socket(connection, frame))
+            else:
+                connection.try_send({"type": "error", "status": 400, "detail": f"Unknown frame type: {frame_type}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        chat_connections.discard(connection)
+        await connection.close()
+
+async def socket_session(connection: ChatConnection, chat_request: ChatRequest, new_session: bool) -> ChatSession:
+    """The connection's current session, switching only when the client asks for another"""
+    session = connection.session
+    if session and not new_session and chat_request.session_id in (None, session.id):
+        return session
+    
+    session = None
+    if chat_request.session_id and not new_session:
+        session = await chat_archive.load_for_update(chat_request.session_id, connection.user.id)
+    if session is None:
+        session = ChatSession(user_id=connection.user.id, subject=chat_request.subject, topic=chat_request.topic)
+    connection.session = session
+    return session
+
+async def reply_over_socket(connection: ChatConnection, frame: dict):
+    message_id = frame.get("id")
+    try:
+        chat_request = ChatRequest(**{k: v for k, v in frame.items() if k not in ("type", "id", "new_session")})
+    except ValidationError as e:
+        await connection.send({"type": "error", "id": message_id, "status": 422, "detail": e.errors()})
+        return
+    
+    session = None
+    saved = False
+    user_message = ChatMessage(role="user", content=chat_request.message)
+    try:
+        session = await socket_session(connection, chat_request, bool(frame.get("new_session")))
+        await connection.send({"type": "session", "id": message_id, "session_id": session.id})
+        session.messages.append(user_message)
+        
+        ai_response_text, prompt = await answer_chat(chat_request, session)
+        
+        # LlmChat returns whole replies; chunking keeps the client protocol ready for token streaming
+        for chunk in iter_chunks(ai_response_text):
+            await connection.send({"type": "chunk", "id": message_id, "delta": chunk})
+        
+        ai_message = ChatMessage(role="assistant", content=ai_response_text)
+        session.messages.append(ai_message)
+        session.updated_at = datetime.utcnow()
+        
+        # One append write; the header is only written when the session is new
+        await chat_sessions_collection.update_one(
+            {"id": session.id},
+            {
+                "$push": {"messages": {"$each": [user_message.dict(), ai_message.dict()]}},
+                "$set": {"updated_at": session.updated_at},
+                "$setOnInsert": session.dict(include={"user_id", "subject", "topic", "created_at"}),
+            },
+            upsert=True
+        )
+        saved = True
+        await connection.send({"type": "done", "id": message_id, "session_id": session.id})
+        
+        if prompt and prompt.needs_summary_refresh(session):
+            schedule_summary_refresh(session, prompt.compactable_upto)
+        
+    except asyncio.CancelledError:
+        if not saved:
+            discard_unsaved_turn(session, user_message)
+            connection.try_send({"type": "cancelled", "id": message_id})
+        raise
+    except llm.LlmUnavailable as e:
+        logger.warning(f"Chat degraded: {str(e)}")
+        discard_unsaved_turn(session, user_message)
+        await connection.send({
+            "type": "error", "id": message_id, "status": 503,
+            "detail": CHAT_DEGRADED_MESSAGE, "retry_after": max(1, round(e.retry_after))
+        })
+    except ArchiveUnavailable as e:
+        logger.error(str(e))
+        await connection.send({
+            "type": "error", "id": message_id, "status": 503, "detail": "This chat session is temporarily unavailable"
+        })
+    except Exception as e:
+        logger.error(f"Chat socket error: {str(e)}")
+        if not saved:
+            discard_unsaved_turn(session, user_message)
+        await connection.send({"type": "error", "id": message_id, "status": 500, "detail": "Error processing chat"})
+
+def discard_unsaved_turn(session: Optional[ChatSession], user_message: ChatMessage):
+    """Drop a turn that was never written from the connection's copy of the session"""
+    if session is None:
+        return
+    for index in range(len(session.messages) - 1, -1, -1):
+        if session.messages[index] is user_message:
+            del session.messages[index:]
+            break
 
 # ============= Progress Tracking =============
 async def update_topic_progress(
@@ -423,13 +875,32 @@ async def update_topic_progress(
         )
         await topic_progress_collection.insert_one(progress.dict())
 
+async def load_progress_docs(user_id: str) -> List[dict]:
+    """All topic progress for a user, fetched once per batch however many sub-requests need it"""
+    return await memoized(
+        ("progress", user_id),
+        lambda: topic_progress_collection.find({"user_id": user_id}, progress_reader.projection).to_list(1000)
+    )
+
 @api_router.get("/progress")
 async def get_progress(current_user: UserInDB = Depends(get_current_user)):
-    progress_docs = await topic_progress_collection.find(
-        {"user_id": current_user.id}
-    ).to_list(100)
+    progress_docs = await load_progress_docs(current_user.id)
     
-    return [TopicProgress(**doc) for doc in progress_docs]
+    return trusted_response(progress_reader, progress_docs[:100])
+
+@api_router.post("/progress/heartbeat", status_code=202)
+async def record_study_heartbeat(
+    heartbeat: StudyHeartbeat,
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Report video watch or reading time; coalesced in memory and flushed in batches"""
+    heartbeat_coalescer.record(
+        (current_user.id, heartbeat.subject, heartbeat.topic),
+        heartbeat.stream.value,
+        heartbeat.class_level,
+        heartbeat.seconds
+    )
+    return {"accepted": True}
 
 @api_router.get("/progress/{subject}")
 async def get_subject_progress(
@@ -447,9 +918,7 @@ async def get_subject_progress(
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: UserInDB = Depends(get_current_user)):
     # Get all progress
-    progress_docs = await topic_progress_collection.find(
-        {"user_id": current_user.id}
-    ).to_list(1000)
+    progress_docs = await load_progress_docs(current_user.id)
     
     # Get quiz attempts
     quiz_attempts = await quiz_attempts_collection.find(
@@ -490,6 +959,55 @@ async def get_dashboard_stats(current_user: UserInDB = Depends(get_current_user)
         "subject_stats": subject_stats
     }
 
+# ============= Background Jobs =============
+@api_router.post("/jobs", response_model=Job)
+async def create_job(job_data: JobCreate, current_user: UserInDB = Depends(get_current_user)):
+    if current_user.role not in [UserRole.ADMIN, UserRole.TEACHER]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if job_data.type not in job_runner.handlers:
+        raise HTTPException(status_code=400, detail=f"Unknown job type: {job_data.type}")
+    try:
+        job_runner.validate(job_data.type, job_data.params)
+    except JobParamsInvalid as e:
+        raise HTTPException(status_code=400, detail=f"Invalid params for {job_data.type}: {str(e)}")
+    
+    return await job_runner.enqueue(Job(**job_data.dict(), created_by=current_user.id))
+
+@api_router.get("/jobs")
+async def get_jobs(
+    status: Optional[JobStatus] = None,
+    current_user: UserInDB = Depends(get_current_user)
+):
+    if current_user.role not in [UserRole.ADMIN, UserRole.TEACHER]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    query = {}
+    if status:
+        query["status"] = status
+    
+    jobs = await jobs_collection.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
+    return [Job(**job) for job in jobs]
+
+@api_router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str, current_user: UserInDB = Depends(get_current_user)):
+    if current_user.role not in [UserRole.ADMIN, UserRole.TEACHER]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    job_doc = await jobs_collection.find_one({"id": job_id}, {"_id": 0})
+    if not job_doc:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return Job(**job_doc)
+
+@api_router.post("/jobs/{job_id}/cancel", response_model=Job)
+async def cancel_job(job_id: str, current_user: UserInDB = Depends(get_current_user)):
+    if current_user.role not in [UserRole.ADMIN, UserRole.TEACHER]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    job_doc = await job_runner.cancel(job_id)
+    if not job_doc:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return Job(**job_doc)
+
 # ============= Content Metadata Routes =============
 @api_router.get("/metadata/subjects")
 async def get_subjects(stream: Optional[str] = None, class_level: Optional[int] = None):
@@ -515,6 +1033,57 @@ async def get_topics(subject: str, stream: Optional[str] = None, class_level: Op
     topics = await books_collection.distinct("topic", query)
     return {"topics": sorted(topics)}
 
+# ============= Batch Reads =============
+MAX_BATCH_REQUESTS = int(os.getenv("MAX_BATCH_REQUESTS", "20"))
+
+batch_dispatcher = BatchDispatcher(api_router.routes, [
+    get_me, get_dashboard_stats, get_progress, get_subject_progress,
+    get_chat_sessions, get_chat_session,
+    get_books, get_book, get_videos, get_video, get_quizzes,
+    get_subjects, get_topics,
+])
+
+@api_router.post("/batch")
+async def batch_reads(batch: BatchRequest, current_user: UserInDB = Depends(get_current_user)):
+    """Run several read requests in one round trip; each result carries its own status and body"""
+    if len(batch.requests) > MAX_BATCH_REQUESTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_REQUESTS} requests per batch")
+    
+    body = await batch_dispatcher.run(batch.requests, current_user)
+    return Response(body, media_type="application/json")
+
+# ============= Admin Profiling =============
+@api_router.post("/admin/profile")
+async def profile_worker(
+    seconds: float = 10,
+    interval_ms: float = 5,
+    route: Optional[str] = None,
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Sample this worker's stacks for a while and return them in collapsed (flamegraph) format
+
+    With route set (a template such as /api/dashboard/stats), only samples taken
+    while the event loop was serving that route are kept.
+    """
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    try:
+        profile = await profiler.run(seconds, interval_ms, route)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+    
+    logger.info(f"Profiled {profile.duration:.1f}s ({profile.mode}), {profile.samples} samples, route={route or 'all'}")
+    return Response(
+        profile.collapsed(),
+        media_type="text/plain",
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{int(profile.started)}.collapsed"',
+            "X-Profile-Samples": str(profile.samples),
+            "X-Profile-Mode": profile.mode,
+        }
+    )
+
 # ============= Root & Health Check =============
 @api_router.get("/")
 async def root():
@@ -522,8 +1091,27 @@ async def root():
 
 @api_router.get("/health")
 async def health_check():
+    """Liveness: the process is up and serving; never touches dependencies"""
     return {"status": "healthy"}
 
+@api_router.get("/ready")
+async def readiness_check():
+    """Readiness: warmed up, not draining and MongoDB answering; see lifecycle.py"""
+    ready, checks = await lifecycle.readiness()
+    return JSONResponse({"status": "ready" if ready else "not_ready", "checks": checks}, status_code=200 if ready else 503)
+
+# ============= Metrics =============
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return metrics_response()
+
+queue_depth.labels("quiz_write_behind").set_function(lambda: quiz_write_behind.depth if quiz_write_behind else 0)
+queue_depth.labels("heartbeats").set_function(lambda: heartbeat_coalescer.depth)
+queue_depth.labels("jobs_running").set_function(lambda: job_runner.depth)
+queue_depth.labels("chat_connections").set_function(lambda: chat_connections.depth)
+queue_depth.labels("llm_in_use").set_function(lambda: llm.llm_budget.in_use)
+queue_depth.labels("llm_waiting").set_function(lambda: llm.llm_budget.interactive_waiting)
+
 # Include router in app
 app.include_router(api_router)
 
@@ -534,15 +1122,68 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
+# Compression and MessagePack negotiation
+app.add_middleware(EncodingMiddleware)
+
+# In-flight request count for draining; turns new work away once shutdown starts
+app.add_middleware(LifecycleMiddleware)
+
+# Request task -> route mapping for route-filtered profiles
+app.add_middleware(ProfilerMiddleware)
+
+# Trace ids, sampled span trees and the slow-request log
+app.add_middleware(TracingMiddleware)
+
+# Per-route latency and status counts; outermost so it times the whole stack
+app.add_middleware(MetricsMiddleware)
+
+# Long-running background loops owned by this worker
+background_tasks = set()
+
+# Warm-up before ready, and what a drain waits for (see lifecycle.py)
+MONGO_WARM_CONNECTIONS = int(os.getenv("MONGO_WARM_CONNECTIONS", "10"))
+ANSWER_KEY_WARM_COUNT = int(os.getenv("ANSWER_KEY_WARM_COUNT", "500"))
+
+# Unique indexes back idempotent writes; index builds get no deadline
+lifecycle.warm_up("indexes", bootstrap_indexes, required=True, timeout=None)
+lifecycle.warm_up("mongo_pool", lambda: warm_pool(MONGO_WARM_CONNECTIONS))
+lifecycle.warm_up("taxonomy", taxonomy_cache.refresh)
+lifecycle.warm_up("answer_keys", lambda: answer_key_cache.warm(ANSWER_KEY_WARM_COUNT))
+lifecycle.warm_up("llm_sdk", llm.llm_clients.preload)
+lifecycle.probe("mongo", lambda: mongo_client.admin.command("ping"))
+lifecycle.on_drain(job_runner.pause)
+lifecycle.busy("chat_replies", lambda: chat_connections.replies_in_flight)
+lifecycle.busy("jobs", lambda: job_runner.depth)
+lifecycle.busy("llm_calls", lambda: llm.llm_budget.in_use)
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
-    await init_db()
-    logger.info("Database initialized")
+    if quiz_write_behind:
+        await quiz_write_behind.start()
+        logger.info("Quiz write-behind buffer started")
+    heartbeat_coalescer.start()
+    background_tasks.add(start_retrieval_sync())
+    await llm.llm_clients.start()
+    job_runner.start()
+    chat_connections.start()
+    lifecycle.start()
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down...")
+    await lifecycle.drain()  # already done when SIGTERM started it
+    await chat_connections.stop(CLOSE_SERVICE_RESTART)
+    for task in background_tasks:
+        task.cancel()
+    await job_runner.stop()
+    await llm.llm_clients.close()
+    await heartbeat_coalescer.stop()
+    if quiz_write_behind:
+        await quiz_write_behind.stop()
+    mongo_client.close()
+    lifecycle.stopped()
@@ -0,0 +1,121 @@
+"""
+Stored topic summaries for "summary" chat requests.
+
+Summaries are keyed by (subject, topic, stream, class_level, model_version), so
+a request is served with one indexed read. Entries older than
+SUMMARY_FRESH_SECONDS are still served but refreshed in the background
+(stale-while-revalidate); misses are generated once and stored, with
+concurrent requests for the same topic sharing that single generation.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, NamedTuple, Optional
+import asyncio
+import logging
+import os
+import re
+
+import llm
+from catalog import taxonomy_cache
+from database import topic_summaries_collection
+from tracing import background_task
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT_VERSION = "v1"
+SUMMARY_MODEL_VERSION = f"{llm.LLM_PROVIDER}/{llm.LLM_MODEL}/{SUMMARY_PROMPT_VERSION}"
+SUMMARY_FRESH_SECONDS = int(os.getenv("SUMMARY_FRESH_SECONDS", str(7 * 24 * 3600)))
+
+TOPIC_SUMMARY_SYSTEM_MESSAGE = (
+    "You are an expert AI tutor. Provide clear, concise summaries of educational topics. Focus on "
+    "key concepts and make them easy to understand for students."
+)
+
+_SUMMARY_REQUEST_RE = re.compile(
+    r"^(please\s+)?((give|write|provide)\s+(me\s+)?(a\s+)?)?(summary|summarize|summarise|overview)"
+    r"(\s+(of|on|for|about))?(\s+the)?(\s+topic)?\s*"
+)
+
+class SummaryKey(NamedTuple):
+    subject: str
+    topic: str
+    stream: str
+    class_level: int
+
+def is_summary_request(message: str, topic: str) -> bool:
+    """True for requests that only ask for the topic summary, e.g. 'Summarize Optics' or just 'Optics'"""
+    normalized = " ".join(message.lower().strip(" .?!").split())
+    remainder = _SUMMARY_REQUEST_RE.sub("", normalized, count=1).strip(" :.-")
+    return remainder in ("", topic.lower().strip())
+
+def _query(key: SummaryKey) -> dict:
+    return {**key._asdict(), "model_version": SUMMARY_MODEL_VERSION}
+
+async def resolve_key(
+    subject: str, topic: str, stream: Optional[str] = None, class_level: Optional[int] = None
+) -> Optional[SummaryKey]:
+    """Fill in stream/class_level from the stored summaries when the request is unambiguous"""
+    if stream and class_level:
+        return SummaryKey(subject, topic, stream, class_level)
+
+    query = {"subject": subject, "topic": topic, "model_version": SUMMARY_MODEL_VERSION}
+    if stream:
+        query["stream"] = stream
+    if class_level:
+        query["class_level"] = class_level
+    docs = await topic_summaries_collection.find(query, {"_id": 0, "stream": 1, "class_level": 1}).to_list(2)
+    if not docs:
+        # Nothing stored yet: fall back to the catalog taxonomy
+        docs = await taxonomy_cache.lookup(stream, class_level, subject, topic)
+    if len(docs) != 1:
+        return None
+    return SummaryKey(subject, topic, docs[0]["stream"], docs[0]["class_level"])
+
+async def generate_summary(key: SummaryKey, background: bool = False) -> str:
+    """Generate and store the summary for a topic"""
+    prompt = (
+        f"Summarize the topic '{key.topic}' in {key.subject} for a {key.stream} class {key.class_level} student."
+    )
+    content = await llm.generate(
+        f"summary-{key.stream}-{key.class_level}-{key.subject}-{key.topic}",
+        TOPIC_SUMMARY_SYSTEM_MESSAGE,
+        prompt,
+        background=background
+    )
+    await topic_summaries_collection.update_one(
+        _query(key),
+        {"$set": {"content": content, "generated_at": datetime.utcnow()}},
+        upsert=True
+    )
+    return content
+
+def is_fresh(doc: dict) -> bool:
+    return doc["generated_at"] > datetime.utcnow() - timedelta(seconds=SUMMARY_FRESH_SECONDS)
+
+class SummaryStore:
+    def __init__(self):
+        self._generating: Dict[SummaryKey, asyncio.Task] = {}
+
+    def _generate_once(self, key: SummaryKey, background: bool) -> asyncio.Task:
+        task = self._generating.get(key)
+        if task is None:
+            task = background_task(generate_summary(key, background))
+            self._generating[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        return task
+
+    def _on_done(self, key: SummaryKey, task: asyncio.Task):
+        self._generating.pop(key, None)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Summary generation failed for {key}: {str(task.exception())}")
+
+    async def get(self, key: SummaryKey) -> str:
+        doc = await topic_summaries_collection.find_one(_query(key), {"_id": 0, "content": 1, "generated_at": 1})
+        if doc:
+            if not is_fresh(doc):
+                # Serve what we have and refresh behind the request
+                self._generate_once(key, background=True)
+            return doc["content"]
+
+        return await asyncio.shield(self._generate_once(key, background=False))
+
+summary_store = SummaryStore()
@@ -0,0 +1,190 @@
+"""
+Lightweight request tracing with a slow-operation log.
+
+TracingMiddleware gives every HTTP request a trace id, taken from an incoming
+X-Trace-Id header when it looks sane and echoed back on the response. A
+TRACE_SAMPLE_RATE share of requests (plus any request that arrives with
+X-Trace-Sampled: 1) also records a span tree: span() opens a nested span in
+the current context, and record() attaches an already-timed leaf such as a
+Mongo call or a single LLM attempt. Outside a sampled request both are a
+single contextvar lookup.
+
+A request slower than TRACE_SLOW_MS, or a sampled request containing a span
+slower than TRACE_SLOW_SPAN_MS, is written to the slow log as one JSON line.
+The line carries the span tree when the request was sampled and only the
+request timing otherwise. The slow log goes to TRACE_SLOW_LOG_PATH when that
+is set, and to the "slow_requests" logger otherwise.
+
+Outbound HTTP clients install inject_trace_headers as an httpx request hook,
+so provider calls carry the request's X-Trace-Id (and X-Trace-Sampled when the
+request is sampled). Work that outlives the request is started with
+background_task(), which keeps the trace id for correlation but drops the
+current span, so a refresh running after the response never appends to a
+trace that has already been written.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Any, Coroutine, Dict, List, Optional
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+import uuid
+
+from starlette.datastructures import Headers
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+TRACE_SLOW_SPAN_MS = float(os.getenv("TRACE_SLOW_SPAN_MS", "1000"))
+TRACE_SLOW_LOG_PATH = os.getenv("TRACE_SLOW_LOG_PATH", "")
+TRACE_HEADER = "x-trace-id"
+TRACE_SAMPLED_HEADER = "x-trace-sampled"
+
+TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+slow_log = logging.getLogger("slow_requests")
+if TRACE_SLOW_LOG_PATH:
+    _handler = logging.FileHandler(TRACE_SLOW_LOG_PATH)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    slow_log.addHandler(_handler)
+    slow_log.propagate = False
+    slow_log.setLevel(logging.INFO)
+
+class Span:
+    __slots__ = ("name", "started", "duration", "attrs", "children")
+
+    def __init__(self, name: str, started: float, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.started = started
+        self.duration: Optional[float] = None
+        self.attrs = attrs or {}
+        self.children: List["Span"] = []
+
+    def slowest(self) -> float:
+        """Longest duration among the descendants, in seconds"""
+        return max((max(child.duration or 0, child.slowest()) for child in self.children), default=0)
+
+    def to_dict(self, origin: float) -> dict:
+        node = {
+            "name": self.name,
+            "start_ms": round((self.started - origin) * 1000, 2),
+            "duration_ms": round((self.duration or 0) * 1000, 2),
+        }
+        if self.attrs:
+            node["attrs"] = self.attrs
+        if self.children:
+            node["children"] = [child.to_dict(origin) for child in self.children]
+        return node
+
+trace_id_var: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def current_trace_id() -> Optional[str]:
+    return trace_id_var.get()
+
+@contextmanager
+def span(name: str, **attrs):
+    """Nested span under the current one; a no-op outside a sampled request"""
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, time.perf_counter(), attrs)
+    parent.children.append(child)
+    token = current_span.set(child)
+    try:
+        yield child
+    finally:
+        child.duration = time.perf_counter() - child.started
+        current_span.reset(token)
+
+def record(name: str, started: float, duration: float, **attrs):
+    """Attach a finished leaf span (perf_counter start and seconds) to the current span"""
+    parent = current_span.get()
+    if parent is None:
+        return
+    leaf = Span(name, started, attrs)
+    leaf.duration = duration
+    parent.children.append(leaf)
+
+def trace_headers() -> Dict[str, str]:
+    """Headers that carry the current trace to an outbound call; empty outside a request"""
+    trace_id = trace_id_var.get()
+    if trace_id is None:
+        return {}
+    headers = {TRACE_HEADER: trace_id}
+    if current_span.get() is not None:
+        headers[TRACE_SAMPLED_HEADER] = "1"
+    return headers
+
+async def inject_trace_headers(request):
+    """httpx request event hook adding trace_headers() to every outbound request"""
+    for name, value in trace_headers().items():
+        request.headers.setdefault(name, value)
+
+def background_task(coro: Coroutine, name: Optional[str] = None) -> asyncio.Task:
+    """asyncio.create_task for work that may outlive the current request
+
+    The task keeps the trace id but starts without a current span.
+    """
+    context = copy_context()
+    context.run(current_span.set, None)
+    return asyncio.create_task(coro, name=name, context=context)
+
+def _write_slow(entry: dict):
+    slow_log.warning(json.dumps(entry, default=str))
+
+class TracingMiddleware:
+    def __init__(self, app, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        trace_id = headers.get(TRACE_HEADER, "")
+        if not TRACE_ID_PATTERN.match(trace_id):
+            trace_id = uuid.uuid4().hex
+        sampled = headers.get(TRACE_SAMPLED_HEADER) == "1" or random.random() < self.sample_rate
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-trace-id", trace_id.encode())]
+            await send(message)
+
+        root = Span("request", time.perf_counter())
+        trace_token = trace_id_var.set(trace_id)
+        span_token = current_span.set(root) if sampled else None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            root.duration = time.perf_counter() - root.started
+            if span_token is not None:
+                current_span.reset(span_token)
+            trace_id_var.reset(trace_token)
+
+            slow = root.duration * 1000 >= TRACE_SLOW_MS
+            if slow or (sampled and root.slowest() * 1000 >= TRACE_SLOW_SPAN_MS):
+                route = scope.get("route")
+                root.attrs = {
+                    "method": scope["method"],
+                    "route": getattr(route, "path", None) or scope["path"],
+                    "status": status,
+                }
+                _write_slow({
+                    "trace_id": trace_id,
+                    "ts": time.time(),
+                    "duration_ms": round(root.duration * 1000, 2),
+                    "sampled": sampled,
+                    "trace": root.to_dict(root.started),
+                })
@@ -0,0 +1,241 @@
+"""
+Optional write-behind buffer for quiz attempts and their progress updates.
+
+Submissions are acknowledged once they are appended (and fsync'd, in groups) to
+a local spill segment. A background flusher then writes everything buffered so
+far to Mongo with one bulk_write per collection, every WRITE_BEHIND_FLUSH_MS or
+as soon as WRITE_BEHIND_MAX_OPS records are waiting. Segments are deleted only
+after their records reach Mongo and are replayed on the next start otherwise.
+
+Replays are exactly-once for attempts (unique attempt id) and at-least-once for
+progress, which can double count only if a crash lands between the Mongo write
+and the segment delete.
+"""
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+from pathlib import Path
+from typing import List, Optional
+import asyncio
+import json
+import logging
+import os
+import time
+
+from database import quiz_attempts_collection, topic_progress_collection
+from models import QuizAttempt
+from progress import merge_quiz_scores, quiz_progress_updates
+from tracing import background_task
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = os.getenv("QUIZ_WRITE_BEHIND", "false").lower() == "true"
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))
+WRITE_BEHIND_MAX_OPS = int(os.getenv("WRITE_BEHIND_MAX_OPS", "500"))
+WRITE_BEHIND_SPILL_DIR = Path(os.getenv("WRITE_BEHIND_SPILL_DIR", Path(__file__).parent / "spill"))
+
+def _append_and_sync(handle, lines: List[str]):
+    handle.write("".join(lines))
+    handle.flush()
+    os.fsync(handle.fileno())
+
+def _read_segment(path: Path) -> List[dict]:
+    records = []
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Torn final write from a crash; everything before it was fsync'd
+                logger.warning(f"Skipping unreadable record in {path.name}")
+    return records
+
+class QuizWriteBehind:
+    """Group-commit buffer for quiz attempts backed by append-only spill segments"""
+
+    def __init__(
+        self,
+        spill_dir: Path = WRITE_BEHIND_SPILL_DIR,
+        flush_interval_ms: int = WRITE_BEHIND_FLUSH_MS,
+        max_ops: int = WRITE_BEHIND_MAX_OPS
+    ):
+        self.spill_dir = Path(spill_dir)
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_ops = max_ops
+
+        self._unsynced: List[tuple] = []  # (line, record, future) awaiting fsync
+        self._durable: List[dict] = []  # fsync'd, not yet in Mongo
+        self._pending_segments: List[Path] = []  # segments holding durable records
+
+        self._segment = None
+        self._segment_path: Optional[Path] = None
+        self._segment_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._sync_wakeup = asyncio.Event()
+        self._flush_wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    @property
+    def depth(self) -> int:
+        """Records accepted but not yet written to Mongo"""
+        return len(self._unsynced) + len(self._durable)
+
+    async def start(self):
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+
+        # Replay whatever a previous process left behind before taking new work
+        leftovers = sorted(self.spill_dir.glob("segment-*.jsonl"))
+        for path in leftovers:
+            self._durable.extend(_read_segment(path))
+            self._pending_segments.append(path)
+        if leftovers:
+            logger.info(f"Replaying {len(self._durable)} buffered quiz attempts from {len(leftovers)} segments")
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind replay failed, will retry: {str(e)}")
+
+        self._open_segment()
+        self._stopping = False
+        self._tasks = [
+            background_task(self._sync_loop()),
+            background_task(self._flush_loop()),
+        ]
+
+    async def stop(self):
+        """Stop the background loops and write out everything still buffered
+
+        The loops are not cancelled: a group being fsync'd or a flush being
+        written finishes first, so no submitter is left waiting and no record
+        is dropped between the segment and Mongo.
+        """
+        self._stopping = True
+        self._sync_wakeup.set()
+        self._flush_wakeup.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        await self._sync_once()
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Write-behind final flush failed, {self.depth} attempts stay spilled for replay: {str(e)}")
+        if self._segment:
+            self._segment.close()
+            self._segment = None
+            # Only an empty segment may go; anything else is replayed on the next start
+            if self._segment_path not in self._pending_segments and not self._unsynced:
+                self._segment_path.unlink(missing_ok=True)
+
+    async def submit(self, attempt: QuizAttempt, stream: str, class_level: int, subject: str, topic: str):
+        """Buffer an attempt; returns once it is durable in the local spill file"""
+        record = {
+            "attempt": attempt.dict(),
+            "stream": stream,
+            "class_level": class_level,
+            "subject": subject,
+            "topic": topic,
+        }
+        line = json.dumps(record, default=str) + "\n"
+        future = asyncio.get_running_loop().create_future()
+        self._unsynced.append((line, record, future))
+        self._sync_wakeup.set()
+        await future
+
+    def _open_segment(self):
+        self._segment_path = self.spill_dir / f"segment-{time.time_ns()}.jsonl"
+        self._segment = open(self._segment_path, "a", encoding="utf-8")
+
+    async def _sync_loop(self):
+        while not self._stopping:
+            await self._sync_wakeup.wait()
+            self._sync_wakeup.clear()
+            await self._sync_once()
+
+    async def _sync_once(self):
+        """Append every waiting record with a single fsync, then acknowledge them"""
+        if not self._unsynced:
+            return
+
+        async with self._segment_lock:
+            group, self._unsynced = self._unsynced, []
+            try:
+                await asyncio.to_thread(_append_and_sync, self._segment, [line for line, _, _ in group])
+            except Exception as e:
+                for _, _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            if self._segment_path not in self._pending_segments:
+                self._pending_segments.append(self._segment_path)
+            for _, record, future in group:
+                self._durable.append(record)
+                if not future.done():
+                    future.set_result(None)
+
+        if len(self._durable) >= self.max_ops:
+            self._flush_wakeup.set()
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            # Wake on the interval or early once max_ops records are waiting
+            timer = asyncio.get_running_loop().call_later(self.flush_interval, self._flush_wakeup.set)
+            try:
+                await self._flush_wakeup.wait()
+            finally:
+                timer.cancel()
+            self._flush_wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed, will retry: {str(e)}")
+
+    async def flush(self):
+        """Write all durable records to Mongo and drop the segments that held them"""
+        async with self._flush_lock:
+            async with self._segment_lock:
+                if not self._durable:
+                    return
+                records, self._durable = self._durable, []
+                segments, self._pending_segments = self._pending_segments, []
+                # Rotate so new appends don't land in a segment we are about to delete
+                if self._segment and self._segment_path in segments:
+                    self._segment.close()
+                    self._open_segment()
+
+            try:
+                await self._write(records)
+            except BaseException:
+                # Also on cancellation: the records go back until a flush succeeds
+                async with self._segment_lock:
+                    self._durable[:0] = records
+                    self._pending_segments[:0] = segments
+                raise
+
+            for path in segments:
+                path.unlink(missing_ok=True)
+
+    async def _write(self, records: List[dict]):
+        attempts = [QuizAttempt(**record["attempt"]) for record in records]
+
+        try:
+            await quiz_attempts_collection.bulk_write(
+                [InsertOne(attempt.dict()) for attempt in attempts], ordered=False
+            )
+        except BulkWriteError as e:
+            # Duplicates were written by an earlier flush whose cleanup didn't finish
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+
+        merged = merge_quiz_scores(
+            (a.user_id, r["stream"], r["class_level"], r["subject"], r["topic"], a.score)
+            for a, r in zip(attempts, records)
+        )
+        if merged:
+            await topic_progress_collection.bulk_write(quiz_progress_updates(merged), ordered=False)
+
+quiz_write_behind = QuizWriteBehind() if WRITE_BEHIND_ENABLED else None
@@ -0,0 +1,20 @@
+"""
+Shared test setup. Backend modules are imported flat, the way server.py imports
+them, LLM calls always go to the local fake provider (fake_llm.py), and the
+app's Mongo client is mongomock-motor. test_query_plans.py opens its own
+connection to a real mongod when MONGO_URL points at one.
+"""
+from pathlib import Path
+import os
+import sys
+
+import motor.motor_asyncio
+from mongomock_motor import AsyncMongoMockClient
+
+BACKEND = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND))
+
+os.environ["LLM_PROVIDER"] = "fake"
+
+# Before database.py is imported, which creates the client at import time
+motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
@@ -0,0 +1,185 @@
+"""Archiving, reading back and restoring chat sessions (chat_archive.py), on mongomock"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import asyncio
+import gzip
+import json
+
+import pytest
+
+import chat_archive
+from chat_archive import ChatArchive
+from database import chat_archive_index_collection, chat_sessions_collection
+from jobs import JobParamsInvalid, job_runner
+from models import ChatMessage, ChatSession, Job
+
+USER = "user-1"
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    """An archive writing segments under tmp_path, over empty collections"""
+    async def clear():
+        await chat_sessions_collection.delete_many({})
+        await chat_archive_index_collection.delete_many({})
+
+    asyncio.run(clear())
+    archive = ChatArchive(archive_dir=tmp_path, min_idle_days=1)
+    monkeypatch.setattr(chat_archive, "chat_archive", archive)
+    return archive
+
+def add_session(idle: timedelta, user_id: str = USER, **fields) -> ChatSession:
+    updated_at = datetime.utcnow() - idle
+    session = ChatSession(
+        user_id=user_id, subject="Physics", topic="Kinematics", created_at=updated_at, updated_at=updated_at,
+        messages=[
+            ChatMessage(role="user", content="What is velocity?"),
+            ChatMessage(role="assistant", content="Speed with a direction."),
+        ],
+        **fields
+    )
+    asyncio.run(chat_sessions_collection.insert_one(session.dict()))
+    return session
+
+def cutoff(days: float = 30) -> datetime:
+    return datetime.utcnow() - timedelta(days=days)
+
+def test_archive_batch_moves_only_idle_sessions(archive, tmp_path):
+    idle = add_session(timedelta(days=40))
+    recent = add_session(timedelta(hours=1))
+
+    assert asyncio.run(archive.archive_batch(cutoff())) == (1, 1)
+
+    async def check():
+        assert await chat_sessions_collection.find_one({"id": idle.id}) is None
+        assert await chat_sessions_collection.find_one({"id": recent.id}) is not None
+        entry = await chat_archive_index_collection.find_one({"_id": idle.id})
+        assert entry["user_id"] == USER and entry["message_count"] == 2
+        return entry
+
+    entry = asyncio.run(check())
+    segment = tmp_path / entry["segment"]
+    assert segment.name.endswith(".jsonl.gz")
+    assert json.loads(gzip.decompress(segment.read_bytes()))["id"] == idle.id  # plain zcat-able stream
+
+def test_archived_session_reads_back(archive):
+    session = add_session(timedelta(days=40))
+    asyncio.run(archive.archive_batch(cutoff()))
+
+    found = asyncio.run(archive.load(session.id, USER))
+    assert found.id == session.id
+    assert [m.content for m in found.messages] == [m.content for m in session.messages]
+    assert asyncio.run(archive.load(session.id, "someone-else")) is None
+
+    headers = asyncio.run(archive.list_headers(USER, 50))
+    assert [h["id"] for h in headers] == [session.id]
+    assert "messages" not in headers[0]
+    assert headers[0]["archived"] and headers[0]["message_count"] == 2
+
+def test_session_list_tells_archived_sessions_from_empty_ones(archive):
+    import server
+
+    archived = add_session(timedelta(days=40))
+    asyncio.run(archive.archive_batch(cutoff()))
+    hot = add_session(timedelta(hours=1))
+    empty = ChatSession(user_id=USER)
+    asyncio.run(chat_sessions_collection.insert_one(empty.dict()))
+
+    response = asyncio.run(server.get_chat_sessions(current_user=SimpleNamespace(id=USER)))
+    rows = {row["id"]: row for row in json.loads(response.body)}
+
+    def shape(row):
+        return row["archived"], row["message_count"], len(row["messages"])
+
+    assert shape(rows[archived.id]) == (True, 2, 0)
+    assert shape(rows[hot.id]) == (False, 2, 2)
+    assert shape(rows[empty.id]) == (False, 0, 0)
+
+def test_load_for_update_restores_archived_session(archive):
+    session = add_session(timedelta(days=40))
+    asyncio.run(archive.archive_batch(cutoff()))
+
+    assert asyncio.run(archive.load_for_update(session.id, "someone-else")) is None
+    restored = asyncio.run(archive.load_for_update(session.id, USER))
+    assert restored.id == session.id
+
+    async def check():
+        hot = await chat_sessions_collection.find_one({"id": session.id})
+        assert len(hot["messages"]) == 2
+        assert hot["opened_at"] > cutoff(1)
+        assert await chat_archive_index_collection.find_one({"_id": session.id}) is None
+
+    asyncio.run(check())
+
+def test_load_for_update_keeps_idle_sessions_from_the_archiver(archive):
+    idle = add_session(timedelta(days=2))
+    recent = add_session(timedelta(hours=1))
+
+    asyncio.run(archive.load_for_update(idle.id, USER))
+    asyncio.run(archive.load_for_update(recent.id, USER))
+
+    async def opened_at(session_id: str):
+        return (await chat_sessions_collection.find_one({"id": session_id})).get("opened_at")
+
+    assert asyncio.run(opened_at(idle.id)) is not None
+    assert asyncio.run(opened_at(recent.id)) is None
+    # Even the shortest cutoff a job may use skips a session with a turn in progress
+    assert asyncio.run(archive.archive_batch(cutoff(1))) == (0, 0)
+
+def test_session_written_during_archiving_stays_hot(archive, monkeypatch):
+    session = add_session(timedelta(days=40))
+    index = chat_archive.chat_archive_index_collection
+
+    class ChatTurnDuringIndexWrite:
+        """A chat turn lands after the session was read, before it is deleted"""
+
+        def __getattr__(self, name):
+            return getattr(index, name)
+
+        async def bulk_write(self, requests, **kwargs):
+            await chat_sessions_collection.update_one(
+                {"id": session.id},
+                {
+                    "$push": {"messages": {"role": "user", "content": "And speed?"}},
+                    "$set": {"updated_at": datetime.utcnow()},
+                }
+            )
+            return await index.bulk_write(requests, **kwargs)
+
+    monkeypatch.setattr(chat_archive, "chat_archive_index_collection", ChatTurnDuringIndexWrite())
+    assert asyncio.run(archive.archive_batch(cutoff())) == (0, 1)
+
+    async def check():
+        hot = await chat_sessions_collection.find_one({"id": session.id})
+        assert len(hot["messages"]) == 3
+        assert await index.find_one({"_id": session.id}) is None
+
+    asyncio.run(check())
+
+def test_archive_job_runs_in_batches(archive):
+    sessions = [add_session(timedelta(days=40)) for _ in range(3)]
+    add_session(timedelta(days=5))
+    job = Job(type="chat_archive", params={"idle_days": 30, "batch_size": 2}, created_by="admin")
+    reports = []
+
+    async def report(progress, message):
+        reports.append(message)
+
+    result = asyncio.run(chat_archive.archive_idle_sessions(job, SimpleNamespace(report=report)))
+    assert result["archived"] == 3 and result["kept_hot"] == 0
+    assert reports == ["2/3 sessions", "3/3 sessions"]
+    assert asyncio.run(chat_sessions_collection.count_documents({})) == 1
+    assert all(asyncio.run(archive.find(s.id)) for s in sessions)
+
+@pytest.mark.parametrize("params", [
+    {"idle_days": 0.5},
+    {"idle_days": "soon"},
+    {"batch_size": 0},
+    {"max_sessions": -1},
+])
+def test_archive_job_rejects_invalid_params(params):
+    with pytest.raises(JobParamsInvalid):
+        job_runner.validate("chat_archive", params)
+
+def test_archive_job_accepts_defaults_and_minimum():
+    job_runner.validate("chat_archive", {})
+    job_runner.validate("chat_archive", {"idle_days": chat_archive.CHAT_ARCHIVE_MIN_IDLE_DAYS, "max_sessions": 10})
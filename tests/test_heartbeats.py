@@ -0,0 +1,127 @@
+"""Study-time heartbeat coalescing (heartbeats.py), on mongomock"""
+import asyncio
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import heartbeats
+from database import topic_progress_collection
+from heartbeats import HeartbeatCoalescer
+
+PHYSICS = ("user-1", "Physics", "Kinematics")
+CHEMISTRY = ("user-1", "Chemistry", "Atoms")
+
+@pytest.fixture(autouse=True)
+def clean():
+    asyncio.run(topic_progress_collection.delete_many({}))
+
+def minutes(key) -> int:
+    user_id, subject, topic = key
+    doc = asyncio.run(topic_progress_collection.find_one({"user_id": user_id, "subject": subject, "topic": topic}))
+    return doc["time_spent"] if doc else 0
+
+def pending_seconds(coalescer: HeartbeatCoalescer, key) -> int:
+    entry = coalescer._pending.get(key)
+    return entry[2] if entry else 0
+
+def test_whole_minutes_are_written_and_the_remainder_carried():
+    coalescer = HeartbeatCoalescer()
+    coalescer.record(PHYSICS, "CBSE", 11, 90)
+    asyncio.run(coalescer.flush())
+    assert minutes(PHYSICS) == 1
+    assert pending_seconds(coalescer, PHYSICS) == 30
+
+    coalescer.record(PHYSICS, "CBSE", 11, 40)
+    asyncio.run(coalescer.flush())
+    assert minutes(PHYSICS) == 2
+    assert pending_seconds(coalescer, PHYSICS) == 10
+
+def test_heartbeats_are_capped():
+    coalescer = HeartbeatCoalescer()
+    coalescer.record(PHYSICS, "CBSE", 11, 3600)
+    asyncio.run(coalescer.flush())
+    assert minutes(PHYSICS) == heartbeats.HEARTBEAT_MAX_SECONDS // 60
+
+def test_final_flush_drops_partial_minutes_instead_of_rounding_up():
+    coalescer = HeartbeatCoalescer()
+    coalescer.record(PHYSICS, "CBSE", 11, 61)
+    coalescer.record(CHEMISTRY, "CBSE", 11, 20)
+    asyncio.run(coalescer.flush(final=True))
+    assert minutes(PHYSICS) == 1
+    assert minutes(CHEMISTRY) == 0
+    assert coalescer.depth == 0
+
+def test_quiet_keys_stop_carrying_remainders():
+    coalescer = HeartbeatCoalescer(carry_seconds=0)
+    coalescer.record(PHYSICS, "CBSE", 11, 30)
+    asyncio.run(coalescer.flush())
+    assert coalescer.depth == 0
+
+class SlowCollection:
+    """Wraps topic_progress_collection so bulk_write is still running when stop() is called"""
+
+    def __init__(self):
+        self.writing = asyncio.Event()
+
+    async def bulk_write(self, operations, **kwargs):
+        self.writing.set()
+        await asyncio.sleep(0.05)
+        return await topic_progress_collection.bulk_write(operations, **kwargs)
+
+def test_stop_during_a_flush_loses_nothing(monkeypatch):
+    async def scenario():
+        collection = SlowCollection()
+        monkeypatch.setattr(heartbeats, "topic_progress_collection", collection)
+        coalescer = HeartbeatCoalescer(flush_interval=0.01)
+        coalescer.start()
+        coalescer.record(PHYSICS, "CBSE", 11, 120)
+        await collection.writing.wait()
+        coalescer.record(CHEMISTRY, "CBSE", 11, 60)  # arrives mid-flush
+        await coalescer.stop()
+
+    asyncio.run(scenario())
+    assert minutes(PHYSICS) == 2
+    assert minutes(CHEMISTRY) == 1
+
+class FailingCollection:
+    def __init__(self, error):
+        self.error = error
+
+    async def bulk_write(self, operations, **kwargs):
+        if isinstance(self.error, BulkWriteError):
+            # Every operation but the failed ones is applied
+            failed = {error["index"] for error in self.error.details["writeErrors"]}
+            applied = [op for index, op in enumerate(operations) if index not in failed]
+            await topic_progress_collection.bulk_write(applied, **kwargs)
+        raise self.error
+
+def test_partial_bulk_failure_retries_only_the_failed_keys(monkeypatch):
+    coalescer = HeartbeatCoalescer()
+    coalescer.record(PHYSICS, "CBSE", 11, 60)
+    coalescer.record(CHEMISTRY, "CBSE", 11, 120)
+    error = BulkWriteError({"writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"}]})
+    monkeypatch.setattr(heartbeats, "topic_progress_collection", FailingCollection(error))
+
+    with pytest.raises(BulkWriteError):
+        asyncio.run(coalescer.flush())
+    assert pending_seconds(coalescer, PHYSICS) == 0
+    assert pending_seconds(coalescer, CHEMISTRY) == 120
+
+    monkeypatch.setattr(heartbeats, "topic_progress_collection", topic_progress_collection)
+    asyncio.run(coalescer.flush())
+    assert minutes(PHYSICS) == 1
+    assert minutes(CHEMISTRY) == 2
+
+def test_failed_flush_puts_every_minute_back(monkeypatch):
+    coalescer = HeartbeatCoalescer()
+    coalescer.record(PHYSICS, "CBSE", 11, 90)
+    monkeypatch.setattr(heartbeats, "topic_progress_collection", FailingCollection(AutoReconnect("down")))
+
+    with pytest.raises(AutoReconnect):
+        asyncio.run(coalescer.flush())
+    assert pending_seconds(coalescer, PHYSICS) == 90
+
+    monkeypatch.setattr(heartbeats, "topic_progress_collection", topic_progress_collection)
+    asyncio.run(coalescer.flush())
+    assert minutes(PHYSICS) == 1
+    assert pending_seconds(coalescer, PHYSICS) == 30
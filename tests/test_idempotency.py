@@ -0,0 +1,139 @@
+"""Idempotency-Key claims, replays and stale-claim takeover (idempotency.py), on mongomock"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import idempotency
+from database import idempotency_keys_collection
+from idempotency import run_idempotent
+
+USER = "user-1"
+SCOPE = "quiz_attempt:quiz-1"
+
+@pytest.fixture(autouse=True)
+def clean(monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_SECONDS", 1.0)
+    asyncio.run(idempotency_keys_collection.delete_many({}))
+
+@pytest.fixture
+def handler():
+    """Counts its runs and returns a fresh response each time"""
+    state = SimpleNamespace(runs=0, delay=0, fail=0)
+
+    async def run():
+        state.runs += 1
+        await asyncio.sleep(state.delay)
+        if state.fail:
+            state.fail -= 1
+            raise RuntimeError("handler failed")
+        return {"attempt": state.runs}
+
+    state.run = run
+    return state
+
+def call(handler, payload=None, key="key-1"):
+    return run_idempotent(key, USER, SCOPE, payload or {"answers": [1, 2]}, handler.run)
+
+def stored(key="key-1") -> dict:
+    return asyncio.run(idempotency_keys_collection.find_one({"_id": f"{USER}:{SCOPE}:{key}"}))
+
+def test_completed_key_replays_the_stored_response(handler):
+    assert asyncio.run(call(handler)) == {"attempt": 1}
+    assert asyncio.run(call(handler)) == {"attempt": 1}
+    assert handler.runs == 1
+    assert stored()["status"] == "completed"
+
+def test_without_a_key_every_request_runs(handler):
+    asyncio.run(run_idempotent(None, USER, SCOPE, {}, handler.run))
+    asyncio.run(run_idempotent(None, USER, SCOPE, {}, handler.run))
+    assert handler.runs == 2
+
+def test_reused_key_with_a_different_body_is_rejected(handler):
+    asyncio.run(call(handler, {"answers": [1, 2]}))
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(call(handler, {"answers": [3, 3]}))
+    assert excinfo.value.status_code == 422
+    assert handler.runs == 1
+
+def test_failed_original_releases_the_key(handler):
+    handler.fail = 1
+    with pytest.raises(RuntimeError):
+        asyncio.run(call(handler))
+    assert stored() is None
+
+    assert asyncio.run(call(handler)) == {"attempt": 2}
+
+def test_concurrent_duplicates_share_one_run(handler):
+    handler.delay = 0.05
+
+    async def scenario():
+        return await asyncio.gather(call(handler), call(handler), call(handler))
+
+    assert asyncio.run(scenario()) == [{"attempt": 1}] * 3
+    assert handler.runs == 1
+
+def claimed_elsewhere(lease_until: datetime, key="key-1"):
+    """An in-progress claim held by a request on another worker"""
+    asyncio.run(idempotency_keys_collection.insert_one({
+        "_id": f"{USER}:{SCOPE}:{key}",
+        "status": "in_progress",
+        "fingerprint": idempotency.request_fingerprint({"answers": [1, 2]}),
+        "owner": "other-worker",
+        "lease_until": lease_until,
+        "expires_at": datetime.utcnow() + timedelta(days=1),
+    }))
+
+def test_stale_claim_is_taken_over(handler):
+    claimed_elsewhere(datetime.utcnow() - timedelta(seconds=1))  # that worker died mid-handler
+
+    assert asyncio.run(call(handler)) == {"attempt": 1}
+    record = stored()
+    assert record["status"] == "completed" and record["owner"] != "other-worker"
+
+def test_live_claim_is_waited_for_then_taken_over_when_it_lapses(handler):
+    claimed_elsewhere(datetime.utcnow() + timedelta(seconds=0.2))
+
+    assert asyncio.run(call(handler)) == {"attempt": 1}
+    assert handler.runs == 1
+
+def test_live_claim_past_the_wait_is_a_conflict(handler, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_SECONDS", 0.05)
+    claimed_elsewhere(datetime.utcnow() + timedelta(minutes=1))
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(call(handler))
+    assert excinfo.value.status_code == 409
+    assert handler.runs == 0
+
+def test_running_request_keeps_renewing_its_lease(handler, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_LEASE_SECONDS", 0.15)
+    handler.delay = 0.4
+
+    async def scenario():
+        original = asyncio.create_task(call(handler))
+        await asyncio.sleep(0.3)  # past the first lease
+        record = await idempotency_keys_collection.find_one({})
+        assert record["lease_until"] > datetime.utcnow()
+        assert not await idempotency._take_over(record["_id"], "another-worker")
+        return await original
+
+    assert asyncio.run(scenario()) == {"attempt": 1}
+
+def test_original_finishing_after_a_takeover_does_not_release_the_key(handler):
+    handler.delay = 0.05
+    handler.fail = 1
+
+    async def scenario():
+        original = asyncio.create_task(call(handler))
+        await asyncio.sleep(0.02)
+        # Its lease lapsed and another request took the claim over
+        await idempotency_keys_collection.update_one({}, {"$set": {"owner": "new-owner"}})
+        with pytest.raises(RuntimeError):
+            await original
+
+    asyncio.run(scenario())
+    assert stored()["owner"] == "new-owner"
@@ -0,0 +1,215 @@
+"""Deadlines, retries, hedging and the circuit breaker in llm.py, against fake_llm"""
+from collections import defaultdict
+from types import SimpleNamespace
+import asyncio
+import time
+
+import pytest
+
+import fake_llm
+import llm
+
+@pytest.fixture
+def model(monkeypatch):
+    """A model with its own breaker and latency window on a fast, reliable fake provider"""
+    monkeypatch.setattr(llm, "llm_budget", llm.LlmConcurrencyBudget())
+    monkeypatch.setattr(llm, "llm_latency", defaultdict(llm.LatencyTracker))
+    monkeypatch.setattr(llm, "llm_breakers", defaultdict(llm.CircuitBreaker))
+    monkeypatch.setattr(llm, "LLM_TIMEOUT_SECONDS", 5.0)
+    monkeypatch.setattr(llm, "LLM_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(llm, "LLM_RETRY_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(llm, "LLM_HEDGE_ENABLED", False)
+    for name, value in {"LATENCY_MS": 5, "JITTER_MS": 0, "SLOW_RATE": 0, "SLOW_MS": 2000,
+                        "FAILURE_RATE": 0, "SLOW_NEXT": 0, "FAIL_NEXT": 0}.items():
+        monkeypatch.setattr(fake_llm, name, value)
+    return llm.ModelSpec("fake", "test-model")
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Counts provider calls that reached the fake"""
+    counter = SimpleNamespace(count=0)
+    send_message = fake_llm.LlmChat.send_message
+
+    async def counting(self, message):
+        counter.count += 1
+        return await send_message(self, message)
+
+    monkeypatch.setattr(fake_llm.LlmChat, "send_message", counting)
+    return counter
+
+def generate(model, text="What is velocity?"):
+    return llm.generate("test-session", "You are a tutor.", text, model=model)
+
+def use_breaker(model, **kwargs) -> llm.CircuitBreaker:
+    breaker = llm.CircuitBreaker(**{"window": 4, "error_rate": 0.5, "cooldown": 60, **kwargs})
+    llm.llm_breakers[model] = breaker
+    return breaker
+
+def test_reply_from_fake_provider(model, calls):
+    reply = asyncio.run(generate(model, "What is velocity?"))
+    assert "What is velocity?" in reply
+    assert calls.count == 1
+
+def test_deadline_raises_unavailable(model, monkeypatch):
+    monkeypatch.setattr(llm, "LLM_TIMEOUT_SECONDS", 0.1)
+    monkeypatch.setattr(fake_llm, "LATENCY_MS", 1000)
+
+    started = time.monotonic()
+    with pytest.raises(llm.LlmUnavailable) as excinfo:
+        asyncio.run(generate(model))
+    assert time.monotonic() - started < 0.5
+    assert not excinfo.value.short_circuited
+
+def test_retryable_errors_are_retried_with_backoff(model, calls, monkeypatch):
+    ceilings = []
+    monkeypatch.setattr(llm, "random", SimpleNamespace(uniform=lambda low, high: ceilings.append(high) or 0))
+    fake_llm.FAIL_NEXT = 2
+
+    assert asyncio.run(generate(model))
+    assert calls.count == 3
+    assert ceilings == [0.01, 0.02]  # jittered delay ceiling doubles per attempt
+
+def test_gives_up_after_max_attempts(model, calls):
+    fake_llm.FAIL_NEXT = 10
+
+    with pytest.raises(llm.LlmUnavailable):
+        asyncio.run(generate(model))
+    assert calls.count == llm.LLM_MAX_ATTEMPTS
+
+def test_non_retryable_errors_are_not_retried(model, calls, monkeypatch):
+    async def bad_request(self, message):
+        calls.count += 1
+        raise ValueError("400 invalid request")
+
+    monkeypatch.setattr(fake_llm.LlmChat, "send_message", bad_request)
+    with pytest.raises(llm.LlmUnavailable):
+        asyncio.run(generate(model))
+    assert calls.count == 1
+
+def test_hedged_request_wins_over_stalled_call(model, calls, monkeypatch):
+    monkeypatch.setattr(llm, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(llm, "LLM_HEDGE_MIN_SECONDS", 0.05)
+    for _ in range(llm.LLM_HEDGE_MIN_SAMPLES):
+        llm.llm_latency[model].record(0.01)
+    fake_llm.SLOW_NEXT = 1
+
+    started = time.monotonic()
+    assert asyncio.run(generate(model))
+    assert time.monotonic() - started < 1
+    assert calls.count == 2
+
+def test_no_hedge_without_latency_samples(model, calls, monkeypatch):
+    monkeypatch.setattr(llm, "LLM_HEDGE_ENABLED", True)
+    assert llm.hedge_delay(model) is None
+    assert asyncio.run(generate(model))
+    assert calls.count == 1
+
+def test_breaker_opens_and_short_circuits(model, calls, monkeypatch):
+    monkeypatch.setattr(llm, "LLM_MAX_ATTEMPTS", 1)
+    breaker = use_breaker(model)
+    fake_llm.FAIL_NEXT = 4
+
+    async def scenario():
+        for _ in range(4):
+            with pytest.raises(llm.LlmUnavailable):
+                await generate(model)
+        assert breaker.state == "open"
+        with pytest.raises(llm.LlmUnavailable) as excinfo:
+            await generate(model)
+        return excinfo.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.short_circuited
+    assert rejected.retry_after > 0
+    assert calls.count == 4  # the short-circuited call never reached the provider
+
+def test_half_open_probe_reopens_then_closes(model, calls, monkeypatch):
+    monkeypatch.setattr(llm, "LLM_MAX_ATTEMPTS", 1)
+    breaker = use_breaker(model, cooldown=0.05)
+    for _ in range(4):
+        breaker.record_failure()
+
+    async def scenario():
+        assert breaker.state == "open"
+        await asyncio.sleep(0.06)
+        assert breaker.state == "half_open"
+
+        fake_llm.FAIL_NEXT = 1
+        with pytest.raises(llm.LlmUnavailable):
+            await generate(model)  # the probe fails
+        assert breaker.state == "open"
+
+        await asyncio.sleep(0.06)
+        assert await generate(model)  # the next probe succeeds
+        assert breaker.state == "closed"
+
+    asyncio.run(scenario())
+    assert calls.count == 2
+
+def test_cancelled_probe_frees_the_probe_slot(model):
+    breaker = use_breaker(model, cooldown=0.05)
+    for _ in range(4):
+        breaker.record_failure()
+
+    async def scenario():
+        await asyncio.sleep(0.06)
+        fake_llm.SLOW_NEXT = 1
+        probe = asyncio.create_task(generate(model))
+        await asyncio.sleep(0.01)
+        with pytest.raises(llm.LlmUnavailable) as excinfo:
+            await generate(model)  # only one probe at a time
+        assert excinfo.value.short_circuited
+
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        assert await generate(model)  # becomes the new probe and closes the breaker
+        assert breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+def test_cancelled_ordinary_call_keeps_the_probe(model):
+    breaker = use_breaker(model, cooldown=0.05)
+
+    async def scenario():
+        fake_llm.SLOW_NEXT = 2
+        ordinary = asyncio.create_task(generate(model))  # let through while closed
+        await asyncio.sleep(0.01)
+        for _ in range(4):
+            breaker.record_failure()
+        await asyncio.sleep(0.06)
+        probe = asyncio.create_task(generate(model))
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half_open"
+
+        ordinary.cancel()
+        await asyncio.gather(ordinary, return_exceptions=True)
+        with pytest.raises(llm.LlmUnavailable) as excinfo:
+            await generate(model)  # the probe is still in flight
+        assert excinfo.value.short_circuited
+
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+def test_probe_with_no_time_left_frees_the_probe_slot(model, calls, monkeypatch):
+    breaker = use_breaker(model, cooldown=0.05)
+    for _ in range(4):
+        breaker.record_failure()
+
+    async def scenario():
+        await asyncio.sleep(0.06)
+        monkeypatch.setattr(llm, "LLM_TIMEOUT_SECONDS", 0)  # e.g. spent queueing for a slot
+        with pytest.raises(llm.LlmUnavailable) as excinfo:
+            await generate(model)
+        assert "None" not in str(excinfo.value)
+        assert "deadline" in str(excinfo.value)
+        assert not excinfo.value.short_circuited
+        assert breaker.state == "half_open"
+
+        monkeypatch.setattr(llm, "LLM_TIMEOUT_SECONDS", 5.0)
+        assert await generate(model)  # the next call gets the probe
+        assert breaker.state == "closed"
+
+    asyncio.run(scenario())
+    assert calls.count == 1
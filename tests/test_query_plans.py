@@ -0,0 +1,279 @@
+"""
+Query-plan regression check: explain() every query shape the app issues.
+
+Creates the index registry (database.INDEXES) in a scratch database on a real
+mongod, runs explain (queryPlanner verbosity) for each shape in QUERY_SHAPES,
+and fails when a winning plan contains a COLLSCAN or a blocking in-memory SORT
+that the shape does not explicitly allow. When a route gains a new query, add
+its shape here and its index to database.INDEXES.
+
+The explain checks need a real mongod (mongomock has no query planner) and are
+skipped unless MONGO_URL points at one. The scratch database is dropped
+afterwards.
+
+    MONGO_URL=mongodb://localhost:27017 python -m pytest -q tests/test_query_plans.py
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Tuple
+import json
+import os
+import uuid
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from database import INDEXES
+
+NOW = datetime(2026, 1, 1)
+USER = "user-1"
+MODEL_VERSION = "provider/model/1"
+
+class QueryShape(NamedTuple):
+    name: str  # where the query comes from
+    collection: str
+    command: Dict[str, Any]  # explainable command body, minus the collection name
+    allow: Tuple[str, ...] = ()  # stages accepted for this shape, with the reason in a comment
+
+def find(filter: dict, sort: dict = None, limit: int = 0) -> dict:
+    command = {"find": None, "filter": filter}
+    if sort:
+        command["sort"] = sort
+    if limit:
+        command["limit"] = limit
+    return command
+
+def update(filter: dict, update_doc: Any, upsert: bool = False) -> dict:
+    return {"update": None, "updates": [{"q": filter, "u": update_doc, "upsert": upsert}]}
+
+def find_and_modify(filter: dict, update_doc: dict, sort: dict = None) -> dict:
+    command = {"findAndModify": None, "query": filter, "update": update_doc}
+    if sort:
+        command["sort"] = sort
+    return command
+
+def distinct(key: str, filter: dict) -> dict:
+    return {"distinct": None, "key": key, "query": filter}
+
+def aggregate(pipeline: list) -> dict:
+    return {"aggregate": None, "pipeline": pipeline, "cursor": {}}
+
+CATALOG_FILTERS = [
+    {"approved": True},
+    {"approved": True, "subject": "Physics"},
+    {"approved": True, "subject": "Physics", "topic": "Kinematics"},
+    {"approved": True, "stream": "CBSE", "class_level": 11},
+    {"approved": True, "stream": "CBSE", "class_level": 11, "subject": "Physics"},
+    {"approved": True, "stream": "CBSE", "subject": "Physics"},
+]
+
+QUERY_SHAPES: List[QueryShape] = [
+    # auth
+    QueryShape("get_current_user", "users", find({"id": USER}, limit=1)),
+    QueryShape("register/login by email", "users", find({"email": "a@example.com"}, limit=1)),
+    # catalog
+    *[QueryShape(f"get_books {sorted(f)}", "books", find(f, limit=100)) for f in CATALOG_FILTERS],
+    *[QueryShape(f"get_videos {sorted(f)}", "videos", find(f, limit=100)) for f in CATALOG_FILTERS],
+    QueryShape("get_book", "books", find({"id": "b"}, limit=1)),
+    QueryShape("get_video", "videos", find({"id": "v"}, limit=1)),
+    QueryShape("get_subjects", "books", distinct("subject", {"approved": True, "stream": "CBSE"})),
+    QueryShape("get_topics", "books", distinct("topic", {"approved": True, "subject": "Physics"})),
+    QueryShape("load_taxonomy", "books", aggregate([
+        {"$match": {"approved": True, "subject": "Physics"}},
+        {"$group": {"_id": {"stream": "$stream", "class_level": "$class_level", "subject": "$subject", "topic": "$topic"}}},
+    ])),
+    QueryShape("retrieval sync (books)", "books", find(
+        {"approved": True, "summary": {"$nin": [None, ""]}, "created_at": {"$gt": NOW}}
+    )),
+    QueryShape("retrieval sync (quizzes)", "quizzes", find({"created_at": {"$gt": NOW}})),
+    # quizzes
+    QueryShape("get_quizzes (unfiltered)", "quizzes", find({}, limit=100),
+               allow=("COLLSCAN",)),  # first 100 in natural order; stops after 100 documents
+    QueryShape("get_quizzes by subject", "quizzes", find({"subject": "Physics"}, limit=100)),
+    QueryShape("get_quizzes by cohort", "quizzes", find({"stream": "CBSE", "class_level": 11, "subject": "Physics"}, limit=100)),
+    QueryShape("start_quiz/submit_quiz", "quizzes", find({"id": "q"}, limit=1)),
+    QueryShape("answer key batch", "quizzes", find({"id": {"$in": ["q1", "q2"]}})),
+    QueryShape("attempt replays", "quiz_attempts", find(
+        {"user_id": USER, "client_attempt_id": {"$in": ["c1", "c2"]}}
+    )),
+    QueryShape("dashboard attempts", "quiz_attempts", find({"user_id": USER}, limit=1000)),
+    # progress
+    QueryShape("load_progress_docs", "topic_progress", find({"user_id": USER}, limit=1000)),
+    QueryShape("get_subject_progress", "topic_progress", find({"user_id": USER, "subject": "Physics"}, limit=100)),
+    QueryShape("progress upsert", "topic_progress", update(
+        {"user_id": USER, "subject": "Physics", "topic": "Kinematics"}, {"$inc": {"time_spent": 1}}, upsert=True
+    )),
+    # chat
+    QueryShape("get_chat_sessions", "chat_sessions", find({"user_id": USER}, sort={"updated_at": -1}, limit=50)),
+    QueryShape("get_chat_session", "chat_sessions", find({"id": "s", "user_id": USER}, limit=1)),
+    QueryShape("chat turn append", "chat_sessions", update({"id": "s"}, {"$set": {"updated_at": NOW}})),
+    # chat archive
+    QueryShape("archive candidates", "chat_sessions", find(
+        {"updated_at": {"$lt": NOW}, "opened_at": {"$not": {"$gte": NOW}}}, sort={"updated_at": 1}, limit=500
+    )),
+    QueryShape("archive still hot", "chat_sessions", distinct("id", {"id": {"$in": ["s", "t"]}})),
+    QueryShape("archived session", "chat_archive_index", find({"_id": "s", "user_id": USER}, limit=1)),
+    QueryShape("archived session list", "chat_archive_index", find({"user_id": USER}, sort={"updated_at": -1}, limit=50)),
+    # jobs
+    QueryShape("get_jobs", "jobs", find({}, sort={"created_at": -1}, limit=100)),
+    QueryShape("get_jobs by status", "jobs", find({"status": "queued"}, sort={"created_at": -1}, limit=100)),
+    QueryShape("get_job", "jobs", find({"id": "j"}, limit=1)),
+    QueryShape("job claim", "jobs", find_and_modify(
+        {
+            "type": {"$in": ["summary_warmup"]},
+            "$or": [
+                {"status": "queued", "run_after": {"$lte": NOW}},
+                {"status": "running", "heartbeat_at": {"$lt": NOW - timedelta(minutes=5)}},
+            ],
+        },
+        {"$set": {"status": "running"}},
+        sort={"run_after": 1},
+    ), allow=("SORT",)),  # both $or branches are index scans; the merged candidates are few
+    QueryShape("job report", "jobs", find_and_modify({"id": "j"}, {"$set": {"progress": 1}})),
+    QueryShape("job finish", "jobs", update({"id": "j", "worker_id": "w"}, {"$set": {"status": "succeeded"}})),
+    QueryShape("quiz drafts for job", "quiz_drafts", find({"job_id": "j"})),
+    # summaries
+    QueryShape("summary lookup", "topic_summaries", find(
+        {"subject": "Physics", "topic": "Kinematics", "stream": "CBSE", "class_level": 11, "model_version": MODEL_VERSION},
+        limit=1,
+    )),
+    QueryShape("summary resolve_key", "topic_summaries", find(
+        {"subject": "Physics", "topic": "Kinematics", "model_version": MODEL_VERSION}, limit=2
+    )),
+    QueryShape("summary warmup", "topic_summaries", find({"model_version": MODEL_VERSION})),
+    # idempotency
+    QueryShape("idempotency key", "idempotency_keys", find({"_id": "k"}, limit=1)),
+]
+
+BLOCKING_STAGES = ("COLLSCAN", "SORT")
+
+def winning_stages(explain: Any) -> List[str]:
+    """Stage names in every winning plan of an explain result (find, aggregate, write and SBE formats)"""
+    stages: List[str] = []
+
+    def walk_plan(node: Any):
+        if isinstance(node, dict):
+            if "stage" in node:
+                stages.append(node["stage"])
+            for key, value in node.items():
+                if key != "rejectedPlans":
+                    walk_plan(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk_plan(item)
+
+    def find_winning(node: Any):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "winningPlan":
+                    walk_plan(value)
+                elif key != "rejectedPlans":
+                    find_winning(value)
+        elif isinstance(node, list):
+            for item in node:
+                find_winning(item)
+
+    find_winning(explain)
+    return stages
+
+def violations(shape: QueryShape, stages: List[str]) -> List[str]:
+    return sorted({stage for stage in stages if stage in BLOCKING_STAGES and stage not in shape.allow})
+
+def seed(db):
+    """One document per collection so every collection exists and the planner has something to plan"""
+    for name in {shape.collection for shape in QUERY_SHAPES}:
+        db[name].insert_one({"id": f"seed-{name}", "user_id": "seed", "created_at": NOW})
+
+@pytest.fixture(scope="module")
+def scratch_db():
+    mongo_url = os.environ.get("MONGO_URL")
+    if not mongo_url:
+        pytest.skip("MONGO_URL is not set; query plans need a real mongod")
+    client = MongoClient(mongo_url, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        client.close()
+        pytest.skip(f"No mongod reachable at {mongo_url}")
+
+    db = client[f"query_plan_check_{uuid.uuid4().hex[:8]}"]
+    try:
+        seed(db)
+        for name, models in INDEXES.items():
+            for model in models:
+                options = {k: v for k, v in model.document.items() if k != "key"}
+                db[name].create_index(list(model.document["key"].items()), **options)
+        yield db
+    finally:
+        client.drop_database(db.name)
+        client.close()
+
+@pytest.mark.parametrize("shape", QUERY_SHAPES, ids=[f"{s.collection}: {s.name}" for s in QUERY_SHAPES])
+def test_query_shape_uses_an_index(scratch_db, shape):
+    command = {**shape.command}
+    command[next(iter(command))] = shape.collection
+    result = scratch_db.command({"explain": command, "verbosity": "queryPlanner"})
+    stages = winning_stages(result)
+    assert not violations(shape, stages), (
+        f"{' > '.join(dict.fromkeys(stages))}\n{json.dumps(result.get('queryPlanner', result), default=str, indent=2)}"
+    )
+
+# ---------- winning_stages against canned explain output ----------
+
+def test_winning_stages_classic_find_ignores_rejected_plans():
+    explain = {"queryPlanner": {
+        "winningPlan": {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}},
+        "rejectedPlans": [{"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}],
+    }}
+    assert winning_stages(explain) == ["LIMIT", "FETCH", "IXSCAN"]
+
+def test_winning_stages_slot_based_engine():
+    explain = {"queryPlanner": {
+        "winningPlan": {
+            "queryPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}},
+            "slotBasedPlan": {"slots": "$$RESULT=s5", "stages": "[2] sort [s4] [asc] ..."},
+        },
+        "rejectedPlans": [],
+    }}
+    assert winning_stages(explain) == ["SORT", "COLLSCAN"]
+
+def test_winning_stages_aggregate_cursor_stage():
+    explain = {"stages": [
+        {"$cursor": {"queryPlanner": {
+            "winningPlan": {"stage": "PROJECTION_COVERED", "inputStage": {"stage": "IXSCAN"}},
+            "rejectedPlans": [{"stage": "COLLSCAN"}],
+        }}},
+        {"$group": {"_id": "$subject"}},
+    ]}
+    assert winning_stages(explain) == ["PROJECTION_COVERED", "IXSCAN"]
+
+def test_winning_stages_write_and_find_and_modify():
+    update_explain = {"queryPlanner": {"winningPlan": {"stage": "UPDATE", "inputStage": {"stage": "IXSCAN"}}}}
+    assert winning_stages(update_explain) == ["UPDATE", "IXSCAN"]
+
+    claim_explain = {"queryPlanner": {"winningPlan": {
+        "stage": "UPDATE",
+        "inputStage": {"stage": "SORT", "inputStage": {"stage": "FETCH", "inputStage": {
+            "stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "IXSCAN"}],
+        }}},
+    }}}
+    assert winning_stages(claim_explain) == ["UPDATE", "SORT", "FETCH", "OR", "IXSCAN", "IXSCAN"]
+
+def test_winning_stages_sharded():
+    explain = {"queryPlanner": {"winningPlan": {
+        "stage": "SHARD_MERGE",
+        "shards": [
+            {"shardName": "a", "winningPlan": {"stage": "IXSCAN"}, "rejectedPlans": [{"stage": "COLLSCAN"}]},
+            {"shardName": "b", "winningPlan": {"stage": "COLLSCAN"}},
+        ],
+    }}}
+    assert winning_stages(explain) == ["SHARD_MERGE", "IXSCAN", "COLLSCAN"]
+
+def test_winning_stages_without_a_plan():
+    assert winning_stages({"ok": 1.0}) == []
+
+def test_violations_honour_allowed_stages():
+    claim = next(shape for shape in QUERY_SHAPES if shape.name == "job claim")
+    assert violations(claim, ["SORT", "FETCH", "IXSCAN"]) == []
+    assert violations(claim, ["SORT", "COLLSCAN", "COLLSCAN"]) == ["COLLSCAN"]
+    assert violations(QUERY_SHAPES[0], ["LIMIT", "FETCH", "IXSCAN"]) == []
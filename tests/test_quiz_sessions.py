@@ -0,0 +1,112 @@
+"""Attempt tokens, answer-key digests, grading and the answer-key cache (quiz_sessions.py)"""
+import asyncio
+import hashlib
+import hmac
+import itertools
+
+import pytest
+from jose import jwt
+
+from database import quizzes_collection
+from quiz_sessions import (
+    AnswerKey, AnswerKeyCache, create_attempt_token, decode_attempt_token, select_questions
+)
+
+USER = "user-1"
+
+def answer_key(answers=(2, 0, 3, 1), quiz_id="quiz-1") -> AnswerKey:
+    return AnswerKey(quiz_id, "CBSE", 11, "Physics", "Kinematics", tuple(answers))
+
+def quiz_doc(answers, quiz_id="quiz-1") -> dict:
+    return {
+        "id": quiz_id, "stream": "CBSE", "class_level": 11, "subject": "Physics", "topic": "Kinematics",
+        "questions": [{"question": f"Q{i}", "correct_answer": a} for i, a in enumerate(answers)],
+    }
+
+def test_token_round_trip():
+    key = answer_key()
+    token, _ = create_attempt_token(USER, key, [3, 1, 0, 2])
+
+    claims = decode_attempt_token(token, USER, key.quiz_id)
+    assert claims["q"] == [3, 1, 0, 2]
+    assert key.matches(claims["q"], claims["d"])
+
+def test_token_is_bound_to_user_quiz_and_signature():
+    key = answer_key()
+    token, _ = create_attempt_token(USER, key, [0, 1, 2, 3])
+
+    assert decode_attempt_token(token, "user-2", key.quiz_id) is None
+    assert decode_attempt_token(token, USER, "quiz-2") is None
+    forged = jwt.encode({**jwt.get_unverified_claims(token), "q": [0]}, "not-the-secret", algorithm="HS256")
+    assert decode_attempt_token(forged, USER, key.quiz_id) is None
+
+def test_changed_answer_key_no_longer_matches():
+    token, _ = create_attempt_token(USER, answer_key((2, 0, 3, 1)), [0, 1, 2, 3])
+    claims = decode_attempt_token(token, USER, "quiz-1")
+
+    assert not answer_key((2, 0, 3, 0)).matches(claims["q"], claims["d"])
+    assert not answer_key((2, 0, 3)).matches(claims["q"], claims["d"])  # question removed
+
+def test_token_alone_cannot_confirm_an_answer_guess():
+    key = answer_key((2, 0, 3, 1, 1, 0))
+    question_ids = list(range(len(key.answers)))
+    token, _ = create_attempt_token(USER, key, question_ids)
+    claims = jwt.get_unverified_claims(token)
+
+    def unkeyed(guess):
+        material = key.quiz_id + "|" + ",".join(f"{i}:{guess[i]}" for i in question_ids)
+        return hashlib.sha256(material.encode()).hexdigest()[:16]
+
+    def wrong_secret(guess):
+        material = key.quiz_id + "|" + ",".join(f"{i}:{guess[i]}" for i in question_ids)
+        return hmac.new(b"guessed-secret", material.encode(), hashlib.sha256).hexdigest()[:16]
+
+    guesses = list(itertools.product(range(4), repeat=len(question_ids)))
+    assert key.answers in guesses
+    assert not any(unkeyed(guess) == claims["d"] for guess in guesses)
+    assert not any(wrong_secret(guess) == claims["d"] for guess in guesses)
+
+def test_grade_follows_served_order():
+    key = answer_key((2, 0, 3, 1))
+
+    assert key.grade([2, 0, 3, 1]) == (4, 4, 100.0)
+    assert key.grade([1, 3], question_ids=[3, 2]) == (2, 2, 100.0)
+    assert key.grade([1, 0], question_ids=[3, 2]) == (1, 2, 50.0)
+    assert key.grade([1, 3, 0], question_ids=[3, 2]) == (2, 2, 100.0)  # extra answers are ignored
+    assert key.grade([], question_ids=[]) == (0, 0, 0)
+
+def test_select_questions_samples_without_repeats():
+    picked = select_questions(10, count=4)
+    assert len(picked) == 4 and len(set(picked)) == 4
+    in_order = select_questions(5, count=3, shuffle=False)
+    assert in_order == sorted(in_order)
+    assert sorted(select_questions(5)) == list(range(5))
+
+@pytest.fixture
+def quizzes():
+    async def seed():
+        await quizzes_collection.delete_many({})
+        await quizzes_collection.insert_many([quiz_doc((2, 0, 3, 1)), quiz_doc((1, 1), quiz_id="quiz-2")])
+
+    asyncio.run(seed())
+
+def test_cache_serves_stale_key_until_refreshed(quizzes):
+    cache = AnswerKeyCache(max_size=8, ttl=600)
+
+    async def scenario():
+        assert (await cache.get("quiz-1")).answers == (2, 0, 3, 1)
+        await quizzes_collection.update_one({"id": "quiz-1"}, {"$set": {"questions.3.correct_answer": 0}})
+        assert (await cache.get("quiz-1")).answers == (2, 0, 3, 1)
+        assert (await cache.get("quiz-1", refresh=True)).answers == (2, 0, 3, 0)
+        assert await cache.get("missing") is None
+
+    asyncio.run(scenario())
+
+def test_cache_get_many_loads_misses(quizzes):
+    cache = AnswerKeyCache(max_size=8, ttl=600)
+    cache.put(answer_key((3, 3, 3, 3)))  # cached entries win over the database
+
+    found = asyncio.run(cache.get_many(["quiz-1", "quiz-2", "missing", "quiz-2"]))
+    assert found["quiz-1"].answers == (3, 3, 3, 3)
+    assert found["quiz-2"].answers == (1, 1)
+    assert "missing" not in found